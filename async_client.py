@@ -0,0 +1,253 @@
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+from settings import load_env
+from logging_setup import setup_logging
+from metrics import registry as metrics, endpoint_template
+from tracing import span
+from rate_limiter import AdaptiveRateLimiter, DEFAULT_RATE, backoff_delay, parse_retry_after
+from readiness import report_readiness
+from ns_client import (DEFAULT_MAX_RETRIES, RETRY_BASE_SECONDS, RETRY_MAX_SECONDS, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT,
+                       IDEMPOTENT_METHODS, THROTTLE_STATUSES, TRANSIENT_STATUSES)
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+# Load variables from the .env file into the environment
+load_env()
+
+DEFAULT_ASYNC_IN_FLIGHT = int(os.getenv("NS_ASYNC_IN_FLIGHT", "64"))
+
+# What a failed request raises; the async provisioning functions catch these where the sync ones catch RequestException
+REQUEST_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError) if aiohttp else (asyncio.TimeoutError,)
+CONNECTION_ERRORS = (aiohttp.ClientConnectionError, asyncio.TimeoutError) if aiohttp else (asyncio.TimeoutError,)
+
+class AsyncResponse:
+    """A fully read aiohttp response with the requests.Response attributes the provisioning code uses."""
+
+    def __init__(self, status_code: int, headers, content: bytes, encoding: Optional[str] = None):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding or "utf-8"
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding, errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+def _body_size(kwargs: dict) -> int:
+    if kwargs.get("json") is not None:
+        return len(json.dumps(kwargs["json"]).encode())
+    data = kwargs.get("data")
+    size = len(data.encode() if isinstance(data, str) else data) if isinstance(data, (str, bytes)) else 0
+    for value in (kwargs.get("files") or {}).values():
+        content = value[1] if isinstance(value, tuple) else value
+        size += len(content) if isinstance(content, (str, bytes)) else 0
+    return size
+
+class AsyncNetSapiensClient:
+    """asyncio counterpart of NetSapiensClient for driving many tenants from one event loop.
+
+    Requests go through the same adaptive rate limiter, retry rules, metrics
+    and tracing spans as the sync client, on a single aiohttp session whose
+    connection pool is capped at max_in_flight. The session belongs to the
+    event loop it is first used on.
+    """
+
+    def __init__(self, api_url: str, api_token: Optional[str] = None, max_in_flight: int = DEFAULT_ASYNC_IN_FLIGHT,
+                 max_retries: int = DEFAULT_MAX_RETRIES):
+        if aiohttp is None:
+            raise ValueError("aiohttp is required for the asyncio backend (pip install aiohttp)")
+        self.api_url = api_url.rstrip('/')
+        self.api_token = api_token if api_token is not None else os.getenv("API_TOKEN")
+        self.max_in_flight = max_in_flight
+        self.timeout: Tuple[float, float] = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
+        # NS_RATE_LIMIT=0 turns the limiter off; retries still apply
+        self.limiter = AdaptiveRateLimiter() if DEFAULT_RATE > 0 else None
+        self.max_retries = max_retries
+        self.requests_sent = 0
+        self.connections_opened = 0
+        self.retries = 0
+        self.retry_exhausted = 0
+        self._session = None
+        self._in_flight: Optional[asyncio.Semaphore] = None
+        logger.info(f"Created async NetSapiens client for {self.api_url} with {max_in_flight} requests in flight")
+
+    def _open(self):
+        if self._session is None:
+            tracing = aiohttp.TraceConfig()
+            tracing.on_connection_create_end.append(self._on_connection_created)
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_in_flight, ttl_dns_cache=300),
+                headers={"accept": "application/json", "Authorization": f"Bearer {self.api_token}"},
+                timeout=aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1]),
+                trace_configs=[tracing]
+            )
+        return self._session
+
+    async def _on_connection_created(self, session, context, params) -> None:
+        self.connections_opened += 1
+
+    def url(self, path: str) -> str:
+        """Return an absolute URL for a path relative to the API host."""
+        if path.startswith(("http://", "https://")):
+            return path
+        return f"{self.api_url}/{path.lstrip('/')}"
+
+    async def _acquire(self) -> None:
+        waited = 0.0
+        while True:
+            delay = self.limiter.try_acquire()
+            if not delay:
+                self.limiter.record_wait(waited)
+                return
+            await asyncio.sleep(delay)
+            waited += delay
+
+    async def _send(self, method: str, url: str, **kwargs) -> AsyncResponse:
+        if self.limiter:
+            await self._acquire()
+        session = self._open()
+        bytes_sent = _body_size(kwargs)
+        files = kwargs.pop("files", None)
+        if files:
+            # Multipart like requests builds it: the data fields, then each file; rebuilt for every attempt
+            form = aiohttp.FormData()
+            for name, value in (kwargs.pop("data", None) or {}).items():
+                form.add_field(name, str(value))
+            for name, (filename, content, content_type) in files.items():
+                form.add_field(name, content, filename=filename, content_type=content_type)
+            kwargs["data"] = form
+        async with self._in_flight:
+            with span(f"{method.upper()} {endpoint_template(url)}", "http", url=url) as http_span:
+                started = time.perf_counter()
+                try:
+                    async with session.request(method, url, **kwargs) as raw:
+                        content = await raw.read()
+                        response = AsyncResponse(raw.status, raw.headers, content, raw.charset)
+                except REQUEST_ERRORS:
+                    metrics.record(method, url, None, time.perf_counter() - started)
+                    raise
+                self.requests_sent += 1
+                metrics.record(method, url, response.status_code, time.perf_counter() - started, bytes_sent, len(content))
+                if http_span:
+                    http_span.args["status"] = response.status_code
+                return response
+
+    async def _retry(self, method: str, url: str, attempt: int, reason: str, retry_after: Optional[float] = None) -> bool:
+        if attempt >= self.max_retries:
+            self.retry_exhausted += 1
+            logger.error(f"{method} {url} still failing after {self.max_retries} retries: {reason}")
+            return False
+        delay = max(retry_after or 0.0, backoff_delay(attempt, RETRY_BASE_SECONDS, RETRY_MAX_SECONDS))
+        self.retries += 1
+        metrics.record_retry(method, url)
+        logger.warning(f"{method} {url} {reason}, retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+        await asyncio.sleep(delay)
+        return True
+
+    async def request(self, method: str, path: str, conflict_safe: bool = False, **kwargs) -> AsyncResponse:
+        """Send a request with the same retry rules as NetSapiensClient.request."""
+        url = self.url(path)
+        retryable = method.upper() in IDEMPOTENT_METHODS or conflict_safe
+        attempt = 0
+        while True:
+            try:
+                response = await self._send(method, url, **kwargs)
+            except CONNECTION_ERRORS as e:
+                if retryable and await self._retry(method, url, attempt, f"failed ({e.__class__.__name__})"):
+                    attempt += 1
+                    continue
+                raise
+            status = response.status_code
+            if status in THROTTLE_STATUSES:
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                if self.limiter:
+                    self.limiter.on_throttle(retry_after)
+                if (status == 429 or retryable) and await self._retry(method, url, attempt, f"throttled ({status})", retry_after):
+                    attempt += 1
+                    continue
+                return response
+            if status in TRANSIENT_STATUSES and retryable and await self._retry(method, url, attempt, f"returned {status}"):
+                attempt += 1
+                continue
+            if self.limiter:
+                self.limiter.on_success()
+            return response
+
+    async def get(self, path: str, **kwargs) -> AsyncResponse:
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs) -> AsyncResponse:
+        return await self.request("POST", path, **kwargs)
+
+    async def put(self, path: str, **kwargs) -> AsyncResponse:
+        return await self.request("PUT", path, **kwargs)
+
+    def stats(self) -> Dict[str, float]:
+        """Return connection, retry and rate limiter counters, like NetSapiensClient.stats."""
+        stats = {
+            "requests": self.requests_sent,
+            "connections": self.connections_opened,
+            "reused": max(self.requests_sent - self.connections_opened, 0),
+            "retries": self.retries,
+            "retry_exhausted": self.retry_exhausted
+        }
+        if self.limiter:
+            stats.update({f"limiter_{name}": value for name, value in self.limiter.stats().items()})
+        return stats
+
+    def report(self) -> None:
+        """Print and log the connection reuse and rate limiting summary for this client."""
+        stats = self.stats()
+        ratio = (stats["reused"] / stats["requests"] * 100) if stats["requests"] else 0.0
+        message = (f"Connection reuse for {urlsplit(self.api_url).netloc} (async): {stats['requests']} requests, "
+                   f"{stats['connections']} connections opened, {stats['reused']} reused ({ratio:.1f}%)")
+        print(message)
+        logger.info(message)
+        if self.limiter or self.retries:
+            limiter = self.limiter.stats() if self.limiter else {}
+            message = (f"Rate limiting for {urlsplit(self.api_url).netloc} (async): {self.retries} retries, {self.retry_exhausted} gave up, "
+                       f"{limiter.get('throttled', 0)} throttled responses, final rate {limiter.get('rate', 'unlimited')} req/s "
+                       f"(lowest {limiter.get('lowest_rate', '-')}), {limiter.get('waited', 0)} requests waited {limiter.get('wait_seconds', 0)}s")
+            print(message)
+            logger.info(message)
+        report_readiness(self, f"{urlsplit(self.api_url).netloc} (async)")
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+# Keyed by event loop as well as host, since a session cannot outlive the loop it was opened on
+_clients: Dict[Tuple[int, str], AsyncNetSapiensClient] = {}
+
+def get_async_client(api_url: str, max_in_flight: Optional[int] = None) -> AsyncNetSapiensClient:
+    """Return the shared async client for an API URL on the running event loop, creating it on first use."""
+    key = (id(asyncio.get_running_loop()), api_url.rstrip('/'))
+    client = _clients.get(key)
+    if client is None:
+        client = AsyncNetSapiensClient(key[1], max_in_flight=max_in_flight or DEFAULT_ASYNC_IN_FLIGHT)
+        _clients[key] = client
+    return client
+
+async def close_async_clients(report: bool = True) -> None:
+    """Report on and close every shared async client opened on the running event loop."""
+    loop_id = id(asyncio.get_running_loop())
+    for key in [key for key in _clients if key[0] == loop_id]:
+        client = _clients.pop(key)
+        if report:
+            client.report()
+        await client.close()
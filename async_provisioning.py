@@ -0,0 +1,328 @@
+import asyncio
+import json
+from logging_setup import setup_logging
+from async_client import get_async_client, close_async_clients, REQUEST_ERRORS
+from ns_client import get_client
+from existence_index import ExistenceIndex
+from task_graph import TaskGraph, graph_succeeded
+from readiness import get_waiter
+from create_reseller import reseller_request, reseller_created
+from create_domain import domain_request, domain_created, domain_error
+from create_user import validate_user, user_request, user_created, user_error
+from create_device import device_request, device_created, device_error
+from create_image import (image_request, image_conflicted, image_uploaded, image_error, report_uploads, in_memory_uploads, build_variants,
+                          FILENAME_MAPPING)
+from connections import connection_request, connection_response, connection_error, THINQ_CONNECTIONS
+from routes import route_request, route_response, route_error
+from ui_configs import (configuration_payload, configuration_request, configuration_sent, configuration_result, config_scopes, load_configurations,
+                        apply_overrides, print_status_table)
+from create_training_domains import (call_queue_request, call_queue_created, call_queue_error, cached_agents, agents_request, agents_fetched, agents_error,
+                                     agent_request, agent_added, agent_error, missing_agents, check_agents_added, create_training_domains)
+from manifest import validate_manifest
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+# The index answers from memory, except for a domain's first user, device or call
+# queue lookup, which lists that domain through the sync client. apply_manifest_async
+# loads its domain in a worker thread up front so that never blocks the event loop.
+
+async def create_reseller_async(custID, reseller_name, description, api_url, client=None, index=None):
+    client = client or get_async_client(api_url)
+    request = reseller_request(reseller_name, description, api_url, index)
+    if request is None:
+        return 200
+    url, headers, data = request
+    response = await client.post(url, headers=headers, data=json.dumps(data))
+    return reseller_created(response, reseller_name, index)
+
+async def create_domain_async(custID, domain, reseller, description, dial_plan, dial_policy, area_code, caller_id_name, caller_id_number,
+                              caller_id_number_emergency, api_url, client=None, index=None):
+    api_url = api_url.rstrip('/')
+    client = client or get_async_client(api_url)
+    request = domain_request(domain, reseller, description, dial_plan, dial_policy, area_code, caller_id_name, caller_id_number, caller_id_number_emergency,
+                             api_url, index)
+    if request is None:
+        return 200
+    url, headers, data = request
+    try:
+        response = await client.post(url, headers=headers, data=json.dumps(data))
+    except REQUEST_ERRORS as e:
+        return domain_error(url, domain, e)
+    return domain_created(response, domain, index)
+
+async def create_user_async(custID, domain, api_url, client=None, index=None, extension=None, first_name=None, last_name=None, email=None,
+                            user_scope="Super User"):
+    # Nothing can be prompted for from the event loop, so the details are required
+    if extension is None:
+        raise ValueError("create_user_async needs the user's extension, names and email")
+    extension, first_name, last_name, email = validate_user(extension, first_name, last_name, email)
+
+    api_url = api_url.rstrip('/')
+    client = client or get_async_client(api_url)
+    request = user_request(domain, extension, first_name, last_name, email, user_scope, api_url, index)
+    if request is None:
+        return 200
+    url, headers, data = request
+    try:
+        response = await client.post(url, headers=headers, data=json.dumps(data))
+    except REQUEST_ERRORS as e:
+        return user_error(url, extension, first_name, last_name, e)
+    return user_created(response, domain, extension, first_name, last_name, index)
+
+async def create_device_async(custID, domain, extension, api_url, client=None, index=None, sip_password=None):
+    api_url = api_url.rstrip('/')
+    client = client or get_async_client(api_url)
+    request = device_request(domain, extension, api_url, index, sip_password)
+    if request is None:
+        return 200
+    url, headers, data = request
+    try:
+        response = await client.post(url, headers=headers, data=json.dumps(data))
+    except REQUEST_ERRORS as e:
+        return device_error(extension, e)
+    return device_created(response, domain, extension, data["device-sip-registration-password"], index)
+
+async def create_call_queue_async(custID, domain, callqueue, description, api_url, dispatch_type="Ring All", client=None, index=None):
+    api_url = api_url.rstrip('/')
+    client = client or get_async_client(api_url)
+    request = call_queue_request(domain, callqueue, description, api_url, dispatch_type, index)
+    if request is None:
+        return 200
+    url, headers, data = request
+    try:
+        response = await client.post(url, headers=headers, data=json.dumps(data), conflict_safe=True)
+    except REQUEST_ERRORS as e:
+        return call_queue_error(url, callqueue, e)
+    return call_queue_created(response, domain, callqueue, description, index)
+
+async def get_call_queue_agents_async(custID, domain, callqueue, api_url, client=None, refresh=False):
+    api_url = api_url.rstrip('/')
+    client = client or get_async_client(api_url)
+    roster = None if refresh else cached_agents(client, domain, callqueue)
+    if roster is not None:
+        return roster
+    url, headers = agents_request(domain, callqueue, api_url)
+    try:
+        response = await client.get(url, headers=headers)
+    except REQUEST_ERRORS as e:
+        return agents_error(callqueue, e)
+    return agents_fetched(response, client, domain, callqueue)
+
+async def post_call_queue_agent_async(custID, domain, callqueue, agent_extension, api_url, client=None):
+    api_url = api_url.rstrip('/')
+    client = client or get_async_client(api_url)
+    url, headers, data = agent_request(domain, callqueue, agent_extension, api_url)
+    try:
+        response = await client.post(url, headers=headers, data=json.dumps(data))
+    except REQUEST_ERRORS as e:
+        return agent_error(url, client, domain, callqueue, agent_extension, e)
+    return agent_added(response, client, domain, callqueue, agent_extension)
+
+async def add_agents_to_call_queue_async(custID, domain, callqueue, agent_extensions, api_url, client=None):
+    client = client or get_async_client(api_url)
+    roster = await get_call_queue_agents_async(custID, domain, callqueue, api_url, client, refresh=True)
+    missing, results = missing_agents(roster, domain, callqueue, agent_extensions)
+    statuses = await asyncio.gather(*(post_call_queue_agent_async(custID, domain, callqueue, extension, api_url, client) for extension in missing))
+    results.update(zip(missing, statuses))
+    return check_agents_added(results, missing, callqueue)
+
+async def create_connection_async(custID, name, api_url, client=None):
+    """Create one of the THINQ_CONNECTIONS trunks ("inbound", "second" or "outbound")."""
+    api_url = api_url.rstrip('/')
+    client = client or get_async_client(api_url)
+    address, description = THINQ_CONNECTIONS[name]
+    url, headers, payload = connection_request(address, description, api_url)
+    try:
+        response = await client.post(url, headers=headers, json=payload)
+    except REQUEST_ERRORS as e:
+        connection_error(url, description, payload, e)
+        raise
+    return connection_response(response, description)
+
+async def create_us_domestic_route_async(custID, api_url, match_to="sip:1??????????@*", con_host="a.icr.commio.com", con_index="1", client=None):
+    api_url = api_url.rstrip('/')
+    client = client or get_async_client(api_url)
+    url, headers, payload = route_request(api_url, match_to, con_host, con_index)
+    try:
+        response = await client.post(url, headers=headers, json=payload, conflict_safe=True)
+    except REQUEST_ERRORS as e:
+        route_error(url, e)
+        raise
+    return route_response(response)
+
+async def create_image_async(custID, filename, file_path, api_url, reseller=None, client=None, index=None, file_data=None):
+    client = client or get_async_client(api_url)
+    url, headers, payload, mime_type, method = image_request(filename, file_path, api_url, reseller, index)
+    try:
+        if file_data is None:
+            with open(file_path, "rb") as file:
+                file_data = await asyncio.to_thread(file.read)
+        files = {"File": (filename, file_data, mime_type)}
+        if method == "PUT":
+            response = await client.put(url, headers=headers, data=payload, files=files)
+        else:
+            response = await client.post(url, headers=headers, data=payload, files=files, conflict_safe=True)
+            if image_conflicted(response, filename):
+                response = await client.put(url, headers=headers, data=payload, files=files)
+    except Exception as e:
+        return image_error(filename, file_path, e)
+    return image_uploaded(response, filename, payload, index)
+
+async def upload_images_async(custID, uploads, api_url, reseller=None, client=None, index=None):
+    # uploads: (filename, file_path, file_data) tuples, as for create_image.upload_images
+    client = client or get_async_client(api_url)
+    statuses = await asyncio.gather(*(create_image_async(custID, filename, file_path, api_url, reseller, client=client, index=index, file_data=file_data)
+                                      for filename, file_path, file_data in uploads))
+    return report_uploads({filename: status for (filename, _, _), status in zip(uploads, statuses)}, reseller)
+
+async def process_images_async(image_source, custID, api_url, reseller=None, local=False, exclude_filenames=(), client=None, index=None, variants=None):
+    """Resize in a worker thread (unless variants are given) and upload every branding image concurrently."""
+    if variants is None:
+        variants = await asyncio.to_thread(build_variants, image_source, local)
+    uploads = in_memory_uploads(variants, FILENAME_MAPPING, exclude_filenames, reseller)
+    if uploads is None:
+        return False
+    await upload_images_async(custID, uploads, api_url, reseller, client=client, index=index)
+    return True
+
+async def upload_branding_async(branding, custID, api_url, variants=None, client=None, index=None):
+    # variants is a future from the image process pool, or None to resize in a worker thread
+    return await process_images_async(branding["image"], custID, api_url, reseller=branding["reseller"], local=branding["local"], client=client,
+                                      index=index, variants=await asyncio.wrap_future(variants) if variants else None)
+
+# (client, payload) -> the write of that configuration currently in flight
+_config_writes = {}
+
+async def send_configuration_async(config, api_url, scope=None, client=None, index=None):
+    client = client or get_async_client(api_url)
+    payload = configuration_payload(config, scope)
+    # Tenants on one host share its host-wide configurations; when several push the
+    # same one at once, they wait on a single write instead of racing POST/409/PUT
+    key = (id(client), json.dumps(payload, sort_keys=True))
+    write = _config_writes.get(key)
+    if write is None:
+        write = asyncio.ensure_future(_write_configuration(config, api_url, scope, client, index))
+        _config_writes[key] = write
+        write.add_done_callback(lambda _: _config_writes.pop(key, None))
+    return await asyncio.shield(write)
+
+async def _write_configuration(config, api_url, scope, client, index):
+    url, headers, payload, method = configuration_request(config, api_url, scope, index)
+    if method is None:
+        return 200
+    if method == "POST":
+        response = await client.post(url, headers=headers, json=payload, conflict_safe=True)
+        method = configuration_sent(response, method, config, payload, index)
+    if method == "PUT":
+        response = await client.put(url, headers=headers, json=payload)
+        configuration_sent(response, method, config, payload, index)
+    return response.status_code
+
+async def push_configurations_async(configs, api_url, client=None, index=None):
+    client = client or get_async_client(api_url)
+    jobs = [(config, scope) for config in configs for scope in config_scopes(config)]
+    print(f"Pushing {len(jobs)} configurations concurrently")
+    logger.info(f"Pushing {len(jobs)} configurations to {api_url} (async, {client.max_in_flight} in flight)")
+    statuses = await asyncio.gather(*(send_configuration_async(config, api_url, scope, client=client, index=index) for config, scope in jobs),
+                                    return_exceptions=True)
+    results = [configuration_result(config, scope, status) for (config, scope), status in zip(jobs, statuses)]
+    results.sort(key=lambda result: (result["config_name"], result["scope"], result["reseller"]))
+    print_status_table(results)
+    return results
+
+async def update_configurations_async(customer_name=None, config_file="ui-configs.json", api_url=None, client=None, index=None, overrides=None):
+    """Non-interactive update_configurations: values come from the config file and overrides only."""
+    if not api_url:
+        raise ValueError("API URL must be provided")
+    configs = load_configurations(config_file, customer_name)
+    if overrides:
+        apply_overrides(configs, overrides)
+    return await push_configurations_async(configs, api_url, client=client, index=index)
+
+async def apply_manifest_async(manifest, client=None, index=None, image_pool=None, journal=None):
+    """Provision one host from a manifest on the running event loop; the same steps as manifest.apply_manifest.
+
+    The training domain build has no async variant yet, so it runs in a
+    worker thread on the shared sync client.
+    """
+    tenant = validate_manifest(manifest)
+    custID = tenant["host_id"]
+    api_url = tenant["api_url"]
+    client = client or get_async_client(api_url)
+    if index is None:
+        index = ExistenceIndex(get_client(api_url))
+        await asyncio.to_thread(index.load)
+    waiter = get_waiter(client)
+
+    graph = TaskGraph(f"manifest for {custID}")
+    reseller = tenant["reseller"]
+    reseller_task = graph.add(f"reseller:{reseller['name']}", create_reseller_async, custID, reseller["name"], reseller["description"], api_url,
+                              client=client, index=index)
+
+    branding = tenant["branding"]
+    if branding:
+        variants = image_pool.submit(build_variants, branding["image"], branding["local"]) if image_pool else None
+        graph.add(f"branding:{reseller['name']}", upload_branding_async, branding, custID, api_url, variants, client=client, index=index, deps=[reseller_task])
+
+    configurations = tenant["configurations"]
+    if configurations:
+        graph.add("configurations", update_configurations_async, custID, config_file=configurations["file"], api_url=api_url, client=client,
+                  index=index, overrides=configurations["overrides"], deps=[reseller_task])
+
+    if tenant["connections"]:
+        for name in THINQ_CONNECTIONS:
+            graph.add(f"connection:{name}", create_connection_async, custID, name, api_url, client=client)
+    if tenant["routes"]:
+        graph.add("route:us-domestic", create_us_domestic_route_async, custID, api_url, client=client,
+                  deps=["connection:inbound"] if tenant["connections"] else ())
+
+    domain = tenant["domain"]
+    domain_name = domain["name"]
+    domain_task = graph.add(f"domain:{domain_name}", create_domain_async, custID, domain_name, domain["reseller"], domain["description"], domain["dial_plan"],
+                            domain["dial_policy"], domain["area_code"], domain["caller_id_name"], domain["caller_id_number"],
+                            domain["caller_id_number_emergency"], api_url, client=client, index=index,
+                            ready=waiter.check("domain", None, domain_name))
+    await asyncio.to_thread(index.load_domain, domain_name)
+
+    for user in tenant["users"]:
+        extension = str(user["extension"])
+        user_task = graph.add(f"user:{domain_name}:{extension}", create_user_async, custID, domain_name, api_url, client=client, index=index,
+                              extension=extension, first_name=user["first_name"], last_name=user["last_name"], email=user["email"], deps=[domain_task],
+                              ready=waiter.check("user", domain_name, extension))
+        if user["device"]:
+            graph.add(f"device:{domain_name}:{extension}", create_device_async, custID, domain_name, extension, api_url, client=client, index=index,
+                      deps=[user_task])
+
+    for queue in tenant["call_queues"]:
+        callqueue = str(queue["callqueue"])
+        queue_task = graph.add(f"queue:{domain_name}:{callqueue}", create_call_queue_async, custID, domain_name, callqueue, queue["description"], api_url,
+                               dispatch_type=queue["dispatch_type"], client=client, index=index, deps=[domain_task],
+                               ready=waiter.check("callqueue", domain_name, callqueue))
+        agents = [str(agent) for agent in queue["agents"]]
+        if agents:
+            graph.add(f"agents:{domain_name}:{callqueue}", add_agents_to_call_queue_async, custID, domain_name, callqueue, agents, api_url, client=client,
+                      deps=[queue_task] + [f"user:{domain_name}:{agent}" for agent in agents])
+
+    if tenant["training_domains"]:
+        # Also creates domain:{custID} under {custID}_reseller, so it runs after the tenant's own reseller and domain.
+        # It journals its own steps, so it always runs again to retry whichever of them failed
+        graph.add("training-domains", create_training_domains, custID, api_url, client=get_client(api_url), index=index, journal=journal,
+                  deps=[reseller_task, domain_task], succeeded=graph_succeeded, journaled=False)
+
+    print(f"\n=== Applying tenant manifest for {custID} on the event loop ({len(graph.tasks)} steps) ===")
+    logger.info(f"=== Applying tenant manifest for {custID} on the event loop ({len(graph.tasks)} steps) ===")
+    await graph.run_async(journal=journal)
+    graph.print_critical_path()
+    return graph
+
+def apply_manifest_with_asyncio(manifest, index=None, journal=None):
+    """Sync entry point: run apply_manifest_async on a fresh event loop and close its clients."""
+
+    async def run():
+        try:
+            return await apply_manifest_async(manifest, index=index, journal=journal)
+        finally:
+            await close_async_clients()
+
+    return asyncio.run(run())
@@ -0,0 +1,152 @@
+import contextlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+
+# Keep the benchmark output readable and the image stage honest
+os.environ.setdefault("NS_LOG_LEVEL", "WARNING")
+os.environ.setdefault("NS_IMAGE_CACHE", "0")
+os.environ.setdefault("NS_JOURNAL", "0")
+os.environ.setdefault("API_TOKEN", "benchmark-token")
+
+from logging_setup import setup_logging
+from mock_ns_api import MockNetSapiens, parse_option
+from ns_client import NetSapiensClient
+from existence_index import ExistenceIndex
+from readiness import get_waiter
+from ui_configs import update_configurations
+from create_image import process_images
+from create_training_domains import create_training_domains, clear_agent_rosters
+from manifest import apply_manifest
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+BENCH_HOST_ID = "bench"
+BENCH_LOGO = "reseller_images/reseller-one-logo.jpeg"
+
+def percentile(values, fraction):
+    # Nearest-rank percentile; fine for the few thousand samples a run produces
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+class LatencyRecorder:
+    """Collects the latency and status of every response a client receives."""
+
+    def __init__(self, client):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.statuses = {}
+        client.session.hooks["response"].append(self._record)
+
+    def _record(self, response, *args, **kwargs):
+        with self._lock:
+            self.latencies.append(response.elapsed.total_seconds())
+            self.statuses[response.status_code] = self.statuses.get(response.status_code, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self.latencies = []
+            self.statuses = {}
+
+def eval_manifest(api_url):
+    # The non-interactive equivalent of an eval-main.py build
+    return {
+        "host_id": BENCH_HOST_ID,
+        "api_url": api_url,
+        "branding": {"image": BENCH_LOGO, "local": True},
+        "configurations": {"file": "ui-configs.json"},
+        "users": [
+            {"extension": "1001", "first_name": "Bench", "last_name": "One", "email": "one@example.com"},
+            {"extension": "1002", "first_name": "Bench", "last_name": "Two", "email": "two@example.com"}
+        ],
+        "call_queues": [{"callqueue": "800", "description": "Bench queue", "agents": ["1001", "1002"]}],
+        "training_domains": True
+    }
+
+def loaded_index(client):
+    index = ExistenceIndex(client)
+    index.load()
+    return index
+
+SCENARIOS = {
+    "configs": lambda client: update_configurations(BENCH_HOST_ID, api_url=client.api_url, client=client, interactive=False),
+    "images": lambda client: process_images(BENCH_LOGO, BENCH_HOST_ID, client.api_url, reseller=f"{BENCH_HOST_ID}_reseller", local=True,
+                                            client=client, in_memory=True),
+    "training": lambda client: create_training_domains(BENCH_HOST_ID, client.api_url, client=client, index=loaded_index(client)),
+    "eval": lambda client: apply_manifest(eval_manifest(client.api_url), client=client, index=loaded_index(client)),
+}
+
+def run_scenario(name, mock, client, recorder):
+    mock.reset()
+    # Objects seen in an earlier scenario are gone from the reset mock
+    get_waiter(client).forget()
+    clear_agent_rosters()
+    recorder.reset()
+    started = time.perf_counter()
+    # The provisioning functions narrate every call; only the numbers matter here
+    with contextlib.redirect_stdout(io.StringIO()):
+        SCENARIOS[name](client)
+    elapsed = time.perf_counter() - started
+    latencies = recorder.latencies
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "statuses": dict(sorted(recorder.statuses.items()))
+    }
+
+def print_results(results):
+    print(f"\n{'Scenario':<10}  {'Requests':>8}  {'Time':>8}  {'Req/s':>7}  {'p50 ms':>7}  {'p99 ms':>7}  Statuses")
+    print(f"{'-' * 10}  {'-' * 8}  {'-' * 8}  {'-' * 7}  {'-' * 7}  {'-' * 7}  --------")
+    for result in results:
+        statuses = ", ".join(f"{status}: {count}" for status, count in result["statuses"].items())
+        print(f"{result['scenario']:<10}  {result['requests']:>8}  {result['seconds']:>7.2f}s  {result['requests_per_second']:>7.1f}  "
+              f"{result['p50_ms']:>7.1f}  {result['p99_ms']:>7.1f}  {statuses}")
+        logger.warning(f"Benchmark {result['scenario']}: {result['requests']} requests in {result['seconds']}s "
+                       f"({result['requests_per_second']} req/s, p50 {result['p50_ms']}ms, p99 {result['p99_ms']}ms)")
+
+def run_benchmarks(scenarios, latency=0.02, jitter=0.005, conflict_rate=0.0, throttle_rate=0.0, ready_delay=0.0):
+    mock = MockNetSapiens(latency=latency, jitter=jitter, conflict_rate=conflict_rate, throttle_rate=throttle_rate, ready_delay=ready_delay).start()
+    client = NetSapiensClient(mock.url)
+    recorder = LatencyRecorder(client)
+    print(f"Benchmarking against mock NetSapiens API at {mock.url} (latency {latency * 1000:.0f}ms +{jitter * 1000:.0f}ms, "
+          f"409 rate {conflict_rate}, 429 rate {throttle_rate}, ready delay {ready_delay * 1000:.0f}ms)")
+    try:
+        results = []
+        for name in scenarios:
+            print(f"Running {name}...")
+            results.append(run_scenario(name, mock, client, recorder))
+    finally:
+        client.close()
+        mock.stop()
+    print_results(results)
+    return results
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    latency = parse_option(args, "--latency", 20.0) / 1000
+    jitter = parse_option(args, "--jitter", 5.0) / 1000
+    conflict_rate = parse_option(args, "--conflict-rate", 0.0)
+    throttle_rate = parse_option(args, "--throttle-rate", 0.0)
+    ready_delay = parse_option(args, "--ready-delay", 0.0) / 1000
+    scenarios = parse_option(args, "--scenarios", ",".join(SCENARIOS), str).split(",")
+    output = parse_option(args, "--json", None, str)
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        print(f"Unknown scenarios: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+        sys.exit(1)
+
+    results = run_benchmarks(scenarios, latency, jitter, conflict_rate, throttle_rate, ready_delay)
+    if output:
+        with open(output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+        print(f"Results written to {output}")
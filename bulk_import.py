@@ -0,0 +1,322 @@
+import csv
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+from logging_setup import setup_logging
+from ns_client import get_client, report_all
+from existence_index import ExistenceIndex
+from create_user import create_user, validate_user
+from create_device import create_device, generate_random_password
+from ui_configs import SCOPE_MAPPING
+from readiness import get_waiter
+from tracing import span, propagate
+from profiling import start_profiling
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+DEFAULT_IMPORT_WORKERS = int(os.getenv("NS_IMPORT_WORKERS", "8"))
+DEFAULT_IMPORT_BATCH = int(os.getenv("NS_IMPORT_BATCH", "200"))
+
+USER_SCOPES = {"Super User", "Reseller", "Office Manager", "Advanced User", "Basic User", "Simple User",
+               "Call Center Agent", "Call Center Supervisor", "No Portal"}
+# Header spellings seen in customer exports, mapped onto the importer's column names
+COLUMN_ALIASES = {"ext": "extension", "user": "extension", "first": "first_name", "firstname": "first_name",
+                  "last": "last_name", "lastname": "last_name", "email_address": "email", "user_scope": "scope",
+                  "password": "sip_password"}
+RESULT_FIELDS = ["line", "status", "extension", "first_name", "last_name", "email", "scope", "user", "device", "sip_password", "error"]
+SUCCESS_STATUSES = (200, 201, 202)
+
+def _column(name):
+    column = re.sub(r"[\s-]+", "_", str(name).strip().lower())
+    return COLUMN_ALIASES.get(column, column)
+
+def read_rows(path):
+    """Yield (line number, row) from a CSV or JSONL file, one row at a time.
+
+    Nothing is read ahead, so a migration file of any size streams through
+    in constant memory. A JSONL line that does not parse comes back as a row
+    holding only an "_error" so it is reported along with the rest.
+    """
+    with open(path, "r", newline="", encoding="utf-8-sig") as rows_file:
+        if path.endswith((".jsonl", ".ndjson")):
+            for number, line in enumerate(rows_file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield number, {"_error": f"invalid JSON: {e}"}
+                    continue
+                if not isinstance(row, dict):
+                    yield number, {"_error": "each line must be a JSON object"}
+                    continue
+                yield number, {_column(key): value for key, value in row.items()}
+        else:
+            reader = csv.DictReader(rows_file)
+            for row in reader:
+                if not any((value or "").strip() for value in row.values() if isinstance(value, str)):
+                    continue
+                yield reader.line_num, {_column(key): value for key, value in row.items() if key is not None}
+
+def _text(row, column):
+    value = row.get(column)
+    return "" if value is None else str(value).strip()
+
+def _flag(value, column):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ("", "1", "yes", "y", "true"):
+        return True
+    if text in ("0", "no", "n", "false"):
+        return False
+    raise ValueError(f"{column} must be yes or no, not '{value}'")
+
+def validate_row(row):
+    """Return the user described by one input row, or raise ValueError saying what is wrong with it."""
+    if "_error" in row:
+        raise ValueError(row["_error"])
+    extension, first_name, last_name, email = validate_user(_text(row, "extension"), _text(row, "first_name"),
+                                                            _text(row, "last_name"), _text(row, "email"))
+    scope = _text(row, "scope") or "Super User"
+    scope = SCOPE_MAPPING.get(scope.lower(), scope)
+    if scope not in USER_SCOPES:
+        raise ValueError(f"Unknown user scope '{scope}'")
+    return {
+        "extension": extension,
+        "first_name": first_name,
+        "last_name": last_name,
+        "email": email,
+        "scope": scope,
+        "device": _flag(row.get("device", ""), "device"),
+        "sip_password": _text(row, "sip_password")
+    }
+
+def validate_batch(batch, seen):
+    """Validate a batch of (line, row) pairs; returns (users, rejected result rows).
+
+    seen holds every extension accepted so far, so a repeated extension is
+    rejected wherever it appears in the file and the first occurrence wins.
+    """
+    users, rejected = [], []
+    for number, row in batch:
+        try:
+            user = validate_row(row)
+        except ValueError as e:
+            rejected.append({"line": number, "status": "invalid", "extension": _text(row, "extension"), "error": str(e)})
+            continue
+        if user["extension"] in seen:
+            rejected.append({"line": number, "status": "duplicate", "extension": user["extension"],
+                             "error": f"extension {user['extension']} already appears on line {seen[user['extension']]}"})
+            continue
+        seen[user["extension"]] = number
+        users.append(dict(user, line=number))
+    return users, rejected
+
+def import_user(custID, domain, user, api_url, client, index):
+    """Create one row's user; returns the row's result so far, with status set if the row is already finished."""
+    extension = user["extension"]
+    result = {key: user[key] for key in ("line", "extension", "first_name", "last_name", "email", "scope")}
+    if index.has_user(domain, extension):
+        result["user"] = "exists"
+        return result
+    with span(f"import:user:{extension}", "object", domain=domain):
+        result["user"] = create_user(custID, domain, api_url, client=client, index=index, extension=extension,
+                                     first_name=user["first_name"], last_name=user["last_name"], email=user["email"],
+                                     user_scope=user["scope"])
+    if result["user"] == 409:
+        # Created by someone else since the index was loaded; the device may still be missing
+        result["user"] = "exists"
+    elif result["user"] not in SUCCESS_STATUSES:
+        result.update(status="failed", device="skipped", error=f"user create returned {result['user'] or 'no response'}")
+    return result
+
+def import_device(custID, domain, user, result, api_url, client, index):
+    """Create one row's device once its user exists, and settle the row's status."""
+    extension = user["extension"]
+    if not user["device"]:
+        result["device"] = "none"
+    elif index.has_device(domain, extension, extension):
+        result["device"] = "exists"
+    else:
+        # Generated here rather than in create_device so it can go into the results file
+        sip_password = user["sip_password"] or generate_random_password()
+        with span(f"import:device:{extension}", "object", domain=domain):
+            result["device"] = create_device(custID, domain, extension, api_url, client=client, index=index, sip_password=sip_password)
+        if result["device"] == 409:
+            result["device"] = "exists"
+        elif result["device"] not in SUCCESS_STATUSES:
+            result.update(status="failed", error=f"device create returned {result['device'] or 'no response'}")
+            return result
+        else:
+            result["sip_password"] = sip_password
+    created = result["user"] != "exists" or result["device"] not in ("exists", "none")
+    result["status"] = "created" if created else "exists"
+    return result
+
+def start_row(executor, custID, domain, user, api_url, client, index):
+    """Import one row on the executor; returns a Future of the row's result.
+
+    The user is created asynchronously by the API, so the device is only
+    queued once the readiness waiter sees the user. No worker sits idle in
+    the meantime, and other rows' users keep going out.
+    """
+    row = Future()
+
+    def finish(stage, *args):
+        try:
+            result = stage(*args)
+            if result is not None:
+                row.set_result(result)
+        except Exception as e:
+            row.set_exception(e)
+
+    def device_stage(result, ready):
+        if not ready:
+            result.update(status="failed", device="skipped", error="user was created but never became ready")
+            return result
+        return import_device(custID, domain, user, result, api_url, client, index)
+
+    def user_stage():
+        result = import_user(custID, domain, user, api_url, client, index)
+        if "status" in result:
+            return result
+        if result["user"] == "exists" or not user["device"]:
+            return import_device(custID, domain, user, result, api_url, client, index)
+        get_waiter(client).when_ready("user", domain, user["extension"]).add_done_callback(
+            lambda ready: executor.submit(propagate(finish), device_stage, result, ready.result()))
+        return None
+
+    executor.submit(propagate(finish), user_stage)
+    return row
+
+def default_results_path(path):
+    return f"{os.path.splitext(path)[0]}-results.csv"
+
+def import_users(path, custID, domain, api_url, client=None, index=None, results_path=None, max_workers=DEFAULT_IMPORT_WORKERS,
+                 batch_size=DEFAULT_IMPORT_BATCH, check_only=False):
+    """Stream users from a CSV or JSONL file into a domain, creating users and devices concurrently.
+
+    Rows are validated a batch at a time as they are read, and only valid,
+    first-seen extensions are submitted. At most one batch of rows is in
+    flight at once, so memory stays flat however long the file is. One
+    result row per input row is written to results_path as soon as it is
+    known. Returns the number of rows with each status.
+    """
+    results_path = results_path or default_results_path(path)
+    api_url = api_url.rstrip('/')
+    if not check_only:
+        client = client or get_client(api_url)
+        if index is None:
+            index = ExistenceIndex(client)
+            index.load()
+        # Users that already exist are reported as such instead of being posted again
+        index.load_domain(domain)
+
+    counts = {}
+    seen = {}
+    started = time.perf_counter()
+    print(f"Importing users from {path} into {domain} with {max_workers} workers (results: {results_path})")
+    logger.info(f"Importing users from {path} into {domain} on {api_url} with {max_workers} workers, batches of {batch_size}")
+
+    with open(results_path, "w", newline="") as results_file, \
+            ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="import") as executor, \
+            span(f"import:{domain}", "phase", source=path):
+        writer = csv.DictWriter(results_file, fieldnames=RESULT_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+
+        def record(result):
+            writer.writerow(result)
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+
+        def collect(futures):
+            for future in futures:
+                user = pending.pop(future)
+                try:
+                    record(future.result())
+                except Exception as e:
+                    logger.error(f"Importing extension {user['extension']} (line {user['line']}) failed: {e}")
+                    record({"line": user["line"], "status": "failed", "extension": user["extension"], "error": str(e)})
+
+        pending = {}
+        rows = read_rows(path)
+        batch_number = rows_read = 0
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            batch_number += 1
+            rows_read += len(batch)
+            users, rejected = validate_batch(batch, seen)
+            for result in rejected:
+                record(result)
+            if rejected:
+                print(f"Batch {batch_number}: {len(rejected)} of {len(batch)} rows rejected")
+                logger.warning(f"Batch {batch_number} of {path}: {len(rejected)} of {len(batch)} rows rejected")
+            for user in users:
+                if check_only:
+                    record({**user, "status": "valid", "device": "yes" if user["device"] else "no", "sip_password": ""})
+                    continue
+                while len(pending) >= max(batch_size, max_workers * 2):
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending[start_row(executor, custID, domain, user, api_url, client, index)] = user
+            results_file.flush()
+            print(f"Read {rows_read} rows: " + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+        collect(list(pending))
+
+    elapsed = time.perf_counter() - started
+    summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items())) or "no rows"
+    print(f"Import of {path} finished in {elapsed:.2f}s: {summary}")
+    logger.info(f"Import of {path} into {domain} finished in {elapsed:.2f}s: {summary}")
+    print(f"Per-row results written to {results_path}")
+    return counts
+
+def parse_option(args, name, default, cast=str):
+    if name in args:
+        position = args.index(name)
+        value = cast(args[position + 1])
+        del args[position:position + 2]
+        return value
+    return default
+
+if __name__ == "__main__":
+    start_profiling("bulk_import")
+    print("Starting bulk user import")
+    logger.info("Starting bulk user import")
+    args = sys.argv[1:]
+    try:
+        domain = parse_option(args, "--domain", "")
+        custID = parse_option(args, "--host-id", domain)
+        api_url = parse_option(args, "--api-url", "")
+        results_path = parse_option(args, "--results", None)
+        max_workers = parse_option(args, "--workers", DEFAULT_IMPORT_WORKERS, int)
+        batch_size = parse_option(args, "--batch", DEFAULT_IMPORT_BATCH, int)
+        check_only = "--check" in args
+        args = [arg for arg in args if arg != "--check"]
+        if len(args) != 1:
+            raise ValueError("give exactly one CSV or JSONL file")
+        if not domain:
+            raise ValueError("--domain is required")
+        if not check_only and not re.match(r"^https?://[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+(:\d+)?$", api_url):
+            raise ValueError(f"--api-url is not a valid URL: '{api_url}'")
+        if max_workers < 1 or batch_size < 1:
+            raise ValueError("--workers and --batch must be at least 1")
+    except (ValueError, IndexError) as e:
+        print(f"Error: {e}")
+        print("Usage: python bulk_import.py <users.csv|users.jsonl> --domain DOMAIN --api-url URL [--host-id ID] "
+              "[--results out.csv] [--workers N] [--batch N] [--check]")
+        sys.exit(1)
+
+    counts = import_users(args[0], custID, domain, api_url, results_path=results_path, max_workers=max_workers,
+                          batch_size=batch_size, check_only=check_only)
+    if not check_only:
+        report_all()
+    print("Bulk user import completed")
+    logger.info("Bulk user import completed")
+    sys.exit(0 if not any(counts.get(status) for status in ("invalid", "duplicate", "failed")) else 1)
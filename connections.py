@@ -1,14 +1,14 @@
 import requests
-import json
 import os
-from dotenv import load_dotenv
-from logging_setup import setup_logging
+from settings import load_env
+from logging_setup import setup_logging, LazyJSON, LazyText
+from ns_client import get_client
 
 # Initialize logger
-logger = setup_logging()
+logger = setup_logging(__name__)
 
 # Load variables from the .env file into the environment
-load_dotenv()
+load_env()
 
 # Retrieve the API token
 API_TOKEN = os.getenv("API_TOKEN")
@@ -16,18 +16,18 @@ API_TOKEN = os.getenv("API_TOKEN")
 print(f"Loaded API_TOKEN: {API_TOKEN}")
 logger.info(f"Loaded API_TOKEN: {API_TOKEN}")
 
-def create_connection(custID, api_url, description="ThinQ Secondary Orig & 911"):
-    api_url = api_url.rstrip('/')
-    url = f"{api_url}/ns-api/v2/connections"
-    headers = {
-        "accept": "application/json",
-        "authorization": f"Bearer {API_TOKEN}",
-        "content-type": "application/json"
-    }
-    payload = {
+# Connection name -> (carrier address, description) for the ThinQ trunks every host gets
+THINQ_CONNECTIONS = {
+    "inbound": ("192.81.236.20", "ThinQ Secondary Orig & 911"),
+    "second": ("192.81.237.20", "ThinQ Primary Orig & 911"),
+    "outbound": ("a.icr.commio.com", "ThinQ LCR Outbound")
+}
+
+def connection_payload(address, description):
+    return {
         "connection-orig-enabled": "yes",
         "connection-term-enabled": "yes",
-        "connection-translation-destination-host": "192.81.236.20",
+        "connection-translation-destination-host": address,
         "connection-translation-request-user": "[*]",
         "connection-translation-destination-user": "[*]",
         "connection-translation-source-user": "[*]",
@@ -54,176 +54,66 @@ def create_connection(custID, api_url, description="ThinQ Secondary Orig & 911")
         "minimum-call-duration-seconds": 0,
         "connection-sip-authenticate-as-client-enabled": "no",
         "connection-is-carrier-trunk": "yes",
-        "connection-orig-match-pattern": "sip*@192.81.236.20",
-        "connection-term-match-pattern": "sip:*@192.81.236.20",
+        "connection-orig-match-pattern": f"sip*@{address}",
+        "connection-term-match-pattern": f"sip:*@{address}",
         "domain": "*",
         "description": description,
         "connection-audio-relay-enabled": "yes",
-        "connection-address": "192.81.236.20",
+        "connection-address": address,
         "dial-plan": "Inbound DID",
         "dial-policy": "Permit All",
         "connection-linked-billing-user": "domain",
-        "connection-translation-request-host": "192.81.236.20",
+        "connection-translation-request-host": address,
         "connection-translation-source-host": "<AppIP>",
         "utc-offset": "-7",
         "time-zone": "US/Pacific"
     }
-    
-    print(f"Calling API URL: {url}")
-    logger.info(f"Calling API URL: {url} for connection: {description}")
-    logger.debug(f"Payload: {json.dumps(payload, indent=2)}")
-    
-    try:
-        response = requests.post(url, headers=headers, json=payload)
-        print(f"Status Code: {response.status_code}")
-        logger.info(f"Status Code: {response.status_code} for connection: {description}")
-        logger.debug(f"Response text: {response.text}")
-        return response
-    except requests.exceptions.RequestException as e:
-        print(f"Error calling {url} with payload {payload}")
-        print(f"Exception: {e}")
-        logger.error(f"Error calling {url} for connection: {description}: {e}")
-        raise
 
-def create_second_connection(custID, api_url):
-    api_url = api_url.rstrip('/')
+def connection_request(address, description, api_url):
+    """Log and return (url, headers, payload) for creating a connection."""
     url = f"{api_url}/ns-api/v2/connections"
     headers = {
         "accept": "application/json",
-        "authorization": f"Bearer {API_TOKEN}",
         "content-type": "application/json"
     }
-    
-    payload = {
-        "connection-orig-enabled": "yes",
-        "connection-term-enabled": "yes",
-        "connection-translation-destination-host": "192.81.237.20",
-        "connection-translation-request-user": "[*]",
-        "connection-translation-destination-user": "[*]",
-        "connection-translation-source-user": "[*]",
-        "connection-source-ip-checking-enabled": "yes",
-        "connection-include-server-header-enabled": "no",
-        "connection-relay-comfort-noise-enabled": "system-default",
-        "connection-pcmu-only-enabled": "no",
-        "connection-enforce-minimum-duration-enabled": "no",
-        "connection-bind-to-alternate-interface-enabled": "no",
-        "connection-block-video-in-sdp-enabled": "no",
-        "connection-sip-get-new-dialog-destination-from": "default-ip",
-        "connection-sip-get-response-destination-from": "default-ip",
-        "connection-require-encrypted-audio-enabled": "no",
-        "connection-sip-transport-protocol": "UDP",
-        "connection-check-orig-matching-sip-header": "from",
-        "connection-sip-session-timer-enabled": "system-default",
-        "connection-prevent-rtp-port-change-enabled": "no",
-        "connection-hide-post-dial-delay-with-ringback-enabled": "no",
-        "connection-remote-ringback-handling": "allowed",
-        "connection-block-media-in-sip-180-ringing": "no",
-        "connection-allow-mid-call-uri-updates-enabled": "no",
-        "connection-record-all-calls-enabled": "no",
-        "connection-require-sip-authentication-enabled": "no",
-        "minimum-call-duration-seconds": 0,
-        "connection-sip-authenticate-as-client-enabled": "no",
-        "connection-is-carrier-trunk": "yes",
-        "connection-orig-match-pattern": "sip*@192.81.237.20",
-        "connection-term-match-pattern": "sip:*@192.81.237.20",
-        "domain": "*",
-        "description": "ThinQ Primary Orig & 911",
-        "connection-audio-relay-enabled": "yes",
-        "connection-address": "192.81.237.20",
-        "dial-plan": "Inbound DID",
-        "dial-policy": "Permit All",
-        "connection-linked-billing-user": "domain",
-        "connection-translation-request-host": "192.81.237.20",
-        "connection-translation-source-host": "<AppIP>",
-        "utc-offset": "-7",
-        "time-zone": "US/Pacific"
-    }
+    payload = connection_payload(address, description)
     
     print(f"Calling API URL: {url}")
-    logger.info(f"Calling API URL: {url} for connection: ThinQ Primary Orig & 911")
-    logger.debug(f"Payload: {json.dumps(payload, indent=2)}")
-    
-    try:
-        response = requests.post(url, headers=headers, json=payload)
-        print(f"Status Code: {response.status_code}")
-        logger.info(f"Status Code: {response.status_code} for connection: ThinQ Primary Orig & 911")
-        logger.debug(f"Response text: {response.text}")
-        return response
-    except requests.exceptions.RequestException as e:
-        print(f"Error calling {url} with payload {payload}")
-        print(f"Exception: {e}")
-        logger.error(f"Error calling {url} for connection: ThinQ Primary Orig & 911: {e}")
-        raise
+    logger.info(f"Calling API URL: {url} for connection: {description}")
+    logger.debug("Payload: %s", LazyJSON(payload))
+    return url, headers, payload
 
-def create_outbound_connection(custID, api_url):
+def connection_response(response, description):
+    print(f"Status Code: {response.status_code}")
+    logger.info(f"Status Code: {response.status_code} for connection: {description}")
+    logger.debug("Response text: %s", LazyText(response))
+    return response
+
+def connection_error(url, description, payload, e):
+    print(f"Error calling {url} with payload {payload}")
+    print(f"Exception: {e}")
+    logger.error(f"Error calling {url} for connection: {description}: {e}")
+
+def post_connection(custID, address, description, api_url, client=None):
     api_url = api_url.rstrip('/')
-    url = f"{api_url}/ns-api/v2/connections"
-    headers = {
-        "accept": "application/json",
-        "authorization": f"Bearer {API_TOKEN}",
-        "content-type": "application/json"
-    }
-    
-    payload = {
-        "connection-orig-enabled": "yes",
-        "connection-term-enabled": "yes",
-        "connection-translation-destination-host": "a.icr.commio.com",
-        "connection-translation-request-user": "[*]",
-        "connection-translation-destination-user": "[*]",
-        "connection-translation-source-user": "[*]",
-        "connection-source-ip-checking-enabled": "yes",
-        "connection-include-server-header-enabled": "no",
-        "connection-relay-comfort-noise-enabled": "system-default",
-        "connection-pcmu-only-enabled": "no",
-        "connection-enforce-minimum-duration-enabled": "no",
-        "connection-bind-to-alternate-interface-enabled": "no",
-        "connection-block-video-in-sdp-enabled": "no",
-        "connection-sip-get-new-dialog-destination-from": "default-ip",
-        "connection-sip-get-response-destination-from": "default-ip",
-        "connection-require-encrypted-audio-enabled": "no",
-        "connection-sip-transport-protocol": "UDP",
-        "connection-check-orig-matching-sip-header": "from",
-        "connection-sip-session-timer-enabled": "system-default",
-        "connection-prevent-rtp-port-change-enabled": "no",
-        "connection-hide-post-dial-delay-with-ringback-enabled": "no",
-        "connection-remote-ringback-handling": "allowed",
-        "connection-block-media-in-sip-180-ringing": "no",
-        "connection-allow-mid-call-uri-updates-enabled": "no",
-        "connection-record-all-calls-enabled": "no",
-        "connection-require-sip-authentication-enabled": "no",
-        "minimum-call-duration-seconds": 0,
-        "connection-sip-authenticate-as-client-enabled": "no",
-        "connection-is-carrier-trunk": "yes",
-        "connection-orig-match-pattern": "sip*@a.icr.commio.com",
-        "connection-term-match-pattern": "sip:*@a.icr.commio.com",
-        "domain": "*",
-        "description": "ThinQ LCR Outbound",
-        "connection-audio-relay-enabled": "yes",
-        "connection-address": "a.icr.commio.com",
-        "dial-plan": "Inbound DID",
-        "dial-policy": "Permit All",
-        "connection-linked-billing-user": "domain",
-        "connection-translation-request-host": "a.icr.commio.com",
-        "connection-translation-source-host": "<AppIP>",
-        "utc-offset": "-7",
-        "time-zone": "US/Pacific"
-    }
-    
-    print(f"Calling API URL: {url}")
-    logger.info(f"Calling API URL: {url} for connection: ThinQ LCR Outbound")
-    logger.debug(f"Payload: {json.dumps(payload, indent=2)}")
+    client = client or get_client(api_url)
+    url, headers, payload = connection_request(address, description, api_url)
     
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        print(f"Status Code: {response.status_code}")
-        logger.info(f"Status Code: {response.status_code} for connection: ThinQ LCR Outbound")
-        logger.debug(f"Response text: {response.text}")
-        return response
+        response = client.post(url, headers=headers, json=payload)
     except requests.exceptions.RequestException as e:
-        print(f"Error calling {url} with payload {payload}")
-        print(f"Exception: {e}")
-        logger.error(f"Error calling {url} for connection: ThinQ LCR Outbound: {e}")
+        connection_error(url, description, payload, e)
         raise
+    return connection_response(response, description)
+
+def create_connection(custID, api_url, description=THINQ_CONNECTIONS["inbound"][1], client=None):
+    return post_connection(custID, THINQ_CONNECTIONS["inbound"][0], description, api_url, client)
+
+def create_second_connection(custID, api_url, client=None):
+    return post_connection(custID, *THINQ_CONNECTIONS["second"], api_url, client)
+
+def create_outbound_connection(custID, api_url, client=None):
+    return post_connection(custID, *THINQ_CONNECTIONS["outbound"], api_url, client)
 
 if __name__ == "__main__":
     import re
@@ -251,7 +141,7 @@ if __name__ == "__main__":
         print(f"Failed to create connection: {response.status_code}")
         print(response.text)
         logger.error(f"Failed to create connection '{description}': {response.status_code}")
-        logger.debug(f"Response text: {response.text}")
+        logger.debug("Response text: %s", LazyText(response))
     
     print("Connection creation script completed")
     logger.info("Connection creation script completed")
\ No newline at end of file
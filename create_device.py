@@ -4,14 +4,15 @@ import os
 import re
 import random
 import string
-from dotenv import load_dotenv
-from logging_setup import setup_logging
+from settings import load_env
+from logging_setup import setup_logging, LazyJSON, LazyText
+from ns_client import get_client
 
 # Initialize logger
-logger = setup_logging()
+logger = setup_logging(__name__)
 
 # Load variables from the .env file into the environment
-load_dotenv(override=True)
+load_env()
 
 # Retrieve the API token
 API_TOKEN = os.getenv("API_TOKEN")
@@ -30,16 +31,8 @@ def validate_extension(extension):
     logger.info(f"Validated extension: {extension}")
     return extension
 
-def create_device(custID, domain, extension, api_url):
-    api_url = api_url.rstrip('/')
-    url = f"{api_url}/ns-api/v2/domains/{domain}/users/{extension}/devices"
-    headers = {
-        'accept': 'application/json',
-        'content-type': 'application/json',
-        'Authorization': f'Bearer {API_TOKEN}'
-    }
-    sip_password = generate_random_password()
-    data = {
+def device_payload(extension, sip_password):
+    return {
         "synchronous": "no",
         "caller-id-number-emergency": "[*]",
         "device-force-notify-new-voicemails-enabled": "no",
@@ -57,33 +50,66 @@ def create_device(custID, domain, extension, api_url):
         "device-sip-registration-password": sip_password,
         "device": extension
     }
+
+def device_request(domain, extension, api_url, index=None, sip_password=None):
+    """Log and return (url, headers, data) for creating a device, or None if the index already has it."""
+    if index and index.has_device(domain, extension, extension):
+        print(f"Device for extension {extension} already exists, skipping")
+        logger.info(f"Device for extension {extension} already exists in existence index, skipping")
+        return None
+    url = f"{api_url}/ns-api/v2/domains/{domain}/users/{extension}/devices"
+    headers = {
+        'accept': 'application/json',
+        'content-type': 'application/json'
+    }
+    sip_password = sip_password or generate_random_password()
+    data = device_payload(extension, sip_password)
     
     print(f"Calling API URL: {url}")
     logger.info(f"Calling API URL: {url} to create device for extension: {extension}")
     print(f"Generated SIP Password: {sip_password}")
     logger.info(f"Generated SIP Password: {sip_password}")
     print(f"Request payload: {json.dumps(data, indent=2)}")
-    logger.debug(f"Request payload: {json.dumps(data, indent=2)}")
+    logger.debug("Request payload: %s", LazyJSON(data))
+    return url, headers, data
+
+def device_created(response, domain, extension, sip_password, index=None):
+    """Report the create response, record a new device in the index and return the status code."""
+    print(f"Status Code: {response.status_code}")
+    logger.info(f"Status Code: {response.status_code} for device extension: {extension}")
+    
+    if response.status_code in [200, 201, 202]:
+        print(f"Device for extension {extension} created successfully")
+        print(f"SIP Registration Password: {sip_password}")
+        print(f"Response: {response.text}")
+        logger.info(f"Device for extension {extension} created successfully with status code: {response.status_code}")
+        if index:
+            index.add_device(domain, extension, extension)
+        logger.info(f"SIP Registration Password provided to user: {sip_password}")
+    else:
+        print(f"Failed to create device: {response.status_code}")
+        print(response.text)
+        logger.error(f"Failed to create device for extension {extension}: {response.status_code}")
+        logger.debug("Response text: %s", LazyText(response))
+    return response.status_code
+
+def device_error(extension, e):
+    print(f"Network error: {e}")
+    logger.error(f"Network error creating device for extension {extension}: {e}")
+
+def create_device(custID, domain, extension, api_url, client=None, index=None, sip_password=None):
+    api_url = api_url.rstrip('/')
+    client = client or get_client(api_url)
+    request = device_request(domain, extension, api_url, index, sip_password)
+    if request is None:
+        return 200
+    url, headers, data = request
     
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(data))
-        print(f"Status Code: {response.status_code}")
-        logger.info(f"Status Code: {response.status_code} for device extension: {extension}")
-        
-        if response.status_code in [200, 201, 202]:
-            print(f"Device for extension {extension} created successfully")
-            print(f"SIP Registration Password: {sip_password}")
-            print(f"Response: {response.text}")
-            logger.info(f"Device for extension {extension} created successfully with status code: {response.status_code}")
-            logger.info(f"SIP Registration Password provided to user: {sip_password}")
-        else:
-            print(f"Failed to create device: {response.status_code}")
-            print(response.text)
-            logger.error(f"Failed to create device for extension {extension}: {response.status_code}")
-            logger.debug(f"Response text: {response.text}")
+        response = client.post(url, headers=headers, data=json.dumps(data))
     except requests.exceptions.RequestException as e:
-        print(f"Network error: {e}")
-        logger.error(f"Network error creating device for extension {extension}: {e}")
+        return device_error(extension, e)
+    return device_created(response, domain, extension, data["device-sip-registration-password"], index)
 
 def create_device_prompt():
     if not API_TOKEN:
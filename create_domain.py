@@ -2,14 +2,15 @@ import requests
 import json
 import os
 import re
-from dotenv import load_dotenv
-from logging_setup import setup_logging
+from settings import load_env
+from logging_setup import setup_logging, LazyJSON, LazyText
+from ns_client import get_client
 
 # Initialize logger
-logger = setup_logging()
+logger = setup_logging(__name__)
 
 # Load variables from the .env file into the environment
-load_dotenv()
+load_env()
 
 # Retrieve the API token
 API_TOKEN = os.getenv("API_TOKEN")
@@ -17,15 +18,8 @@ API_TOKEN = os.getenv("API_TOKEN")
 print(f"Loaded API_TOKEN: {API_TOKEN}")
 logger.info(f"Loaded API_TOKEN: {API_TOKEN}")
 
-def create_domain(custID, domain, reseller, description, dial_plan, dial_policy, area_code, caller_id_name, caller_id_number, caller_id_number_emergency, api_url):
-    api_url = api_url.rstrip('/')
-    url = f"{api_url}/ns-api/v2/domains"
-    headers = {
-        'accept': 'application/json',
-        'content-type': 'application/json',
-        'Authorization': f'Bearer {API_TOKEN}'
-    }
-    data = {
+def domain_payload(domain, reseller, description, dial_plan, dial_policy, area_code, caller_id_name, caller_id_number, caller_id_number_emergency):
+    return {
         "synchronous": "yes",
         "recording-configuration": "yes",
         "voicemail-transcription-enabled": "deepgram",
@@ -46,27 +40,58 @@ def create_domain(custID, domain, reseller, description, dial_plan, dial_policy,
         "is-stir-enabled": "no",
         "is-ivr-forward-change-blocked": "no"
     }
+
+def domain_request(domain, reseller, description, dial_plan, dial_policy, area_code, caller_id_name, caller_id_number, caller_id_number_emergency, api_url, index=None):
+    """Log and return (url, headers, data) for creating a domain, or None if the index already has it."""
+    if index and index.has_domain(domain):
+        print(f"Domain {domain} already exists, skipping")
+        logger.info(f"Domain '{domain}' already exists in existence index, skipping")
+        return None
+    url = f"{api_url}/ns-api/v2/domains"
+    headers = {
+        'accept': 'application/json',
+        'content-type': 'application/json'
+    }
+    data = domain_payload(domain, reseller, description, dial_plan, dial_policy, area_code, caller_id_name, caller_id_number, caller_id_number_emergency)
     
     print(f"Calling API URL: {url}")
     logger.info(f"Calling API URL: {url} to create domain: {domain}")
-    logger.debug(f"Payload: {json.dumps(data, indent=2)}")
+    logger.debug("Payload: %s", LazyJSON(data))
+    return url, headers, data
+
+def domain_created(response, domain, index=None):
+    """Report the create response, record a new domain in the index and return the status code."""
+    if response.status_code in [200, 201, 202]:
+        print("Domain created successfully")
+        logger.info(f"Domain '{domain}' created successfully with status code: {response.status_code}")
+        if index:
+            index.add_domain(domain)
+    else:
+        print(f"Failed to create domain: {response.status_code}")
+        logger.error(f"Failed to create domain '{domain}': {response.status_code}")
+    
+    print(response.text)
+    logger.debug("Response text: %s", LazyText(response))
+    return response.status_code
+
+def domain_error(url, domain, e):
+    print(f"Error calling {url}: {e}")
+    logger.error(f"Error calling {url} to create domain '{domain}': {e}")
+
+def create_domain(custID, domain, reseller, description, dial_plan, dial_policy, area_code, caller_id_name, caller_id_number, caller_id_number_emergency, api_url, client=None, index=None):
+    api_url = api_url.rstrip('/')
+    client = client or get_client(api_url)
+    request = domain_request(domain, reseller, description, dial_plan, dial_policy, area_code, caller_id_name, caller_id_number, caller_id_number_emergency,
+                             api_url, index)
+    if request is None:
+        return 200
+    url, headers, data = request
     
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(data))
-        
-        if response.status_code in [200, 201, 202]:
-            print("Domain created successfully")
-            logger.info(f"Domain '{domain}' created successfully with status code: {response.status_code}")
-        else:
-            print(f"Failed to create domain: {response.status_code}")
-            logger.error(f"Failed to create domain '{domain}': {response.status_code}")
-        
-        print(response.text)
-        logger.debug(f"Response text: {response.text}")
-        
+        response = client.post(url, headers=headers, data=json.dumps(data))
     except requests.exceptions.RequestException as e:
-        print(f"Error calling {url}: {e}")
-        logger.error(f"Error calling {url} to create domain '{domain}': {e}")
+        return domain_error(url, domain, e)
+    return domain_created(response, domain, index)
 
 if __name__ == "__main__":
     print("Starting domain creation script")
@@ -1,74 +1,143 @@
 import os
-import requests
 import mimetypes
 import traceback
-import json
-from resize import resize_image_from_url
-from PIL import Image  # Added for local resizing
-from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
+from settings import load_env
 from requests.utils import quote
-from logging_setup import setup_logging
+from logging_setup import setup_logging, LazyJSON, LazyText
+from ns_client import get_client
+from image_cache import get_default_cache
+from tracing import propagate
+from profiling import start_profiling
 
-logger = setup_logging()
-load_dotenv()
+logger = setup_logging(__name__)
+load_env()
 API_TOKEN = os.getenv("API_TOKEN")
 if not API_TOKEN:
     raise ValueError("API_TOKEN is missing from the environment variables!")
 print(f"Loaded API_TOKEN: {API_TOKEN}")
 logger.info(f"Loaded API_TOKEN: {API_TOKEN}")
 
-def create_image(custID, filename, file_path, api_url, reseller=None):
-    url = f"{api_url}/ns-api/v2/images/{quote(filename, safe='')}"
-    headers = {
-        "accept": "application/json",
-        "Authorization": f"Bearer {API_TOKEN}"
-    }
-    reseller_value = reseller if reseller else "*"
-    payload = {
-        "reseller": reseller_value,
+DEFAULT_UPLOAD_WORKERS = int(os.getenv("NS_UPLOAD_WORKERS", "4"))
+
+# Uploaded filename -> the resized variant it is made from
+FILENAME_MAPPING = {
+    "512PWA.png": "512x512.jpg",
+    "192PWA.png": "192x192.jpg",
+    "favicon.gif": "192x192.jpg",
+    "video_main_top_left.png": "250x150.jpg",
+    "video_login.png": "250x150.jpg",
+    "portal_main_top_left.png": "250x150.jpg",
+    "portal_landing.png": "250x150.jpg",
+    "webphone_main_top_left.png": "250x150.jpg"
+}
+
+def image_payload(reseller=None):
+    return {
+        "reseller": reseller if reseller else "*",
         "domain": "*",
         "server": "*",
         "description": "viaAPI"
     }
+
+def image_request(filename, file_path, api_url, reseller=None, index=None):
+    """Log and return (url, headers, payload, mime_type, method) for uploading an image.
+
+    method is "PUT" when the index already has the image, so it is replaced
+    directly instead of waiting for the POST to conflict, and "POST" otherwise.
+    """
+    url = f"{api_url}/ns-api/v2/images/{quote(filename, safe='')}"
+    headers = {
+        "accept": "application/json"
+    }
+    payload = image_payload(reseller)
+    reseller_value = payload["reseller"]
     mime_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
-    try:
-        with open(file_path, "rb") as file:
-            files = {"File": (filename, file, mime_type)}
-            print(f"Making API call to: {url} (POST)")
-            logger.info(f"Making API call to: {url} (POST) for reseller: {reseller_value}")
-            logger.debug(f"Headers: {json.dumps(headers, indent=2)}")
-            logger.debug(f"Payload: {json.dumps(payload, indent=2)}")
-            response = requests.post(url, headers=headers, data=payload, files=files)
-            if response.status_code in [400, 409]:
-                print(f"Image already exists, trying PUT request for {filename}")
-                logger.info(f"Image already exists, trying PUT request for {filename}")
-                response = requests.put(url, headers=headers, data=payload, files=files)
-            print(f"API response for {filename}: {response.status_code} - {response.text}")
-            logger.info(f"API response for {filename}: {response.status_code}")
-            logger.debug(f"Response text: {response.text}")
-    except FileNotFoundError:
+    print(f"Making API call to: {url} (POST)")
+    logger.info(f"Making API call to: {url} (POST) for reseller: {reseller_value}")
+    logger.debug("Headers: %s", LazyJSON(headers))
+    logger.debug("Payload: %s", LazyJSON(payload))
+    if index and index.has_image(filename, reseller_value):
+        print(f"Image already exists, sending PUT request for {filename}")
+        logger.info(f"Image {filename} already exists in existence index, sending PUT request")
+        return url, headers, payload, mime_type, "PUT"
+    return url, headers, payload, mime_type, "POST"
+
+def image_conflicted(response, filename):
+    """Whether a POST failed because the image already exists, so it has to be sent again as a PUT."""
+    if response.status_code in [400, 409]:
+        print(f"Image already exists, trying PUT request for {filename}")
+        logger.info(f"Image already exists, trying PUT request for {filename}")
+        return True
+    return False
+
+def image_uploaded(response, filename, payload, index=None):
+    """Report the upload response, record the image in the index and return the status code."""
+    if index and response.status_code in [200, 201, 202]:
+        index.add_image(filename, payload["reseller"])
+    print(f"API response for {filename}: {response.status_code} - {response.text}")
+    logger.info(f"API response for {filename}: {response.status_code}")
+    logger.debug("Response text: %s", LazyText(response))
+    return response.status_code
+
+def image_error(filename, file_path, e):
+    if isinstance(e, FileNotFoundError):
         print(f"File {file_path} not found.")
         logger.error(f"File {file_path} not found")
-    except Exception as e:
+    else:
         print(f"An error occurred while uploading {filename}: {traceback.format_exc()}")
         logger.error(f"An error occurred while uploading {filename}: {traceback.format_exc()}")
 
-def process_images(image_source, custID, api_url, reseller=None, local=False, exclude_filenames=None):
+def create_image(custID, filename, file_path, api_url, reseller=None, client=None, index=None, file_data=None):
+    client = client or get_client(api_url)
+    url, headers, payload, mime_type, method = image_request(filename, file_path, api_url, reseller, index)
+    try:
+        # file_data holds an in-memory variant; file_path then only names it
+        with (BytesIO(file_data) if file_data is not None else open(file_path, "rb")) as file:
+            files = {"File": (filename, file, mime_type)}
+            if method == "PUT":
+                response = client.put(url, headers=headers, data=payload, files=files)
+            else:
+                response = client.post(url, headers=headers, data=payload, files=files, conflict_safe=True)
+                if image_conflicted(response, filename):
+                    file.seek(0)
+                    response = client.put(url, headers=headers, data=payload, files=files)
+    except Exception as e:
+        return image_error(filename, file_path, e)
+    return image_uploaded(response, filename, payload, index)
+
+def report_uploads(results, reseller=None):
+    """Print and log how many of the {filename: status} uploads succeeded."""
+    failed = {filename: status for filename, status in results.items() if status not in (200, 201, 202)}
+    print(f"Uploaded {len(results) - len(failed)} of {len(results)} images for {reseller or 'system'}")
+    logger.info(f"Uploaded {len(results) - len(failed)} of {len(results)} images for {reseller or 'system'}")
+    for filename, status in sorted(failed.items()):
+        print(f"Failed to upload {filename}: {status if status is not None else 'error'}")
+        logger.error(f"Failed to upload {filename} for {reseller or 'system'}: {status if status is not None else 'error'}")
+    return results
+
+def upload_images(custID, uploads, api_url, reseller=None, client=None, index=None, max_workers=DEFAULT_UPLOAD_WORKERS):
+    # uploads: (filename, file_path, file_data) tuples; each upload is independent
+    client = client or get_client(api_url)
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(propagate(create_image), custID, filename, file_path, api_url, reseller, client=client, index=index, file_data=file_data): filename
+                   for filename, file_path, file_data in uploads}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    return report_uploads(results, reseller)
+
+def process_images(image_source, custID, api_url, reseller=None, local=False, exclude_filenames=None, client=None, index=None, in_memory=False, variants=None):
     output_directory = "image_files"
-    filename_mapping = {
-        "512PWA.png": "512x512.jpg",
-        "192PWA.png": "192x192.jpg",
-        "favicon.gif": "192x192.jpg",
-        "video_main_top_left.png": "250x150.jpg",
-        "video_login.png": "250x150.jpg",
-        "portal_main_top_left.png": "250x150.jpg",
-        "portal_landing.png": "250x150.jpg",
-        "webphone_main_top_left.png": "250x150.jpg"
-    }
+    filename_mapping = FILENAME_MAPPING
 
     if exclude_filenames is None:
         exclude_filenames = []
 
+    if in_memory or variants is not None:
+        return process_images_in_memory(image_source, custID, api_url, filename_mapping, reseller, local, exclude_filenames, client, index, variants)
+
     if local:
         # Process local file
         print(f"Processing local image: {image_source} for reseller: {reseller}")
@@ -78,23 +147,24 @@ def process_images(image_source, custID, api_url, reseller=None, local=False, ex
             logger.error(f"Local image file {image_source} not found")
             return False  # Indicate failure
         
-        with Image.open(image_source) as original_image:
-            if original_image.mode == "RGBA":
-                print("Converting RGBA image to RGB")
-                logger.info("Converting RGBA image to RGB")
-                original_image = original_image.convert("RGB")
-            sizes = [(192, 192), (512, 512), (250, 150)]
-            for size in sizes:
-                resized_image = original_image.resize(size)
-                filename = f"{size[0]}x{size[1]}"
-                output_path = os.path.join(output_directory, f"{filename}.jpg")
-                resized_image.save(output_path)
-                print(f"Resized image saved to {output_path}")
-                logger.info(f"Resized image saved to {output_path}")
+        try:
+            from PIL import Image
+            from resize import resize_variants
+            with Image.open(image_source) as original_image:
+                for name, resized_image in resize_variants(original_image).items():
+                    output_path = os.path.join(output_directory, name)
+                    resized_image.save(output_path)
+                    print(f"Resized image saved to {output_path}")
+                    logger.info(f"Resized image saved to {output_path}")
+        except (OSError, ValueError) as e:
+            print(f"Error resizing local image {image_source}: {e}")
+            logger.error(f"Error resizing local image {image_source}: {e}")
+            return False
     else:
         # Process URL
         print(f"Resizing image from URL: {image_source}")
         logger.info(f"Resizing image from URL: {image_source}")
+        from resize import resize_image_from_url
         resize_image_from_url(image_source, output_directory)
 
     all_files_exist = all(os.path.exists(os.path.join(output_directory, image_file)) for image_file in filename_mapping.values())
@@ -103,6 +173,7 @@ def process_images(image_source, custID, api_url, reseller=None, local=False, ex
         logger.error(f"Error: Not all resized images were created for {reseller or 'system'}")
         return False  # Indicate failure
 
+    uploads = []
     for filename, image_file in filename_mapping.items():
         if filename in exclude_filenames:
             print(f"Skipping upload for {filename} as per exclusion list")
@@ -111,11 +182,63 @@ def process_images(image_source, custID, api_url, reseller=None, local=False, ex
         file_path = os.path.join(output_directory, image_file)
         print(f"Uploading {filename} from {file_path}")
         logger.info(f"Uploading {filename} from {file_path}")
-        create_image(custID, filename, file_path, api_url, reseller)
+        uploads.append((filename, file_path, None))
+    upload_images(custID, uploads, api_url, reseller, client=client, index=index)
     
     return True  # Indicate success
 
+def build_variants(image_source, local=False):
+    """Resize and encode every branding variant in memory; returns {variant name: JPEG bytes} or None.
+
+    Top-level and free of shared state so it can also run in a worker process.
+    """
+    # Pillow is imported here rather than at module load so runs that skip branding never pay for it
+    from resize import variants_from_file, variants_from_url
+    if local:
+        if not os.path.exists(image_source):
+            print(f"Local image file {image_source} not found")
+            logger.error(f"Local image file {image_source} not found")
+            return None
+        return variants_from_file(image_source, cache=get_default_cache())
+    print(f"Resizing image from URL in memory: {image_source}")
+    logger.info(f"Resizing image from URL in memory: {image_source}")
+    return variants_from_url(image_source, cache=get_default_cache())
+
+def in_memory_uploads(variants, filename_mapping, exclude_filenames=(), reseller=None):
+    """(filename, variant name, variant bytes) uploads for every mapped filename, or None if a variant is missing."""
+    if not variants or not all(image_file in variants for image_file in filename_mapping.values()):
+        print(f"Error: Not all resized images were created for {reseller or 'system'}")
+        logger.error(f"Error: Not all resized images were created for {reseller or 'system'}")
+        return None
+
+    uploads = []
+    for filename, image_file in filename_mapping.items():
+        if filename in exclude_filenames:
+            print(f"Skipping upload for {filename} as per exclusion list")
+            logger.info(f"Skipping upload for {filename} as per exclusion list")
+            continue
+        print(f"Uploading {filename} from in-memory {image_file}")
+        logger.info(f"Uploading {filename} from in-memory {image_file}")
+        uploads.append((filename, image_file, variants[image_file]))
+    return uploads
+
+def process_images_in_memory(image_source, custID, api_url, filename_mapping, reseller=None, local=False, exclude_filenames=(), client=None, index=None, variants=None):
+    # Each variant is encoded once and shared by every filename mapped to it; nothing is written to disk
+    if variants is None:
+        if local:
+            print(f"Processing local image in memory: {image_source} for reseller: {reseller}")
+            logger.info(f"Processing local image in memory: {image_source} for reseller: {reseller}")
+        variants = build_variants(image_source, local)
+
+    uploads = in_memory_uploads(variants, filename_mapping, exclude_filenames, reseller)
+    if uploads is None:
+        return False
+    upload_images(custID, uploads, api_url, reseller, client=client, index=index)
+
+    return True
+
 if __name__ == "__main__":
+    start_profiling("create_image")
     print("Starting image processing script")
     logger.info("Starting image processing script")
     custID = input("Enter the host ID (e.g., sgdemo): ").strip()
@@ -1,14 +1,14 @@
-import requests
 import json
 import os
-from dotenv import load_dotenv
-from logging_setup import setup_logging
+from settings import load_env
+from logging_setup import setup_logging, LazyJSON, LazyText
+from ns_client import get_client
 
 # Initialize logger
-logger = setup_logging()
+logger = setup_logging(__name__)
 
 # Load variables from the .env file into the environment
-load_dotenv()
+load_env()
 
 # Retrieve the API token
 API_TOKEN = os.getenv("API_TOKEN")
@@ -16,35 +16,55 @@ API_TOKEN = os.getenv("API_TOKEN")
 print(API_TOKEN)
 logger.info(f"Loaded API_TOKEN: {API_TOKEN}")
 
-def create_reseller(custID, reseller_name, description, api_url):
+def reseller_payload(reseller_name, description):
+    return {
+        "reseller": reseller_name,
+        "description": description
+    }
+
+def reseller_request(reseller_name, description, api_url, index=None):
+    """Log and return (url, headers, data) for creating a reseller, or None if the index already has it."""
+    if index and index.has_reseller(reseller_name):
+        print(f"Reseller {reseller_name} already exists, skipping")
+        logger.info(f"Reseller {reseller_name} already exists in existence index, skipping")
+        return None
     url = f"{api_url}/ns-api/v2/resellers"
     headers = {
         'accept': '*/*',
-        'content-type': 'application/json',
-        'Authorization': f'Bearer {API_TOKEN}'
-    }
-    data = {
-        "reseller": reseller_name,
-        "description": description
+        'content-type': 'application/json'
     }
+    data = reseller_payload(reseller_name, description)
     
     print(f"Calling API URL: {url}")
     logger.info(f"Calling API URL: {url}")
     print(f"Headers being sent: {headers}")
-    logger.debug(f"Headers being sent: {json.dumps(headers, indent=2)}")
+    logger.debug("Headers being sent: %s", LazyJSON(headers))
     print(f"Data being sent: {data}")
-    logger.debug(f"Data being sent: {json.dumps(data, indent=2)}")
-    
-    response = requests.post(url, headers=headers, data=json.dumps(data))
-    
+    logger.debug("Data being sent: %s", LazyJSON(data))
+    return url, headers, data
+
+def reseller_created(response, reseller_name, index=None):
+    """Report the create response, record a new reseller in the index and return the status code."""
     if response.status_code in (201, 202):
         print("Reseller created successfully")
         logger.info(f"Reseller {reseller_name} created successfully with status code: {response.status_code}")
+        if index:
+            index.add_reseller(reseller_name)
     else:
         print(f"Failed to create reseller: {response.status_code}")
         logger.error(f"Failed to create reseller {reseller_name}: {response.status_code}")
         print(response.text)
-        logger.debug(f"Response text: {response.text}")
+        logger.debug("Response text: %s", LazyText(response))
+    return response.status_code
+
+def create_reseller(custID, reseller_name, description, api_url, client=None, index=None):
+    client = client or get_client(api_url)
+    request = reseller_request(reseller_name, description, api_url, index)
+    if request is None:
+        return 200
+    url, headers, data = request
+    response = client.post(url, headers=headers, data=json.dumps(data))
+    return reseller_created(response, reseller_name, index)
 
 if __name__ == "__main__":
     print("Starting reseller creation script")
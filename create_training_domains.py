@@ -1,17 +1,25 @@
 import os
 import requests
-import shutil
 import json
 import re
-from dotenv import load_dotenv
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from settings import load_env
 from create_image import process_images
-from logging_setup import setup_logging
+from logging_setup import setup_logging, LazyJSON, LazyText
+from ns_client import get_client
+from task_graph import TaskGraph, DEFAULT_GRAPH_WORKERS
+from existence_index import ExistenceIndex
+from journal import get_journal, finish_journal
+from readiness import get_waiter
+from tracing import propagate
+from profiling import start_profiling
 
 # Initialize logger
-logger = setup_logging()
+logger = setup_logging(__name__)
 
 # Load environment variables
-load_dotenv(override=True)
+load_env()
 
 # Retrieve the API token
 API_TOKEN = os.getenv("API_TOKEN")
@@ -20,13 +28,29 @@ if not API_TOKEN:
 print(f"Loaded API_TOKEN: {API_TOKEN}")
 logger.info(f"Loaded API_TOKEN: {API_TOKEN}")
 
-def create_reseller(custID, reseller, api_url, description="Training reseller created via API"):
+DEFAULT_AGENT_WORKERS = int(os.getenv("NS_AGENT_WORKERS", "4"))
+
+# Agent rosters fetched per (api_url, domain, callqueue), kept current as adds succeed. A bulk add
+# always fetches a fresh one, and a failed add drops it so the next check asks the API again
+_agent_rosters = {}
+_agent_rosters_lock = threading.Lock()
+
+def clear_agent_rosters():
+    """Forget every cached roster, e.g. after the API's objects were wiped."""
+    with _agent_rosters_lock:
+        _agent_rosters.clear()
+
+def create_reseller(custID, reseller, api_url, description="Training reseller created via API", client=None, index=None):
     api_url = api_url.rstrip('/')
+    client = client or get_client(api_url)
+    if index and index.has_reseller(reseller):
+        print(f"Reseller {reseller} already exists, skipping.")
+        logger.info(f"Reseller '{reseller}' already exists in existence index, skipping")
+        return 200
     url = f"{api_url}/ns-api/v2/resellers"
     headers = {
         'accept': '*/*',
-        'content-type': 'application/json',
-        'Authorization': f'Bearer {API_TOKEN}'
+        'content-type': 'application/json'
     }
     data = {
         "reseller": reseller,
@@ -35,14 +59,16 @@ def create_reseller(custID, reseller, api_url, description="Training reseller cr
     print(f"Calling API URL: {url}")
     logger.info(f"Calling API URL: {url} to create reseller: {reseller}")
     print(f"Request payload: {json.dumps(data, indent=2)}")
-    logger.debug(f"Request payload: {json.dumps(data, indent=2)}")
+    logger.debug("Request payload: %s", LazyJSON(data))
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(data))
+        response = client.post(url, headers=headers, data=json.dumps(data), conflict_safe=True)
         print(f"Status Code: {response.status_code}")
         logger.info(f"Status Code: {response.status_code} for reseller: {reseller}")
         if response.status_code in [200, 201, 202]:
             print(f"Reseller {reseller} created successfully")
             logger.info(f"Reseller '{reseller}' created successfully with status code: {response.status_code}")
+            if index:
+                index.add_reseller(reseller)
         elif response.status_code == 409:
             print(f"Reseller {reseller} already exists, skipping.")
             logger.info(f"Reseller '{reseller}' already exists, skipping (Status: 409)")
@@ -50,18 +76,23 @@ def create_reseller(custID, reseller, api_url, description="Training reseller cr
             print(f"Failed to create reseller {reseller}: {response.status_code}")
             logger.error(f"Failed to create reseller '{reseller}': {response.status_code}")
         print(response.text)
-        logger.debug(f"Response text: {response.text}")
+        logger.debug("Response text: %s", LazyText(response))
+        return response.status_code
     except requests.exceptions.RequestException as e:
         print(f"Error calling {url}: {e}")
         logger.error(f"Error calling {url} to create reseller '{reseller}': {e}")
 
-def create_domain(custID, domain, reseller, description, dial_plan, dial_policy, api_url):
+def create_domain(custID, domain, reseller, description, dial_plan, dial_policy, api_url, client=None, index=None):
     api_url = api_url.rstrip('/')
+    client = client or get_client(api_url)
+    if index and index.has_domain(domain):
+        print(f"Domain {domain} already exists, skipping.")
+        logger.info(f"Domain '{domain}' already exists in existence index, skipping")
+        return 200
     url = f"{api_url}/ns-api/v2/domains"
     headers = {
         'accept': 'application/json',
-        'content-type': 'application/json',
-        'Authorization': f'Bearer {API_TOKEN}'
+        'content-type': 'application/json'
     }
     data = {
         "domain": domain,
@@ -81,30 +112,37 @@ def create_domain(custID, domain, reseller, description, dial_plan, dial_policy,
     print(f"Calling API URL: {url}")
     logger.info(f"Calling API URL: {url} to create domain: {domain}")
     print(f"Request payload: {json.dumps(data, indent=2)}")
-    logger.debug(f"Request payload: {json.dumps(data, indent=2)}")
+    logger.debug("Request payload: %s", LazyJSON(data))
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(data))
+        response = client.post(url, headers=headers, data=json.dumps(data))
         print(f"Status Code: {response.status_code}")
         logger.info(f"Status Code: {response.status_code} for domain: {domain}")
         if response.status_code in [200, 201, 202]:
             print(f"Domain {domain} created successfully with dial plan {dial_plan}")
             logger.info(f"Domain '{domain}' created successfully with dial plan '{dial_plan}' with status code: {response.status_code}")
+            if index:
+                index.add_domain(domain)
         else:
             print(f"Failed to create domain: {response.status_code}")
             logger.error(f"Failed to create domain '{domain}': {response.status_code}")
         print(response.text)
-        logger.debug(f"Response text: {response.text}")
+        logger.debug("Response text: %s", LazyText(response))
+        return response.status_code
     except requests.exceptions.RequestException as e:
         print(f"Error calling {url}: {e}")
         logger.error(f"Error calling {url} to create domain '{domain}': {e}")
 
-def create_user(custID, domain, extension, first_name, last_name, email, user_scope, api_url):
+def create_user(custID, domain, extension, first_name, last_name, email, user_scope, api_url, client=None, index=None):
     api_url = api_url.rstrip('/')
+    client = client or get_client(api_url)
+    if index and index.has_user(domain, extension):
+        print(f"User {extension} already exists in {domain}, skipping.")
+        logger.info(f"User '{extension}' already exists in domain '{domain}' in existence index, skipping")
+        return 200
     url = f"{api_url}/ns-api/v2/domains/{domain}/users"
     headers = {
         'accept': 'application/json',
-        'content-type': 'application/json',
-        'Authorization': f'Bearer {API_TOKEN}'
+        'content-type': 'application/json'
     }
     data = {
         "synchronous": "no",
@@ -154,30 +192,37 @@ def create_user(custID, domain, extension, first_name, last_name, email, user_sc
     print(f"Calling API URL: {url}")
     logger.info(f"Calling API URL: {url} to create user: {first_name} {last_name} (Ext: {extension})")
     print(f"Request payload: {json.dumps(data, indent=2)}")
-    logger.debug(f"Request payload: {json.dumps(data, indent=2)}")
+    logger.debug("Request payload: %s", LazyJSON(data))
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(data))
+        response = client.post(url, headers=headers, data=json.dumps(data))
         print(f"Status Code: {response.status_code}")
         logger.info(f"Status Code: {response.status_code} for user: {first_name} {last_name} (Ext: {extension})")
         if response.status_code in [200, 201, 202]:
             print(f"User {first_name} {last_name} (Ext: {extension}, Scope: {user_scope}) created successfully")
             logger.info(f"User '{first_name} {last_name}' (Ext: {extension}, Scope: {user_scope}) created successfully with status code: {response.status_code}")
+            if index:
+                index.add_user(domain, extension)
         else:
             print(f"Failed to create user: {response.status_code}")
             logger.error(f"Failed to create user '{first_name} {last_name}' (Ext: {extension}): {response.status_code}")
         print(response.text)
-        logger.debug(f"Response text: {response.text}")
+        logger.debug("Response text: %s", LazyText(response))
+        return response.status_code
     except requests.exceptions.RequestException as e:
         print(f"Error calling {url}: {e}")
         logger.error(f"Error calling {url} to create user '{first_name} {last_name}' (Ext: {extension}): {e}")
 
-def create_device(custID, domain, extension, api_url):
+def create_device(custID, domain, extension, api_url, client=None, index=None):
     api_url = api_url.rstrip('/')
+    client = client or get_client(api_url)
+    if index and index.has_device(domain, extension, extension):
+        print(f"Device for extension {extension} already exists, skipping.")
+        logger.info(f"Device for extension {extension} already exists in existence index, skipping")
+        return 200
     url = f"{api_url}/ns-api/v2/domains/{domain}/users/{extension}/devices"
     headers = {
         'accept': 'application/json',
-        'content-type': 'application/json',
-        'Authorization': f'Bearer {API_TOKEN}'
+        'content-type': 'application/json'
     }
     data = {
         "synchronous": "no",
@@ -200,14 +245,16 @@ def create_device(custID, domain, extension, api_url):
     print(f"Calling API URL: {url}")
     logger.info(f"Calling API URL: {url} to create device for extension: {extension}")
     print(f"Request payload: {json.dumps(data, indent=2)}")
-    logger.debug(f"Request payload: {json.dumps(data, indent=2)}")
+    logger.debug("Request payload: %s", LazyJSON(data))
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(data))
+        response = client.post(url, headers=headers, data=json.dumps(data), conflict_safe=True)
         print(f"Status Code: {response.status_code}")
         logger.info(f"Status Code: {response.status_code} for device extension: {extension}")
         if response.status_code in [200, 201, 202]:
             print(f"Device for extension {extension} created successfully")
             logger.info(f"Device for extension {extension} created successfully with status code: {response.status_code}")
+            if index:
+                index.add_device(domain, extension, extension)
         elif response.status_code == 409:
             print(f"Device for extension {extension} already exists, skipping.")
             logger.warning(f"Device for extension {extension} already exists, skipping (Status: 409)")
@@ -215,17 +262,22 @@ def create_device(custID, domain, extension, api_url):
             print(f"Failed to create device: {response.status_code}")
             logger.error(f"Failed to create device for extension {extension}: {response.status_code}")
         print(response.text)
-        logger.debug(f"Response text: {response.text}")
+        logger.debug("Response text: %s", LazyText(response))
+        return response.status_code
     except requests.exceptions.RequestException as e:
         print(f"Error calling {url}: {e}")
         logger.error(f"Error calling {url} to create device for extension {extension}: {e}")
 
-def create_call_park(custID, domain, callqueue, description, api_url):
+def create_call_park(custID, domain, callqueue, description, api_url, client=None, index=None):
     api_url = api_url.rstrip('/')
+    client = client or get_client(api_url)
+    if index and index.has_callqueue(domain, callqueue):
+        print(f"Call park {callqueue} already exists, skipping")
+        logger.info(f"Call park '{callqueue}' already exists in existence index, skipping")
+        return 200
     url = f"{api_url}/ns-api/"
     headers = {
-        'accept': '*/*',
-        'Authorization': f'Bearer {API_TOKEN}'
+        'accept': '*/*'
     }
     data = {
         "object": "callqueue",
@@ -259,16 +311,18 @@ def create_call_park(custID, domain, callqueue, description, api_url):
     print(f"Calling API URL: {url}")
     logger.info(f"Calling API URL: {url} to create call park: {callqueue}")
     print(f"Request payload: {json.dumps(data, indent=2)}")
-    logger.debug(f"Request payload: {json.dumps(data, indent=2)}")
+    logger.debug("Request payload: %s", LazyJSON(data))
     
     try:
-        response = requests.post(url, headers=headers, data=data)
+        response = client.post(url, headers=headers, data=data, conflict_safe=True)
         print(f"Status Code: {response.status_code}")
         logger.info(f"Status Code: {response.status_code} for call park: {callqueue}")
         
         if response.status_code in [200, 201, 202]:
             print(f"Call park {callqueue} ({description}) created successfully")
             logger.info(f"Call park '{callqueue}' ({description}) created successfully with status code: {response.status_code}")
+            if index:
+                index.add_callqueue(domain, callqueue)
         elif response.status_code == 409:
             print(f"Call park {callqueue} already exists, skipping")
             logger.info(f"Call park '{callqueue}' already exists, skipping (Status: 409)")
@@ -277,20 +331,14 @@ def create_call_park(custID, domain, callqueue, description, api_url):
             logger.error(f"Failed to create call park '{callqueue}': {response.status_code}")
         
         print(response.text)
-        logger.debug(f"Response text: {response.text}")
+        logger.debug("Response text: %s", LazyText(response))
+        return response.status_code
     except requests.exceptions.RequestException as e:
         print(f"Error calling {url}: {e}")
         logger.error(f"Error calling {url} to create call park '{callqueue}': {e}")
 
-def create_call_queue(custID, domain, callqueue, description, api_url, dispatch_type="Ring All"):
-    api_url = api_url.rstrip('/')
-    url = f"{api_url}/ns-api/v2/domains/{domain}/callqueues"
-    headers = {
-        'accept': '*/*',
-        'content-type': 'application/json',
-        'Authorization': f'Bearer {API_TOKEN}'
-    }
-    data = {
+def call_queue_payload(callqueue, description, dispatch_type="Ring All"):
+    return {
         "synchronous": "no",
         "callqueue": callqueue,
         "description": description,
@@ -299,87 +347,210 @@ def create_call_queue(custID, domain, callqueue, description, api_url, dispatch_
         "callqueue-agent-dispatch-timeout-seconds": 12,
         "callqueue-force-full-intro-playback": "no"
     }
+
+def call_queue_request(domain, callqueue, description, api_url, dispatch_type="Ring All", index=None):
+    """Log and return (url, headers, data) for creating a call queue, or None if the index already has it."""
+    if index and index.has_callqueue(domain, callqueue):
+        print(f"Call queue {callqueue} already exists, skipping")
+        logger.info(f"Call queue '{callqueue}' already exists in existence index, skipping")
+        return None
+    url = f"{api_url}/ns-api/v2/domains/{domain}/callqueues"
+    headers = {
+        'accept': '*/*',
+        'content-type': 'application/json'
+    }
+    data = call_queue_payload(callqueue, description, dispatch_type)
     print(f"Calling API URL: {url}")
     logger.info(f"Calling API URL: {url} to create call queue: {callqueue}")
     print(f"Request payload: {json.dumps(data, indent=2)}")
-    logger.debug(f"Request payload: {json.dumps(data, indent=2)}")
+    logger.debug("Request payload: %s", LazyJSON(data))
+    return url, headers, data
+
+def call_queue_created(response, domain, callqueue, description, index=None):
+    """Report the create response, record a new call queue in the index and return the status code."""
+    print(f"Status Code: {response.status_code}")
+    logger.info(f"Status Code: {response.status_code} for call queue: {callqueue}")
+    if response.status_code in [200, 201, 202]:
+        print(f"Call queue {callqueue} ({description}) created successfully")
+        logger.info(f"Call queue '{callqueue}' ({description}) created successfully with status code: {response.status_code}")
+        if index:
+            index.add_callqueue(domain, callqueue)
+    elif response.status_code == 409:
+        print(f"Call queue {callqueue} already exists, skipping")
+        logger.info(f"Call queue '{callqueue}' already exists, skipping (Status: 409)")
+    else:
+        print(f"Failed to create call queue {callqueue}: {response.status_code}")
+        logger.error(f"Failed to create call queue '{callqueue}': {response.status_code}")
+    print(response.text)
+    logger.debug("Response text: %s", LazyText(response))
+    return response.status_code
+
+def call_queue_error(url, callqueue, e):
+    print(f"Error calling {url}: {e}")
+    logger.error(f"Error calling {url} to create call queue '{callqueue}': {e}")
+
+def create_call_queue(custID, domain, callqueue, description, api_url, dispatch_type="Ring All", client=None, index=None):
+    api_url = api_url.rstrip('/')
+    client = client or get_client(api_url)
+    request = call_queue_request(domain, callqueue, description, api_url, dispatch_type, index)
+    if request is None:
+        return 200
+    url, headers, data = request
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(data))
-        print(f"Status Code: {response.status_code}")
-        logger.info(f"Status Code: {response.status_code} for call queue: {callqueue}")
-        if response.status_code in [200, 201, 202]:
-            print(f"Call queue {callqueue} ({description}) created successfully")
-            logger.info(f"Call queue '{callqueue}' ({description}) created successfully with status code: {response.status_code}")
-        elif response.status_code == 409:
-            print(f"Call queue {callqueue} already exists, skipping")
-            logger.info(f"Call queue '{callqueue}' already exists, skipping (Status: 409)")
-        else:
-            print(f"Failed to create call queue {callqueue}: {response.status_code}")
-            logger.error(f"Failed to create call queue '{callqueue}': {response.status_code}")
-        print(response.text)
-        logger.debug(f"Response text: {response.text}")
+        response = client.post(url, headers=headers, data=json.dumps(data), conflict_safe=True)
     except requests.exceptions.RequestException as e:
-        print(f"Error calling {url}: {e}")
-        logger.error(f"Error calling {url} to create call queue '{callqueue}': {e}")
+        return call_queue_error(url, callqueue, e)
+    return call_queue_created(response, domain, callqueue, description, index)
 
-def add_agent_to_call_queue(custID, domain, callqueue, agent_extension, api_url):
-    api_url = api_url.rstrip('/')
+def cached_agents(client, domain, callqueue):
+    with _agent_rosters_lock:
+        return _agent_rosters.get((client.api_url, domain, callqueue))
+
+def agents_request(domain, callqueue, api_url):
     url = f"{api_url}/ns-api/v2/domains/{domain}/callqueues/{callqueue}/agents"
-    headers = {
-        'accept': 'application/json',
-        'content-type': 'application/json',
-        'Authorization': f'Bearer {API_TOKEN}'
-    }
-    agent_id = f"{agent_extension}@{domain}"
+    print(f"Fetching agents for call queue {callqueue}")
+    logger.info(f"Fetching agents for call queue {callqueue} in domain {domain}")
+    return url, {'accept': 'application/json'}
 
-    print(f"Checking if agent {agent_extension} is already in call queue {callqueue}")
-    logger.info(f"Checking if agent {agent_extension} is already in call queue {callqueue}")
+def agents_fetched(response, client, domain, callqueue):
+    """Cache and return the agent ids in a roster listing, or None if it could not be read."""
+    if response.status_code != 200:
+        print(f"Failed to fetch agents for queue {callqueue}: {response.status_code}")
+        logger.warning(f"Failed to fetch agents for queue {callqueue}: {response.status_code}")
+        return None
     try:
-        get_response = requests.get(url, headers=headers)
-        if get_response.status_code == 200:
-            agents = get_response.json()
-            for agent in agents:
-                if agent.get("callqueue-agent-id") == agent_id:
-                    print(f"Agent {agent_extension} already exists in call queue {callqueue}, skipping")
-                    logger.info(f"Agent '{agent_extension}' already exists in call queue '{callqueue}', skipping")
-                    return
-        else:
-            print(f"Failed to fetch agents for queue {callqueue}: {get_response.status_code}")
-            logger.warning(f"Failed to fetch agents for queue {callqueue}: {get_response.status_code}")
+        roster = {agent.get("callqueue-agent-id") for agent in response.json()}
+    except ValueError as e:
+        return agents_error(callqueue, e)
+    with _agent_rosters_lock:
+        _agent_rosters[(client.api_url, domain, callqueue)] = roster
+    return roster
+
+def agents_error(callqueue, e):
+    print(f"Error checking agents for queue {callqueue}: {e}")
+    logger.error(f"Error checking agents for queue {callqueue}: {e}")
+
+def get_call_queue_agents(custID, domain, callqueue, api_url, client=None, refresh=False):
+    api_url = api_url.rstrip('/')
+    client = client or get_client(api_url)
+    roster = None if refresh else cached_agents(client, domain, callqueue)
+    if roster is not None:
+        return roster
+    url, headers = agents_request(domain, callqueue, api_url)
+    try:
+        response = client.get(url, headers=headers)
     except requests.exceptions.RequestException as e:
-        print(f"Error checking agents for queue {callqueue}: {e}")
-        logger.error(f"Error checking agents for queue {callqueue}: {e}")
+        return agents_error(callqueue, e)
+    return agents_fetched(response, client, domain, callqueue)
 
-    data = {
+def agent_payload(domain, callqueue, agent_extension):
+    return {
         "synchronous": "no",
         "callqueue-agent-wrap-up-allowance-seconds": 0,
         "auto-answer-enabled": "no",
         "callqueue-agent-answer-confirmation-enabled": "no",
-        "callqueue-agent-id": agent_id,
+        "callqueue-agent-id": f"{agent_extension}@{domain}",
         "callqueue": callqueue,
         "domain": domain
     }
+
+def agent_request(domain, callqueue, agent_extension, api_url):
+    """Log and return (url, headers, data) for adding an agent to a call queue."""
+    url = f"{api_url}/ns-api/v2/domains/{domain}/callqueues/{callqueue}/agents"
+    headers = {
+        'accept': 'application/json',
+        'content-type': 'application/json'
+    }
+    data = agent_payload(domain, callqueue, agent_extension)
     print(f"Calling API URL: {url} to add agent {agent_extension} to call queue: {callqueue}")
     logger.info(f"Calling API URL: {url} to add agent {agent_extension} to call queue: {callqueue}")
     print(f"Request payload: {json.dumps(data, indent=2)}")
-    logger.debug(f"Request payload: {json.dumps(data, indent=2)}")
+    logger.debug("Request payload: %s", LazyJSON(data))
+    return url, headers, data
+
+def agent_added(response, client, domain, callqueue, agent_extension):
+    """Report the add response, keep the cached roster current and return the status code."""
+    print(f"Status Code: {response.status_code}")
+    logger.info(f"Status Code: {response.status_code} for adding agent {agent_extension} to call queue: {callqueue}")
+    if response.status_code in [200, 201, 202]:
+        print(f"Agent {agent_extension} added to call queue {callqueue} successfully")
+        logger.info(f"Agent '{agent_extension}' added to call queue '{callqueue}' successfully with status code: {response.status_code}")
+        with _agent_rosters_lock:
+            roster = _agent_rosters.get((client.api_url, domain, callqueue))
+            if roster is not None:
+                roster.add(f"{agent_extension}@{domain}")
+    else:
+        print(f"Failed to add agent {agent_extension} to call queue {callqueue}: {response.status_code}")
+        logger.error(f"Failed to add agent '{agent_extension}' to call queue '{callqueue}': {response.status_code}")
+        with _agent_rosters_lock:
+            _agent_rosters.pop((client.api_url, domain, callqueue), None)
+    print(response.text)
+    logger.debug("Response text: %s", LazyText(response))
+    return response.status_code
+
+def agent_error(url, client, domain, callqueue, agent_extension, e):
+    print(f"Error calling {url}: {e}")
+    logger.error(f"Error calling {url} to add agent '{agent_extension}' to call queue '{callqueue}': {e}")
+    with _agent_rosters_lock:
+        _agent_rosters.pop((client.api_url, domain, callqueue), None)
+
+def post_call_queue_agent(custID, domain, callqueue, agent_extension, api_url, client=None):
+    api_url = api_url.rstrip('/')
+    client = client or get_client(api_url)
+    url, headers, data = agent_request(domain, callqueue, agent_extension, api_url)
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(data))
-        print(f"Status Code: {response.status_code}")
-        logger.info(f"Status Code: {response.status_code} for adding agent {agent_extension} to call queue: {callqueue}")
-        if response.status_code in [200, 201, 202]:
-            print(f"Agent {agent_extension} added to call queue {callqueue} successfully")
-            logger.info(f"Agent '{agent_extension}' added to call queue '{callqueue}' successfully with status code: {response.status_code}")
-        else:
-            print(f"Failed to add agent {agent_extension} to call queue {callqueue}: {response.status_code}")
-            logger.error(f"Failed to add agent '{agent_extension}' to call queue '{callqueue}': {response.status_code}")
-        print(response.text)
-        logger.debug(f"Response text: {response.text}")
+        response = client.post(url, headers=headers, data=json.dumps(data))
     except requests.exceptions.RequestException as e:
-        print(f"Error calling {url}: {e}")
-        logger.error(f"Error calling {url} to add agent '{agent_extension}' to call queue '{callqueue}': {e}")
+        return agent_error(url, client, domain, callqueue, agent_extension, e)
+    return agent_added(response, client, domain, callqueue, agent_extension)
+
+def add_agent_to_call_queue(custID, domain, callqueue, agent_extension, api_url, client=None):
+    print(f"Checking if agent {agent_extension} is already in call queue {callqueue}")
+    logger.info(f"Checking if agent {agent_extension} is already in call queue {callqueue}")
+    roster = get_call_queue_agents(custID, domain, callqueue, api_url, client)
+    if roster is not None and f"{agent_extension}@{domain}" in roster:
+        print(f"Agent {agent_extension} already exists in call queue {callqueue}, skipping")
+        logger.info(f"Agent '{agent_extension}' already exists in call queue '{callqueue}', skipping")
+        return
+    post_call_queue_agent(custID, domain, callqueue, agent_extension, api_url, client)
+
+def missing_agents(roster, domain, callqueue, agent_extensions):
+    """Split agent_extensions into the ones to add and {extension: 200} for those already in the roster."""
+    known = roster if roster is not None else set()
+    missing = [extension for extension in dict.fromkeys(agent_extensions) if f"{extension}@{domain}" not in known]
+    results = {extension: 200 for extension in agent_extensions if extension not in missing}
+    if results:
+        print(f"Agents {', '.join(results)} already in call queue {callqueue}, skipping")
+        logger.info(f"Agents {', '.join(results)} already in call queue '{callqueue}', skipping")
+    return missing, results
 
-def create_training_domains(custID, api_url):
+def check_agents_added(results, missing, callqueue):
+    failed = [extension for extension in missing if results[extension] not in (200, 201, 202)]
+    if failed:
+        raise RuntimeError(f"Failed to add agents {', '.join(failed)} to call queue {callqueue}")
+    return results
+
+def add_agents_to_call_queue(custID, domain, callqueue, agent_extensions, api_url, client=None, max_workers=DEFAULT_AGENT_WORKERS):
+    api_url = api_url.rstrip('/')
+    client = client or get_client(api_url)
+    roster = get_call_queue_agents(custID, domain, callqueue, api_url, client, refresh=True)
+    missing, results = missing_agents(roster, domain, callqueue, agent_extensions)
+    if not missing:
+        return results
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(propagate(post_call_queue_agent), custID, domain, callqueue, extension, api_url, client): extension for extension in missing}
+        for future, extension in futures.items():
+            results[extension] = future.result()
+    return check_agents_added(results, missing, callqueue)
+
+def process_reseller_images(custID, reseller_info, api_url, client, index=None):
+    reseller_name = reseller_info["name"]
+    print(f"\n=== Processing images for reseller {reseller_name} ===")
+    logger.info(f"=== Processing images for reseller {reseller_name} ===")
+    return process_images(reseller_info["image_path"], custID, api_url, reseller=reseller_name, local=True, exclude_filenames=["192PWA.png", "512PWA.png"], client=client, index=index, in_memory=True)
+
+def create_training_domains(custID, api_url, client=None, max_workers=DEFAULT_GRAPH_WORKERS, index=None, journal=None):
     resellers = [
         {"name": "training_reseller1", "description": "Training reseller 1 created via API", "image_path": "reseller_images/reseller-one-logo.jpeg"},
         {"name": "training_reseller2", "description": "Training reseller 2 created via API", "image_path": "reseller_images/reseller-two-logo.jpg"}
@@ -414,62 +585,51 @@ def create_training_domains(custID, api_url):
         {"extension": "2006", "email": "office.manager@example.com"},
         {"extension": "2007", "email": "reseller@example.com"}
     ]
+    client = client or get_client(api_url)
+    # Domains, users and call queues here are created asynchronously; dependents wait until they exist
+    waiter = get_waiter(client)
+    graph = TaskGraph(f"training domains for {custID}")
 
-    print(f"\n=== Creating resellers for {custID} ===")
-    logger.info(f"=== Creating resellers for {custID} ===")
+    print(f"\n=== Building training domain task graph for {custID} ===")
+    logger.info(f"=== Building training domain task graph for {custID} ===")
     for reseller_info in resellers:
         reseller_name = reseller_info["name"]
-        create_reseller(custID, reseller_name, api_url, reseller_info["description"])
-        print(f"\n=== Processing images for reseller {reseller_name} ===")
-        logger.info(f"=== Processing images for reseller {reseller_name} ===")
-        image_dir = "image_files"
-        if os.path.exists(image_dir):
-            shutil.rmtree(image_dir)
-            os.makedirs(image_dir)
-            print(f"Cleared {image_dir} for {reseller_name}")
-            logger.info(f"Cleared {image_dir} for {reseller_name}")
-        process_images(reseller_info["image_path"], custID, api_url, reseller=reseller_name, local=True, exclude_filenames=["192PWA.png", "512PWA.png"])
-
-    print(f"\n=== Creating domain: {custID} with reseller: {custID}_reseller ===")
-    logger.info(f"=== Creating domain: {custID} with reseller: {custID}_reseller ===")
-    create_domain(custID, custID, f"{custID}_reseller", 'made via api', custID, dial_policy, api_url)
+        reseller_task = graph.add(f"reseller:{reseller_name}", create_reseller, custID, reseller_name, api_url, reseller_info["description"], client=client, index=index)
+        # Branding is built in memory, so resellers no longer share the image_files directory
+        graph.add(f"branding:{reseller_name}", process_reseller_images, custID, reseller_info, api_url, client, index, deps=[reseller_task])
+
+    graph.add(f"domain:{custID}", create_domain, custID, custID, f"{custID}_reseller", 'made via api', custID, dial_policy, api_url, client=client, index=index)
 
     for domain_info in domains:
         domain = domain_info["name"]
         reseller = domain_info["reseller"]
-        print(f"\n=== Creating domain: {domain} with reseller: {reseller} ===")
-        logger.info(f"=== Creating domain: {domain} with reseller: {reseller} ===")
-        create_domain(custID, domain, reseller, description, domain, dial_policy, api_url)
+        domain_task = graph.add(f"domain:{domain}", create_domain, custID, domain, reseller, description, domain, dial_policy, api_url, client=client, index=index, deps=[f"reseller:{reseller}"],
+                                ready=waiter.check("domain", None, domain))
 
-        print(f"\n=== Creating users and devices for {domain} ===")
-        logger.info(f"=== Creating users and devices for {domain} ===")
         for i, user in enumerate(users):
             scope = user_scopes[i]
             scope_parts = scope.split(" ")
             first_name = scope_parts[0]
             last_name = "User" if len(scope_parts) == 1 else " ".join(scope_parts[1:])
-            print(f"\nCreating user {user['extension']} with scope {scope}")
-            logger.info(f"Creating user {user['extension']} with scope {scope}")
-            create_user(custID, domain, user["extension"], first_name, last_name, user["email"], scope, api_url)
-            create_device(custID, domain, user["extension"], api_url)
+            user_task = graph.add(f"user:{domain}:{user['extension']}", create_user, custID, domain, user["extension"], first_name, last_name, user["email"], scope, api_url, client=client, index=index, deps=[domain_task],
+                                  ready=waiter.check("user", domain, user["extension"]))
+            graph.add(f"device:{domain}:{user['extension']}", create_device, custID, domain, user["extension"], api_url, client=client, index=index, deps=[user_task])
 
-        print(f"\n=== Creating call parks for {domain} ===")
-        logger.info(f"=== Creating call parks for {domain} ===")
         for park in call_parks:
-            create_call_park(custID, domain, park["callqueue"], park["description"], api_url)
+            graph.add(f"park:{domain}:{park['callqueue']}", create_call_park, custID, domain, park["callqueue"], park["description"], api_url, client=client, index=index, deps=[domain_task])
 
-        print(f"\n=== Creating call queues for {domain} ===")
-        logger.info(f"=== Creating call queues for {domain} ===")
         for queue in call_queues:
-            create_call_queue(custID, domain, queue["callqueue"], queue["description"], api_url)
+            queue_task = graph.add(f"queue:{domain}:{queue['callqueue']}", create_call_queue, custID, domain, queue["callqueue"], queue["description"], api_url, client=client, index=index, deps=[domain_task],
+                                   ready=waiter.check("callqueue", domain, queue["callqueue"]))
+            graph.add(f"agents:{domain}:{queue['callqueue']}", add_agents_to_call_queue, custID, domain, queue["callqueue"], agent_extensions, api_url, client=client,
+                      deps=[queue_task] + [f"user:{domain}:{agent_extension}" for agent_extension in agent_extensions])
 
-        print(f"\n=== Adding agents to call queues for {domain} ===")
-        logger.info(f"=== Adding agents to call queues for {domain} ===")
-        for queue in call_queues:
-            for agent_extension in agent_extensions:
-                add_agent_to_call_queue(custID, domain, queue["callqueue"], agent_extension, api_url)
+    graph.run(max_workers=max_workers, journal=journal)
+    graph.print_critical_path()
+    return graph
 
 if __name__ == "__main__":
+    start_profiling("create_training_domains")
     print("Starting training domains creation script")
     logger.info("Starting training domains creation script")
     custID = input("Enter the customer domain (e.g., sgdemo): ").strip()
@@ -482,6 +642,12 @@ if __name__ == "__main__":
     
     logger.info(f"Customer domain entered: {custID}")
     logger.info(f"API URL entered: {api_url}")
-    create_training_domains(custID, api_url)
+    client = get_client(api_url)
+    index = ExistenceIndex(client)
+    index.load()
+    journal = get_journal(api_url, custID)
+    create_training_domains(custID, api_url, client=client, index=index, journal=journal)
+    finish_journal(journal)
+    client.report()
     print("Training domains creation script completed")
     logger.info("Training domains creation script completed")
@@ -2,14 +2,15 @@ import requests
 import json
 import os
 import re
-from dotenv import load_dotenv
-from logging_setup import setup_logging
+from settings import load_env
+from logging_setup import setup_logging, LazyJSON, LazyText
+from ns_client import get_client
 
 # Initialize logger
-logger = setup_logging()
+logger = setup_logging(__name__)
 
 # Load variables from the .env file into the environment
-load_dotenv(override=True)
+load_env()
 
 # Retrieve the API token
 API_TOKEN = os.getenv("API_TOKEN")
@@ -35,28 +36,26 @@ def validate_name(name, field_name):
     logger.info(f"Validated {field_name.lower()}: {name}")
     return name
 
-def create_user(custID, domain, api_url):
+def validate_user(extension, first_name, last_name, email):
+    return (validate_extension(str(extension)), validate_name(first_name, "First name"),
+            validate_name(last_name, "Last name"), validate_email(email))
+
+def prompt_for_user():
     while True:
         try:
             extension = validate_extension(input("Enter the user extension (ID): ").strip())
             first_name = validate_name(input("Enter the first name: ").strip(), "First name")
             last_name = validate_name(input("Enter the last name: ").strip(), "Last name")
             email = validate_email(input("Enter the email address: ").strip())
-            break
+            return extension, first_name, last_name, email
         except ValueError as e:
             print(f"Error: {e}. Please try again.")
             logger.warning(f"Input validation error: {e}")
 
-    api_url = api_url.rstrip('/')
-    url = f"{api_url}/ns-api/v2/domains/{domain}/users"
-    headers = {
-        'accept': 'application/json',
-        'content-type': 'application/json',
-        'Authorization': f'Bearer {API_TOKEN}'
-    }
-    data = {
+def user_payload(domain, extension, first_name, last_name, email, user_scope="Super User"):
+    return {
         "synchronous": "no",
-        "user-scope": "Super User",
+        "user-scope": user_scope,
         "privacy": "no",
         "voicemail-user-control-enabled": "yes",
         "phone-numbers-to-allow-enabled": "yes",
@@ -99,29 +98,66 @@ def create_user(custID, domain, api_url):
         "voicemail-greeting-index": 0,
         "caller-id-name": f"{first_name} {last_name}"
     }
+
+def user_request(domain, extension, first_name, last_name, email, user_scope, api_url, index=None):
+    """Log and return (url, headers, data) for creating a user, or None if the index already has it."""
+    if index and index.has_user(domain, extension):
+        print(f"User {extension} already exists in {domain}, skipping")
+        logger.info(f"User '{extension}' already exists in domain '{domain}' in existence index, skipping")
+        return None
+    url = f"{api_url}/ns-api/v2/domains/{domain}/users"
+    headers = {
+        'accept': 'application/json',
+        'content-type': 'application/json'
+    }
+    data = user_payload(domain, extension, first_name, last_name, email, user_scope)
     
     print(f"Calling API URL: {url}")
     logger.info(f"Calling API URL: {url} to create user: {first_name} {last_name} (Ext: {extension})")
     print(f"Request payload: {json.dumps(data, indent=2)}")
-    logger.debug(f"Request payload: {json.dumps(data, indent=2)}")
+    logger.debug("Request payload: %s", LazyJSON(data))
+    return url, headers, data
+
+def user_created(response, domain, extension, first_name, last_name, index=None):
+    """Report the create response, record a new user in the index and return the status code."""
+    print(f"Status Code: {response.status_code}")
+    logger.info(f"Status Code: {response.status_code} for user: {first_name} {last_name} (Ext: {extension})")
+    
+    if response.status_code in [200, 201, 202]:
+        print(f"User {first_name} {last_name} (Ext: {extension}) created successfully")
+        logger.info(f"User '{first_name} {last_name}' (Ext: {extension}) created successfully with status code: {response.status_code}")
+        if index:
+            index.add_user(domain, extension)
+    else:
+        print(f"Failed to create user: {response.status_code}")
+        print(response.text)
+        logger.error(f"Failed to create user '{first_name} {last_name}' (Ext: {extension}): {response.status_code}")
+        logger.debug("Response text: %s", LazyText(response))
+    return response.status_code
+
+def user_error(url, extension, first_name, last_name, e):
+    print(f"Error calling {url}: {e}")
+    logger.error(f"Error calling {url} to create user '{first_name} {last_name}' (Ext: {extension}): {e}")
+
+def create_user(custID, domain, api_url, client=None, index=None, extension=None, first_name=None, last_name=None, email=None, user_scope="Super User"):
+    # Details passed in (e.g. from a tenant manifest) are used as-is; otherwise the SE is prompted
+    if extension is None:
+        extension, first_name, last_name, email = prompt_for_user()
+    else:
+        extension, first_name, last_name, email = validate_user(extension, first_name, last_name, email)
+
+    api_url = api_url.rstrip('/')
+    client = client or get_client(api_url)
+    request = user_request(domain, extension, first_name, last_name, email, user_scope, api_url, index)
+    if request is None:
+        return 200
+    url, headers, data = request
     
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(data))
-        
-        print(f"Status Code: {response.status_code}")
-        logger.info(f"Status Code: {response.status_code} for user: {first_name} {last_name} (Ext: {extension})")
-        
-        if response.status_code in [200, 201, 202]:
-            print(f"User {first_name} {last_name} (Ext: {extension}) created successfully")
-            logger.info(f"User '{first_name} {last_name}' (Ext: {extension}) created successfully with status code: {response.status_code}")
-        else:
-            print(f"Failed to create user: {response.status_code}")
-            print(response.text)
-            logger.error(f"Failed to create user '{first_name} {last_name}' (Ext: {extension}): {response.status_code}")
-            logger.debug(f"Response text: {response.text}")
+        response = client.post(url, headers=headers, data=json.dumps(data))
     except requests.exceptions.RequestException as e:
-        print(f"Error calling {url}: {e}")
-        logger.error(f"Error calling {url} to create user '{first_name} {last_name}' (Ext: {extension}): {e}")
+        return user_error(url, extension, first_name, last_name, e)
+    return user_created(response, domain, extension, first_name, last_name, index)
 
 if __name__ == "__main__":
     import re
@@ -1,19 +1,110 @@
 from create_domain import create_domain
 from create_reseller import create_reseller
 from create_image import process_images
-from ui_configs import update_configurations
+from ui_configs import update_configurations, load_configurations, prompt_for_config, push_configurations
 from connections import create_connection, create_second_connection, create_outbound_connection
 from routes import create_us_domestic_route
-from create_user import create_user
+from create_user import create_user, prompt_for_user
 from create_device import create_device  
 from create_training_domains import create_training_domains
 from logging_setup import setup_logging
+from ns_client import get_client
+from existence_index import ExistenceIndex
+from journal import get_journal, finish_journal, run_step
+from tracing import span
+from profiling import start_profiling
+from pipeline import Pipeline
+from task_graph import graph_succeeded
+from readiness import get_waiter
+import os
 import re
+import sys
 
 # Initialize logger
-logger = setup_logging()
+logger = setup_logging(__name__)
+
+def pipelined_mode():
+    return "--pipeline" in sys.argv or os.getenv("NS_PIPELINE", "0") == "1"
+
+def run_pipelined(custID, domain, api_url, client, journal):
+    """Interactive build that starts each step in the background as soon as its answers are in.
+
+    The reseller, connections, route and domain only need the host ID,
+    domain and API URL, so they start right away, with the training domains
+    after the reseller and domain; branding, configurations, users and
+    devices are queued as each prompt is answered.
+    """
+    pipeline = Pipeline(journal=journal)
+    index = ExistenceIndex(client)
+    waiter = get_waiter(client)
+    reseller = f"{custID}_reseller"
+    description = "Created via API app"
+
+    print("Starting reseller, connections, route, domain and training domains in the background")
+    logger.info("Starting reseller, connections, route, domain and training domains in the background")
+    index_step = pipeline.submit("existence-index", index.load, journaled=False, succeeded=None)
+    reseller_step = pipeline.submit(f"reseller:{reseller}", create_reseller, custID, reseller, description, api_url, client=client, index=index, deps=[index_step])
+    pipeline.submit("connection:inbound", create_connection, custID, api_url, client=client)
+    pipeline.submit("connection:second", create_second_connection, custID, api_url, client=client)
+    pipeline.submit("connection:outbound", create_outbound_connection, custID, api_url, client=client)
+    pipeline.submit("route:us-domestic", create_us_domestic_route, custID, api_url, client=client, deps=["connection:inbound"])
+    domain_step = pipeline.submit(f"domain:{domain}", create_domain, custID, domain, custID, 'made via api', domain, 'US and Canada', '858', 'NSEval', '8582834172', '8582834172', api_url,
+                                  client=client, index=index, deps=[index_step], ready=waiter.check("domain", None, domain))
+    # Records its own steps in the journal; also creates this domain under the reseller, so it waits for both
+    pipeline.submit("training-domains", create_training_domains, custID, api_url, client=client, index=index, journal=journal,
+                    deps=[reseller_step, domain_step], journaled=False, succeeded=graph_succeeded)
+
+    # Steps already queued still finish (and reach the journal) if the SE quits a prompt
+    try:
+        image_url = pipeline.prompt("Enter the image URL (or 'n' to skip): ").strip()
+        if image_url.lower() != "n":
+            reseller_input = pipeline.prompt("Enter the reseller value for image upload (or '*' for default): ").strip()
+            logger.info(f"Reseller value entered for image upload: {reseller_input}")
+            print(f"Queued image processing for {image_url}")
+            logger.info(f"Queued image processing for {image_url}")
+            pipeline.submit(f"branding:{reseller_input}", process_images, image_url, custID, reseller=reseller_input, api_url=api_url, client=client, index=index,
+                            in_memory=True, deps=[reseller_step])
+        else:
+            print("Skipping image processing")
+            logger.info("Skipping image processing")
+
+        config_prompt = pipeline.prompt("Would you like to update configurations? (y/n): ").strip().lower()
+        if config_prompt == 'y':
+            # Answer every value first; the push runs while the users are entered
+            configs = load_configurations("ui-configs.json", custID)
+            for config in configs:
+                prompt_for_config(config)
+            pipeline.submit("configurations", push_configurations, configs, api_url, client, index=index, deps=[reseller_step], journaled=False)
+        else:
+            print("Skipping configuration updates")
+            logger.info("Skipping configuration updates")
+
+        while True:
+            print(f"\n=== Creating a new user === {pipeline.status_line()}")
+            logger.info("=== Creating a new user ===")
+            extension, first_name, last_name, email = prompt_for_user()
+            user_step = pipeline.submit(f"user:{domain}:{extension}", create_user, custID, domain, api_url, client=client, index=index, extension=extension,
+                                        first_name=first_name, last_name=last_name, email=email, deps=[domain_step],
+                                        ready=waiter.check("user", domain, extension))
+
+            print("\n=== Creating device for the user ===")
+            logger.info("=== Creating device for the user ===")
+            device_extension = pipeline.prompt("Enter the extension for the device (same as user): ").strip()
+            logger.info(f"Extension entered: {device_extension}")
+            pipeline.submit(f"device:{domain}:{device_extension}", create_device, custID, domain, device_extension, api_url, client=client, index=index, deps=[user_step])
+
+            continue_prompt = pipeline.prompt("Would you like to create another user? (y/n): ").strip().lower()
+            if continue_prompt != 'y':
+                print("Done entering users and devices.")
+                logger.info("Done entering users and devices")
+                break
+            logger.info("Continuing to create another user")
+
+    finally:
+        pipeline.wait()
 
 if __name__ == "__main__":
+    start_profiling("eval-main")
     print("Starting NetSapiens API setup script")
     logger.info("Starting NetSapiens API setup script")
     
@@ -35,6 +126,27 @@ if __name__ == "__main__":
     logger.info(f"API URL entered: {api_url}")
     logger.info(f"Host ID entered: {cust_id}")
     logger.info(f"Domain name entered: {domain}")
+
+    # One pooled client is shared by every API call in this run
+    client = get_client(api_url)
+    # Resolve the host and open keep-alive connections while the build gets going
+    client.start_warm_up()
+
+    # Steps that finished in an interrupted earlier run are skipped
+    journal = get_journal(api_url, cust_id)
+
+    if pipelined_mode():
+        with span("pipelined build"):
+            run_pipelined(cust_id, domain, api_url, client, journal)
+        finish_journal(journal)
+        client.report()
+        print("NetSapiens API setup script completed")
+        logger.info("NetSapiens API setup script completed")
+        sys.exit(0)
+
+    # List what already exists on the host once so reruns skip objects instead of collecting 409s
+    index = ExistenceIndex(client)
+    index.load()
     
     custID = f"{cust_id}"
     domain = f"{domain}"
@@ -49,7 +161,8 @@ if __name__ == "__main__":
 
     print(f"Creating reseller: {reseller}")
     logger.info(f"Creating reseller: {reseller}")
-    create_reseller(custID, reseller, description, api_url)
+    with span("reseller", reseller=reseller):
+        run_step(journal, f"reseller:{reseller}", create_reseller, custID, reseller, description, api_url, client=client, index=index)
     
     image_url = input("Enter the image URL (or 'n' to skip): ").strip()
     if image_url.lower() != "n":
@@ -57,7 +170,8 @@ if __name__ == "__main__":
         logger.info(f"Reseller value entered for image upload: {reseller_input}")
         print(f"Processing image URL: {image_url}")
         logger.info(f"Processing image URL: {image_url}")
-        process_images(image_url, custID, reseller=reseller_input, api_url=api_url)
+        with span("branding", reseller=reseller_input):
+            run_step(journal, f"branding:{reseller_input}", process_images, image_url, custID, reseller=reseller_input, api_url=api_url, client=client, index=index, in_memory=True)
     else:
         print("Skipping image processing")
         logger.info("Skipping image processing")
@@ -66,45 +180,57 @@ if __name__ == "__main__":
     if config_prompt == 'y':
         print("Updating configurations")
         logger.info("Updating configurations")
-        update_configurations(custID, api_url=api_url)
+        with span("configurations"):
+            update_configurations(custID, api_url=api_url, client=client, concurrent=True, index=index)
     else:
         print("Skipping configuration updates")
         logger.info("Skipping configuration updates")
     
     print("Creating connections")
     logger.info("Creating connections")
-    create_connection(custID, api_url)
-    create_second_connection(custID, api_url)
-    create_outbound_connection(custID, api_url)
+    with span("connections"):
+        run_step(journal, "connection:inbound", create_connection, custID, api_url, client=client)
+        run_step(journal, "connection:second", create_second_connection, custID, api_url, client=client)
+        run_step(journal, "connection:outbound", create_outbound_connection, custID, api_url, client=client)
     print("Setting up US Domestic Route...")
     logger.info("Setting up US Domestic Route...")
-    create_us_domestic_route(custID, api_url)
+    with span("route"):
+        run_step(journal, "route:us-domestic", create_us_domestic_route, custID, api_url, client=client)
 
     print(f"Creating domain: {domain}")
     logger.info(f"Creating domain: {domain}")
-    create_domain(custID, domain, custID, 'made via api', domain, 'US and Canada', '858', 'NSEval', '8582834172', '8582834172', api_url)
+    with span("domain", domain=domain):
+        run_step(journal, f"domain:{domain}", create_domain, custID, domain, custID, 'made via api', domain, 'US and Canada', '858', 'NSEval', '8582834172', '8582834172', api_url, client=client, index=index)
     
-    while True:
-        print("\n=== Creating a new user ===")
-        logger.info("=== Creating a new user ===")
-        create_user(custID, domain, api_url)
+    # Includes time spent at the prompts; the user/device spans inside show the API work
+    with span("users"):
+        while True:
+            print("\n=== Creating a new user ===")
+            logger.info("=== Creating a new user ===")
+            with span("user", "object"):
+                create_user(custID, domain, api_url, client=client, index=index)
         
-        print("\n=== Creating device for the user ===")
-        logger.info("=== Creating device for the user ===")
-        extension = input("Enter the extension for the device (same as user): ").strip()
-        logger.info(f"Extension entered: {extension}")
-        create_device(custID, domain, extension, api_url)
+            print("\n=== Creating device for the user ===")
+            logger.info("=== Creating device for the user ===")
+            extension = input("Enter the extension for the device (same as user): ").strip()
+            logger.info(f"Extension entered: {extension}")
+            with span(f"device:{domain}:{extension}", "object"):
+                create_device(custID, domain, extension, api_url, client=client, index=index)
         
-        continue_prompt = input("Would you like to create another user? (y/n): ").strip().lower()
-        if continue_prompt != 'y':
-            print("Done creating users and devices.")
-            logger.info("Done creating users and devices")
-            break
-        logger.info("Continuing to create another user")
+            continue_prompt = input("Would you like to create another user? (y/n): ").strip().lower()
+            if continue_prompt != 'y':
+                print("Done creating users and devices.")
+                logger.info("Done creating users and devices")
+                break
+            logger.info("Continuing to create another user")
 
     print("Creating training domains")
     logger.info("Creating training domains")
-    create_training_domains(custID, api_url)
+    with span("training domains"):
+        create_training_domains(custID, api_url, client=client, index=index, journal=journal)
+    finish_journal(journal)
+
+    client.report()
     
     print("NetSapiens API setup script completed")
     logger.info("NetSapiens API setup script completed")
\ No newline at end of file
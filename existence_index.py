@@ -0,0 +1,208 @@
+import threading
+import requests
+from typing import Dict, Optional, Set, Tuple
+from logging_setup import setup_logging
+from tracing import span
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+class ExistenceIndex:
+    """In-memory index of objects that already exist on a NetSapiens host.
+
+    Lists are fetched once up front (and once per domain on first use) so the
+    create_* functions can skip objects that are already provisioned instead of
+    collecting a 409 for each one. A listing that fails is treated as unknown and
+    the caller simply sends the create as before.
+
+    Only configurations are compared by value, so a changed one is sent again,
+    and a known image is replaced with a PUT. Resellers, domains, users, devices
+    and call queues are matched on their key alone and skipped when they exist,
+    even if their details differ; each such answer is logged, so a skip whose
+    payload was never checked shows up in the logs.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._lock = threading.Lock()
+        self.resellers: Optional[Set[str]] = None
+        self.domains: Optional[Set[str]] = None
+        self.images: Optional[Set[Tuple[str, str]]] = None
+        self.configurations: Optional[Dict[Tuple[str, str, str, str], str]] = None
+        self.users: Dict[str, Optional[Set[str]]] = {}
+        self.devices: Dict[str, Optional[Set[str]]] = {}
+        self.callqueues: Dict[str, Optional[Set[str]]] = {}
+        # Domains being listed right now; other threads asking for one wait on its event
+        self._loading: Dict[str, threading.Event] = {}
+        self.requests_made = 0
+
+    def _list(self, path: str):
+        self.requests_made += 1
+        try:
+            response = self.client.get(f"/ns-api/v2/{path}")
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Could not list {path} for existence index: {e}")
+            return None
+        if response.status_code == 404:
+            return []
+        if response.status_code != 200:
+            logger.warning(f"Could not list {path} for existence index: {response.status_code}")
+            return None
+        try:
+            items = response.json()
+        except ValueError:
+            logger.warning(f"Could not parse {path} listing for existence index")
+            return None
+        return items if isinstance(items, list) else [items]
+
+    def _keys(self, path: str, field: str) -> Optional[Set[str]]:
+        items = self._list(path)
+        if items is None:
+            return None
+        return {str(item[field]) for item in items if isinstance(item, dict) and field in item}
+
+    def load(self) -> None:
+        """Fetch the host-wide resellers, domains, images and configurations."""
+        with span("existence index", "phase", api_url=self.client.api_url):
+            print("Building existence index")
+            logger.info(f"Building existence index for {self.client.api_url}")
+            self.resellers = self._keys("resellers", "reseller")
+            self.domains = self._keys("domains", "domain")
+
+            images = self._list("images")
+            if images is not None:
+                self.images = set()
+                for image in images:
+                    if isinstance(image, dict):
+                        filename = image.get("filename") or image.get("image") or image.get("name")
+                        if filename:
+                            self.images.add((filename, image.get("reseller", "*")))
+
+            configurations = self._list("configurations")
+            if configurations is not None:
+                self.configurations = {}
+                for config in configurations:
+                    if isinstance(config, dict) and "config-name" in config:
+                        self.configurations[self._config_key(config)] = str(config.get("config-value", ""))
+
+            summary = ", ".join(f"{len(values) if values is not None else 'unknown'} {name}" for name, values in [
+                ("resellers", self.resellers), ("domains", self.domains), ("images", self.images), ("configurations", self.configurations)
+            ])
+            print(f"Existence index loaded: {summary}")
+            logger.info(f"Existence index loaded: {summary}")
+
+    def load_domain(self, domain: str) -> None:
+        """Fetch a domain's users, devices and call queues unless they are already loaded."""
+        with self._lock:
+            if domain in self.users:
+                return
+            if self.domains is not None and domain not in self.domains:
+                # A domain that does not exist yet has nothing in it
+                self.users[domain] = set()
+                self.devices[domain] = set()
+                self.callqueues[domain] = set()
+                return
+            loading = self._loading.get(domain)
+            if loading is None:
+                loading = self._loading[domain] = threading.Event()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            loading.wait()
+            return
+
+        # The listings run outside the lock so other domains (and other tenants) are not held up
+        users = callqueues = devices = None
+        try:
+            users = self._keys(f"domains/{domain}/users", "user")
+            callqueues = self._keys(f"domains/{domain}/callqueues", "callqueue")
+            listed = self._list(f"domains/{domain}/devices")
+            if listed is not None:
+                devices = {f"{item.get('user')}/{item.get('device')}" for item in listed if isinstance(item, dict)}
+        finally:
+            with self._lock:
+                self.users[domain] = users
+                self.callqueues[domain] = callqueues
+                self.devices[domain] = devices
+                del self._loading[domain]
+            loading.set()
+        logger.info(f"Existence index loaded domain {domain}")
+
+    @staticmethod
+    def _config_key(config: dict) -> Tuple[str, str, str, str]:
+        return (config["config-name"], config.get("user-scope", "*"), config.get("reseller", "*"), config.get("domain", "*"))
+
+    @staticmethod
+    def _unchecked(found: bool, kind: str, name: str) -> bool:
+        if found:
+            logger.info(f"Existence index has {kind} {name}; its payload is not compared, so changed details are not applied")
+        return found
+
+    def has_reseller(self, reseller: str) -> bool:
+        return self._unchecked(self.resellers is not None and reseller in self.resellers, "reseller", reseller)
+
+    def has_domain(self, domain: str) -> bool:
+        return self._unchecked(self.domains is not None and domain in self.domains, "domain", domain)
+
+    def has_user(self, domain: str, user: str) -> bool:
+        self.load_domain(domain)
+        users = self.users.get(domain)
+        return self._unchecked(users is not None and str(user) in users, "user", f"{user}@{domain}")
+
+    def has_device(self, domain: str, user: str, device: str) -> bool:
+        self.load_domain(domain)
+        devices = self.devices.get(domain)
+        return self._unchecked(devices is not None and f"{user}/{device}" in devices, "device", f"{user}/{device}@{domain}")
+
+    def has_callqueue(self, domain: str, callqueue: str) -> bool:
+        self.load_domain(domain)
+        callqueues = self.callqueues.get(domain)
+        return self._unchecked(callqueues is not None and str(callqueue) in callqueues, "call queue", f"{callqueue}@{domain}")
+
+    def has_image(self, filename: str, reseller: str = "*") -> bool:
+        return self.images is not None and (filename, reseller) in self.images
+
+    def config_state(self, payload: dict) -> str:
+        """Return 'missing', 'same' or 'different' for a configuration payload."""
+        if self.configurations is None:
+            return "missing"
+        current = self.configurations.get(self._config_key(payload))
+        if current is None:
+            return "missing"
+        return "same" if current == str(payload.get("config-value", "")) else "different"
+
+    def add_reseller(self, reseller: str) -> None:
+        with self._lock:
+            if self.resellers is not None:
+                self.resellers.add(reseller)
+
+    def add_domain(self, domain: str) -> None:
+        with self._lock:
+            if self.domains is not None:
+                self.domains.add(domain)
+
+    def add_user(self, domain: str, user: str) -> None:
+        with self._lock:
+            if self.users.get(domain) is not None:
+                self.users[domain].add(str(user))
+
+    def add_device(self, domain: str, user: str, device: str) -> None:
+        with self._lock:
+            if self.devices.get(domain) is not None:
+                self.devices[domain].add(f"{user}/{device}")
+
+    def add_callqueue(self, domain: str, callqueue: str) -> None:
+        with self._lock:
+            if self.callqueues.get(domain) is not None:
+                self.callqueues[domain].add(str(callqueue))
+
+    def add_image(self, filename: str, reseller: str = "*") -> None:
+        with self._lock:
+            if self.images is not None:
+                self.images.add((filename, reseller))
+
+    def add_configuration(self, payload: dict) -> None:
+        with self._lock:
+            if self.configurations is not None:
+                self.configurations[self._config_key(payload)] = str(payload.get("config-value", ""))
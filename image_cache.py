@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, Optional, Tuple
+from logging_setup import setup_logging
+
+logger = setup_logging(__name__)
+
+DEFAULT_CACHE_DIR = os.getenv("NS_IMAGE_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "branding"))
+DEFAULT_CACHE_MAX_BYTES = int(float(os.getenv("NS_IMAGE_CACHE_MAX_MB", "64")) * 1024 * 1024)
+URL_INDEX_FILE = "urls.json"
+
+def source_hash(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+def _write_atomic(path: str, data: bytes) -> None:
+    # Write to a temp file first so a concurrent reader never sees a partial variant
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class VariantCache:
+    """On-disk cache of resized branding variants keyed by source content and target size.
+
+    Entries are evicted least-recently-used first once the cache grows past
+    max_bytes. Remote sources also keep their ETag/Last-Modified so the next
+    download can be a conditional GET.
+    """
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, digest: str, size: Tuple[int, int]) -> str:
+        key = hashlib.sha256(f"{digest}:{size[0]}x{size[1]}".encode()).hexdigest()
+        return os.path.join(self.directory, f"{key}.jpg")
+
+    def get(self, digest: str, size: Tuple[int, int]) -> Optional[bytes]:
+        path = self._path(digest, size)
+        try:
+            with open(path, "rb") as cached_file:
+                data = cached_file.read()
+            os.utime(path)  # Mark as recently used for LRU eviction
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def get_all(self, digest: str, sizes) -> Optional[Dict[Tuple[int, int], bytes]]:
+        """Return every requested size, or None if any of them is missing."""
+        variants = {}
+        for size in sizes:
+            data = self.get(digest, size)
+            if data is None:
+                return None
+            variants[size] = data
+        return variants
+
+    def put(self, digest: str, size: Tuple[int, int], data: bytes) -> None:
+        _write_atomic(self._path(digest, size), data)
+        self.evict()
+
+    def evict(self) -> None:
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name.endswith(".jpg"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            if total <= self.max_bytes:
+                return
+            entries.sort()
+            for _, entry_size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= entry_size
+                    logger.info(f"Evicted cached image variant {os.path.basename(path)}")
+                except FileNotFoundError:
+                    pass
+
+    def _load_url_index(self) -> Dict[str, dict]:
+        try:
+            with open(os.path.join(self.directory, URL_INDEX_FILE), "r") as index_file:
+                return json.load(index_file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def url_metadata(self, url: str) -> Optional[dict]:
+        with self._lock:
+            return self._load_url_index().get(url)
+
+    def save_url_metadata(self, url: str, digest: str, etag: Optional[str], last_modified: Optional[str]) -> None:
+        with self._lock:
+            url_index = self._load_url_index()
+            url_index[url] = {"source_hash": digest, "etag": etag, "last_modified": last_modified}
+            _write_atomic(os.path.join(self.directory, URL_INDEX_FILE), json.dumps(url_index, indent=2).encode())
+
+_default_cache: Optional[VariantCache] = None
+
+def get_default_cache() -> Optional[VariantCache]:
+    """Return the shared variant cache, or None when NS_IMAGE_CACHE=0."""
+    global _default_cache
+    if os.getenv("NS_IMAGE_CACHE", "1") == "0":
+        return None
+    if _default_cache is None:
+        _default_cache = VariantCache()
+    return _default_cache
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+from urllib.parse import urlsplit
+from logging_setup import setup_logging
+from tracing import span
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+DEFAULT_JOURNAL_DIR = os.getenv("NS_JOURNAL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "journal"))
+
+def payload_hash(func: Callable, args: tuple = (), kwargs: Optional[dict] = None) -> str:
+    """Hash a step's function and arguments; clients, indexes and futures hash by type only."""
+    payload = {"func": getattr(func, "__qualname__", repr(func)), "args": args, "kwargs": kwargs or {}}
+    encoded = json.dumps(payload, sort_keys=True, default=lambda value: type(value).__name__)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+def step_succeeded(result) -> bool:
+    """Whether a step's return value shows it finished; None means the step does not say."""
+    if isinstance(result, bool):
+        return result
+    if isinstance(result, int):
+        return 200 <= result < 300 or result == 409
+    if hasattr(result, "status_code"):
+        return step_succeeded(result.status_code)
+    if isinstance(result, dict):
+        return all(step_succeeded(value) for value in result.values())
+    if isinstance(result, list):
+        return all(step_succeeded(item.get("status") if isinstance(item, dict) else item) for item in result)
+    return False
+
+class RunJournal:
+    """Append-only JSONL record of provisioning steps, used to resume an interrupted run.
+
+    Each line holds a step key, the hash of the step's payload and whether it
+    succeeded. A step whose last record succeeded with the same payload hash is
+    skipped on the next run; anything else runs again. A run that finishes
+    with every step succeeded archives the journal, so the next run starts
+    from scratch instead of skipping objects that may since have been deleted.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._steps: Dict[str, dict] = {}
+        self.resumed = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if os.path.exists(path):
+            with open(path, "r") as journal_file:
+                for line in journal_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A run killed mid-write leaves at most one partial line
+                        continue
+                    self._steps[record["key"]] = record
+        done = sum(1 for record in self._steps.values() if record["status"] == "succeeded")
+        logger.info(f"Opened run journal {path}: {done} of {len(self._steps)} recorded steps succeeded")
+
+    @classmethod
+    def for_run(cls, api_url: str, custID: str, directory: str = DEFAULT_JOURNAL_DIR) -> "RunJournal":
+        """Return the journal for one host ID on one API host."""
+        host = urlsplit(api_url).netloc or api_url
+        safe_name = "".join(char if char.isalnum() or char in "-_." else "_" for char in f"{host}_{custID}")
+        return cls(os.path.join(directory, f"{safe_name}.jsonl"))
+
+    def is_done(self, key: str, digest: str) -> bool:
+        with self._lock:
+            record = self._steps.get(key)
+        return record is not None and record["status"] == "succeeded" and record["hash"] == digest
+
+    def record(self, key: str, digest: str, succeeded: bool, result=None) -> None:
+        if hasattr(result, "status_code"):
+            result = result.status_code
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "key": key,
+            "hash": digest,
+            "status": "succeeded" if succeeded else "failed",
+            "result": result if isinstance(result, (int, str, bool)) or result is None else type(result).__name__
+        }
+        with self._lock:
+            self._steps[key] = entry
+            with open(self.path, "a") as journal_file:
+                journal_file.write(json.dumps(entry) + "\n")
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+
+    def run_step(self, key: str, func: Callable, *args, **kwargs):
+        """Run func unless the journal shows it already succeeded with the same arguments; a skipped step returns True."""
+        digest = payload_hash(func, args, kwargs)
+        if self.is_done(key, digest):
+            with self._lock:
+                self.resumed += 1
+            print(f"Skipping {key}: already completed in a previous run")
+            logger.info(f"Skipping step {key}: already completed in a previous run")
+            return True
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.record(key, digest, False, str(e))
+            raise
+        self.record(key, digest, step_succeeded(result), result)
+        return result
+
+    def finish(self) -> bool:
+        """Archive the journal if every recorded step succeeded; returns whether it was archived.
+
+        With failed steps it is kept, so the next run retries only those.
+        """
+        with self._lock:
+            failed = [key for key, record in self._steps.items() if record["status"] != "succeeded"]
+            if failed:
+                message = f"Keeping run journal {self.path}: {len(failed)} steps failed and will be retried on the next run"
+            else:
+                if os.path.exists(self.path):
+                    os.replace(self.path, self.archive_path)
+                self._steps = {}
+                message = f"Run completed; journal archived to {self.archive_path}"
+        print(message)
+        logger.info(message)
+        return not failed
+
+    @property
+    def archive_path(self) -> str:
+        root, ext = os.path.splitext(self.path)
+        return f"{root}.completed{ext}"
+
+def get_journal(api_url: str, custID: str) -> Optional[RunJournal]:
+    """Return the run journal for a host build, or None when NS_JOURNAL=0."""
+    if os.getenv("NS_JOURNAL", "1") == "0":
+        return None
+    return RunJournal.for_run(api_url, custID)
+
+def finish_journal(journal: Optional[RunJournal]) -> None:
+    """Archive a completed run's journal; a no-op without one."""
+    if journal is not None:
+        journal.finish()
+
+def run_step(journal: Optional[RunJournal], key: str, func: Callable, *args, **kwargs):
+    """Run a step through the journal when there is one, otherwise just call it."""
+    with span(key, "object"):
+        if journal is None:
+            return func(*args, **kwargs)
+        return journal.run_step(key, func, *args, **kwargs)
@@ -1,19 +1,121 @@
 # logging_setup.py
+import atexit
+import json
 import logging
 import os
+import queue
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
-def setup_logging():
+# Longest payload or response body written to the log before it is truncated
+MAX_LOG_BODY = int(os.getenv("NS_LOG_MAX_BODY", "2000"))
+LOG_MAX_BYTES = int(float(os.getenv("NS_LOG_MAX_MB", "10")) * 1024 * 1024)
+LOG_BACKUP_COUNT = int(os.getenv("NS_LOG_BACKUPS", "5"))
+LOG_JSON = os.getenv("NS_LOG_JSON", "0") == "1"
+
+def _parse_levels(spec):
+    # NS_LOG_LEVELS="ui_configs=DEBUG,create_image=WARNING"
+    levels = {}
+    for item in spec.split(","):
+        if "=" in item:
+            module, level = item.split("=", 1)
+            levels[module.strip()] = level.strip().upper()
+    return levels
+
+MODULE_LOG_LEVELS = _parse_levels(os.getenv("NS_LOG_LEVELS", ""))
+
+def truncate(text, limit=None):
+    limit = MAX_LOG_BODY if limit is None else limit
+    if limit and len(text) > limit:
+        return f"{text[:limit]}... [truncated {len(text) - limit} chars]"
+    return text
+
+class LazyJSON:
+    """Serializes its object only if the log record is actually emitted."""
+
+    def __init__(self, obj, indent=2):
+        self.obj = obj
+        self.indent = indent
+
+    def __str__(self):
+        return truncate(json.dumps(self.obj, indent=self.indent))
+
+class LazyText:
+    """Decodes a response body only if the log record is actually emitted."""
+
+    def __init__(self, response):
+        self.response = response
+
+    def __str__(self):
+        return truncate(self.response.text)
+
+def _module_name(name):
+    if name == "__main__":
+        # Scripts run directly are configured under their file name
+        main_file = getattr(sys.modules.get("__main__"), "__file__", None)
+        if main_file:
+            return os.path.splitext(os.path.basename(main_file))[0]
+    return name
+
+class JsonLineFormatter(logging.Formatter):
+    """Formats each record as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+_listener = None
+_listener_lock = threading.Lock()
+
+def _start_listener(log_file):
+    # Handlers run on a background thread; callers only put records on the queue
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return
+        text_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+        file_handler = RotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+        file_handler.setFormatter(JsonLineFormatter() if LOG_JSON else text_formatter)
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(text_formatter)
+
+        log_queue = queue.SimpleQueue()
+        root = logging.getLogger()
+        root.setLevel(os.getenv("NS_LOG_LEVEL", "INFO").upper())
+        root.addHandler(QueueHandler(log_queue))
+        _listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+
+def stop_logging():
+    """Flush queued records and stop the background log writer."""
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+def setup_logging(name=None):
     # Define the log file path in the 'logs' subdirectory
     log_dir = os.path.join(os.path.dirname(__file__), 'logs')
     os.makedirs(log_dir, exist_ok=True)  # Create 'logs' directory if it doesn’t exist
     log_file = os.path.join(log_dir, 'netsapiens_api.log')
 
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_file),  # Log to logs/netsapiens_api.log
-            logging.StreamHandler()  # Log to terminal
-        ]
-    )
-    return logging.getLogger(__name__)
\ No newline at end of file
+    # Safe to call from every module: the queue handler is installed only once
+    _start_listener(log_file)
+    if name is None:
+        return logging.getLogger(__name__)
+    name = _module_name(name)
+    logger = logging.getLogger(name)
+    if name in MODULE_LOG_LEVELS:
+        logger.setLevel(MODULE_LOG_LEVELS[name])
+    return logger
@@ -0,0 +1,259 @@
+import json
+import os
+import re
+import sys
+from logging_setup import setup_logging
+from ns_client import get_client
+from existence_index import ExistenceIndex
+from task_graph import TaskGraph, DEFAULT_GRAPH_WORKERS, graph_succeeded
+from journal import get_journal, finish_journal
+from readiness import get_waiter
+from create_reseller import create_reseller
+from create_domain import create_domain
+from create_user import create_user, validate_user
+from create_device import create_device
+from create_image import process_images, build_variants
+from connections import create_connection, create_second_connection, create_outbound_connection
+from routes import create_us_domestic_route
+from ui_configs import update_configurations, load_configurations, apply_overrides
+from create_training_domains import create_call_queue, add_agents_to_call_queue, create_training_domains
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+MANIFEST_KEYS = {"host_id", "api_url", "reseller", "domain", "branding", "connections", "routes",
+                 "configurations", "users", "call_queues", "training_domains"}
+
+def _read_document(path):
+    with open(path, "r") as manifest_file:
+        text = manifest_file.read()
+    if path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("PyYAML is required for YAML manifests (pip install pyyaml), or use a .json manifest")
+        return yaml.safe_load(text)
+    return json.loads(text)
+
+def load_manifest(path):
+    """Read a tenant manifest from JSON, or from YAML when PyYAML is installed."""
+    manifest = _read_document(path)
+    if not isinstance(manifest, dict):
+        raise ValueError(f"Manifest {path} must contain a mapping at the top level")
+    logger.info(f"Loaded tenant manifest from {path}")
+    return manifest
+
+def load_manifests(path):
+    """Read a file holding either one tenant manifest or a list of them."""
+    manifests = _read_document(path)
+    if isinstance(manifests, dict):
+        manifests = [manifests]
+    if not isinstance(manifests, list) or not all(isinstance(manifest, dict) for manifest in manifests):
+        raise ValueError(f"{path} must contain a manifest or a list of manifests")
+    logger.info(f"Loaded {len(manifests)} tenant manifests from {path}")
+    return manifests
+
+def normalize_manifest(manifest):
+    """Fill in the defaults eval-main.py uses for anything the manifest leaves out."""
+    host_id = str(manifest.get("host_id", "")).strip()
+    api_url = str(manifest.get("api_url", "")).strip()
+    if api_url and not api_url.startswith(('http://', 'https://')):
+        api_url = f"https://{api_url}"
+
+    reseller = {"name": f"{host_id}_reseller", "description": "Created via API app"}
+    reseller.update(manifest.get("reseller") or {})
+
+    domain = {
+        "name": host_id,
+        "reseller": host_id,
+        "description": "made via api",
+        "dial_policy": "US and Canada",
+        "area_code": "858",
+        "caller_id_name": "NSEval",
+        "caller_id_number": "8582834172",
+        "caller_id_number_emergency": "8582834172"
+    }
+    domain.update(manifest.get("domain") or {})
+    domain.setdefault("dial_plan", domain["name"])
+
+    branding = manifest.get("branding")
+    if branding:
+        branding = {"local": False, "reseller": "*", **branding}
+
+    configurations = manifest.get("configurations")
+    if configurations:
+        configurations = {"file": "ui-configs.json", "overrides": {}, **configurations}
+
+    return {
+        "host_id": host_id,
+        "api_url": api_url,
+        "reseller": reseller,
+        "domain": domain,
+        "branding": branding,
+        "connections": bool(manifest.get("connections", True)),
+        "routes": bool(manifest.get("routes", True)),
+        "configurations": configurations,
+        "users": [{"device": True, **user} for user in manifest.get("users") or []],
+        "call_queues": [{"description": "", "dispatch_type": "Ring All", "agents": [], **queue} for queue in manifest.get("call_queues") or []],
+        "training_domains": bool(manifest.get("training_domains", False))
+    }
+
+def validate_manifest(manifest):
+    """Check the whole manifest up front and raise one ValueError listing every problem."""
+    errors = [f"Unknown manifest key: {key}" for key in sorted(set(manifest) - MANIFEST_KEYS)]
+    tenant = normalize_manifest(manifest)
+
+    if not tenant["host_id"]:
+        errors.append("host_id is required")
+    if not re.match(r"^https?://[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+(:\d+)?$", tenant["api_url"]):
+        errors.append(f"api_url is not a valid URL: '{tenant['api_url']}'")
+    if not tenant["domain"]["name"]:
+        errors.append("domain.name is required")
+
+    branding = tenant["branding"]
+    if branding:
+        if not branding.get("image"):
+            errors.append("branding.image is required when branding is given")
+        elif branding["local"] and not os.path.exists(branding["image"]):
+            errors.append(f"branding.image {branding['image']} not found")
+
+    configurations = tenant["configurations"]
+    if configurations:
+        if not os.path.exists(configurations["file"]):
+            errors.append(f"configurations.file {configurations['file']} not found")
+        else:
+            try:
+                apply_overrides(load_configurations(configurations["file"], tenant["host_id"]), configurations["overrides"])
+            except ValueError as e:
+                errors.append(f"configurations.overrides: {e}")
+
+    extensions = set()
+    for i, user in enumerate(tenant["users"]):
+        try:
+            validate_user(user.get("extension", ""), user.get("first_name", ""), user.get("last_name", ""), user.get("email", ""))
+        except ValueError as e:
+            errors.append(f"users[{i}]: {e}")
+        if str(user.get("extension")) in extensions:
+            errors.append(f"users[{i}]: duplicate extension {user.get('extension')}")
+        extensions.add(str(user.get("extension")))
+
+    for i, queue in enumerate(tenant["call_queues"]):
+        if not str(queue.get("callqueue", "")).isdigit():
+            errors.append(f"call_queues[{i}]: callqueue must be numeric")
+        for agent in queue["agents"]:
+            if str(agent) not in extensions:
+                errors.append(f"call_queues[{i}]: agent {agent} is not one of the manifest users")
+
+    if errors:
+        for error in errors:
+            logger.error(f"Manifest error: {error}")
+        raise ValueError("Invalid tenant manifest:\n  " + "\n  ".join(errors))
+    logger.info(f"Manifest for {tenant['host_id']} is valid: {len(tenant['users'])} users, {len(tenant['call_queues'])} call queues")
+    return tenant
+
+def upload_branding(branding, custID, api_url, variants=None, client=None, index=None):
+    # variants is a future from the image process pool, or None to resize here
+    return process_images(branding["image"], custID, api_url, reseller=branding["reseller"], local=branding["local"], client=client, index=index,
+                          in_memory=True, variants=variants.result() if variants else None)
+
+def apply_manifest(manifest, client=None, index=None, max_workers=DEFAULT_GRAPH_WORKERS, image_pool=None, journal=None):
+    """Provision one host from a validated manifest without prompting, as a task graph.
+
+    With image_pool (a process pool), branding variants are resized in a worker
+    process while the API steps run, and only the upload happens in this process.
+    """
+    tenant = validate_manifest(manifest)
+    custID = tenant["host_id"]
+    api_url = tenant["api_url"]
+    client = client or get_client(api_url)
+    if index is None:
+        index = ExistenceIndex(client)
+        index.load()
+    # The domain, users and call queues are created asynchronously; their dependents wait until they exist
+    waiter = get_waiter(client)
+
+    graph = TaskGraph(f"manifest for {custID}")
+    reseller = tenant["reseller"]
+    reseller_task = graph.add(f"reseller:{reseller['name']}", create_reseller, custID, reseller["name"], reseller["description"], api_url, client=client, index=index)
+
+    branding = tenant["branding"]
+    if branding:
+        variants = image_pool.submit(build_variants, branding["image"], branding["local"]) if image_pool else None
+        graph.add(f"branding:{reseller['name']}", upload_branding, branding, custID, api_url, variants, client=client, index=index, deps=[reseller_task])
+
+    configurations = tenant["configurations"]
+    if configurations:
+        graph.add("configurations", update_configurations, custID, config_file=configurations["file"], api_url=api_url, client=client, index=index,
+                  interactive=False, overrides=configurations["overrides"], deps=[reseller_task])
+
+    if tenant["connections"]:
+        graph.add("connection:inbound", create_connection, custID, api_url, client=client)
+        graph.add("connection:second", create_second_connection, custID, api_url, client=client)
+        graph.add("connection:outbound", create_outbound_connection, custID, api_url, client=client)
+    if tenant["routes"]:
+        graph.add("route:us-domestic", create_us_domestic_route, custID, api_url, client=client,
+                  deps=["connection:inbound"] if tenant["connections"] else ())
+
+    domain = tenant["domain"]
+    domain_name = domain["name"]
+    domain_task = graph.add(f"domain:{domain_name}", create_domain, custID, domain_name, domain["reseller"], domain["description"], domain["dial_plan"],
+                            domain["dial_policy"], domain["area_code"], domain["caller_id_name"], domain["caller_id_number"],
+                            domain["caller_id_number_emergency"], api_url, client=client, index=index,
+                            ready=waiter.check("domain", None, domain_name))
+
+    for user in tenant["users"]:
+        extension = str(user["extension"])
+        user_task = graph.add(f"user:{domain_name}:{extension}", create_user, custID, domain_name, api_url, client=client, index=index, extension=extension,
+                              first_name=user["first_name"], last_name=user["last_name"], email=user["email"], deps=[domain_task],
+                              ready=waiter.check("user", domain_name, extension))
+        if user["device"]:
+            graph.add(f"device:{domain_name}:{extension}", create_device, custID, domain_name, extension, api_url, client=client, index=index, deps=[user_task])
+
+    for queue in tenant["call_queues"]:
+        callqueue = str(queue["callqueue"])
+        queue_task = graph.add(f"queue:{domain_name}:{callqueue}", create_call_queue, custID, domain_name, callqueue, queue["description"], api_url,
+                               dispatch_type=queue["dispatch_type"], client=client, index=index, deps=[domain_task],
+                               ready=waiter.check("callqueue", domain_name, callqueue))
+        agents = [str(agent) for agent in queue["agents"]]
+        if agents:
+            graph.add(f"agents:{domain_name}:{callqueue}", add_agents_to_call_queue, custID, domain_name, callqueue, agents, api_url, client=client,
+                      deps=[queue_task] + [f"user:{domain_name}:{agent}" for agent in agents])
+
+    if tenant["training_domains"]:
+        # Also creates domain:{custID} under {custID}_reseller, so it runs after the tenant's own reseller and domain.
+        # It journals its own steps, so it always runs again to retry whichever of them failed
+        graph.add("training-domains", create_training_domains, custID, api_url, client=client, max_workers=max_workers, index=index, journal=journal,
+                  deps=[reseller_task, domain_task], succeeded=graph_succeeded, journaled=False)
+
+    print(f"\n=== Applying tenant manifest for {custID} ({len(graph.tasks)} steps) ===")
+    logger.info(f"=== Applying tenant manifest for {custID} ({len(graph.tasks)} steps) ===")
+    graph.run(max_workers=max_workers, journal=journal)
+    graph.print_critical_path()
+    return graph
+
+if __name__ == "__main__":
+    print("Starting tenant manifest provisioning")
+    logger.info("Starting tenant manifest provisioning")
+    args = [arg for arg in sys.argv[1:] if arg != "--check"]
+    if not args:
+        print("Usage: python manifest.py <tenant.json|tenant.yaml> [--check]")
+        sys.exit(1)
+
+    try:
+        manifest = load_manifest(args[0])
+        if "--check" in sys.argv[1:]:
+            validate_manifest(manifest)
+            print(f"Manifest {args[0]} is valid")
+            sys.exit(0)
+        tenant = normalize_manifest(manifest)
+        journal = get_journal(tenant["api_url"], tenant["host_id"])
+        graph = apply_manifest(manifest, journal=journal)
+        finish_journal(journal)
+    except ValueError as e:
+        print(f"Error: {e}")
+        logger.error(f"Manifest provisioning failed: {e}")
+        sys.exit(1)
+
+    get_client(normalize_manifest(manifest)["api_url"]).report()
+    print("Tenant manifest provisioning completed")
+    logger.info("Tenant manifest provisioning completed")
@@ -0,0 +1,209 @@
+import atexit
+import json
+import os
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+from logging_setup import setup_logging
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+DEFAULT_METRICS_DIR = os.getenv("NS_METRICS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs"))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Collection name -> placeholder for the path segment that follows it
+PATH_PLACEHOLDERS = {
+    "resellers": "{reseller}",
+    "domains": "{domain}",
+    "users": "{user}",
+    "devices": "{device}",
+    "callqueues": "{callqueue}",
+    "agents": "{agent}",
+    "images": "{filename}",
+    "configurations": "{config}",
+    "connections": "{connection}",
+}
+
+def endpoint_template(url: str) -> str:
+    """Turn a request URL into its endpoint template, e.g. /domains/{domain}/users."""
+    path = urlsplit(url).path
+    if re.fullmatch(r"/ns-api/?", path):
+        return "/ns-api/ (legacy)"
+    segments = [segment for segment in re.sub(r"^/ns-api/v2", "", path).split("/") if segment]
+    template = []
+    for position, segment in enumerate(segments):
+        if position % 2 == 1:
+            template.append(PATH_PLACEHOLDERS.get(segments[position - 1], "{id}"))
+        else:
+            template.append(segment)
+    return "/" + "/".join(template)
+
+def status_class(status) -> str:
+    return f"{status // 100}xx" if isinstance(status, int) else "error"
+
+class EndpointStats:
+    def __init__(self):
+        self.count = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.statuses: Dict[str, int] = {}
+
+    def quantile(self, fraction: float) -> float:
+        # Upper bound of the bucket holding the quantile, like Prometheus' histogram_quantile
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS + (self.latency_max,), self.buckets):
+            seen += count
+            if seen >= target:
+                return min(bound, self.latency_max)
+        return self.latency_max
+
+class MetricsRegistry:
+    """Per-endpoint request counters and latency histograms for NetSapiens API calls."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.endpoints: Dict[Tuple[str, str, str], EndpointStats] = {}
+        self.retries: Dict[Tuple[str, str], int] = {}
+        self.started = time.time()
+
+    def record(self, method: str, url: str, status, seconds: float, bytes_sent: int = 0, bytes_received: int = 0) -> None:
+        key = (method.upper(), endpoint_template(url), status_class(status))
+        with self._lock:
+            stats = self.endpoints.setdefault(key, EndpointStats())
+            stats.count += 1
+            stats.latency_sum += seconds
+            stats.latency_max = max(stats.latency_max, seconds)
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+            stats.statuses[str(status)] = stats.statuses.get(str(status), 0) + 1
+            for position, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    stats.buckets[position] += 1
+                    break
+            else:
+                stats.buckets[-1] += 1
+        _register_report()
+
+    def record_retry(self, method: str, url: str) -> None:
+        key = (method.upper(), endpoint_template(url))
+        with self._lock:
+            self.retries[key] = self.retries.get(key, 0) + 1
+
+    def to_prometheus(self) -> str:
+        lines = [
+            "# HELP ns_api_requests_total NetSapiens API responses by endpoint and status class.",
+            "# TYPE ns_api_requests_total counter"
+        ]
+        with self._lock:
+            endpoints = sorted(self.endpoints.items())
+            retries = sorted(self.retries.items())
+        for (method, endpoint, status), stats in endpoints:
+            lines.append(f'ns_api_requests_total{{method="{method}",endpoint="{endpoint}",status_class="{status}"}} {stats.count}')
+        lines += ["# HELP ns_api_request_duration_seconds NetSapiens API request latency.",
+                  "# TYPE ns_api_request_duration_seconds histogram"]
+        for (method, endpoint, status), stats in endpoints:
+            labels = f'method="{method}",endpoint="{endpoint}",status_class="{status}"'
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                cumulative += count
+                lines.append(f'ns_api_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'ns_api_request_duration_seconds_bucket{{{labels},le="+Inf"}} {stats.count}')
+            lines.append(f"ns_api_request_duration_seconds_sum{{{labels}}} {stats.latency_sum:.6f}")
+            lines.append(f"ns_api_request_duration_seconds_count{{{labels}}} {stats.count}")
+        lines += ["# HELP ns_api_request_bytes_total Request body bytes sent.", "# TYPE ns_api_request_bytes_total counter"]
+        for (method, endpoint, status), stats in endpoints:
+            lines.append(f'ns_api_request_bytes_total{{method="{method}",endpoint="{endpoint}",status_class="{status}"}} {stats.bytes_sent}')
+        lines += ["# HELP ns_api_response_bytes_total Response body bytes received.", "# TYPE ns_api_response_bytes_total counter"]
+        for (method, endpoint, status), stats in endpoints:
+            lines.append(f'ns_api_response_bytes_total{{method="{method}",endpoint="{endpoint}",status_class="{status}"}} {stats.bytes_received}')
+        lines += ["# HELP ns_api_retries_total Requests retried after a throttle or transient failure.", "# TYPE ns_api_retries_total counter"]
+        for (method, endpoint), count in retries:
+            lines.append(f'ns_api_retries_total{{method="{method}",endpoint="{endpoint}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> dict:
+        with self._lock:
+            endpoints = sorted(self.endpoints.items())
+            retries = dict(self.retries)
+        return {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "seconds": round(time.time() - self.started, 3),
+            "endpoints": [{
+                "method": method,
+                "endpoint": endpoint,
+                "status_class": status,
+                "count": stats.count,
+                "statuses": stats.statuses,
+                "mean_ms": round(stats.latency_sum / stats.count * 1000, 1),
+                "p50_ms": round(stats.quantile(0.50) * 1000, 1),
+                "p99_ms": round(stats.quantile(0.99) * 1000, 1),
+                "max_ms": round(stats.latency_max * 1000, 1),
+                "bytes_sent": stats.bytes_sent,
+                "bytes_received": stats.bytes_received,
+                "retries": retries.get((method, endpoint), 0)
+            } for (method, endpoint, status), stats in endpoints]
+        }
+
+    def write_reports(self, directory: str = DEFAULT_METRICS_DIR) -> Optional[List[str]]:
+        """Write metrics.prom and metrics.json for this run; returns the paths written."""
+        if not self.endpoints:
+            return None
+        os.makedirs(directory, exist_ok=True)
+        prom_path = os.path.join(directory, "metrics.prom")
+        json_path = os.path.join(directory, "metrics.json")
+        with open(prom_path, "w") as prom_file:
+            prom_file.write(self.to_prometheus())
+        with open(json_path, "w") as json_file:
+            json.dump(self.summary(), json_file, indent=2)
+        logger.info(f"Wrote API metrics to {prom_path} and {json_path}")
+        return [prom_path, json_path]
+
+registry = MetricsRegistry()
+_report_registered = False
+_report_lock = threading.Lock()
+
+def _register_report() -> None:
+    # Write the reports once at exit, as soon as the run has made any API call
+    global _report_registered
+    if _report_registered or os.getenv("NS_METRICS", "1") == "0":
+        return
+    with _report_lock:
+        if not _report_registered:
+            atexit.register(registry.write_reports)
+            _report_registered = True
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve /metrics (Prometheus text) and /metrics.json from a background thread."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = registry.to_prometheus().encode(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = json.dumps(registry.summary(), indent=2).encode(), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    logger.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,240 @@
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, unquote, urlsplit
+
+# Path pattern -> (collection, field that names an object). Collections are per
+# domain when the pattern captures one.
+ROUTES = [
+    (re.compile(r"^/ns-api/v2/resellers$"), "resellers", "reseller"),
+    (re.compile(r"^/ns-api/v2/domains$"), "domains", "domain"),
+    (re.compile(r"^/ns-api/v2/domains/(?P<domain>[^/]+)/users$"), "users", "user"),
+    (re.compile(r"^/ns-api/v2/domains/(?P<domain>[^/]+)/users/(?P<user>[^/]+)/devices$"), "devices", "device"),
+    (re.compile(r"^/ns-api/v2/domains/(?P<domain>[^/]+)/devices$"), "devices", None),
+    (re.compile(r"^/ns-api/v2/domains/(?P<domain>[^/]+)/callqueues$"), "callqueues", "callqueue"),
+    (re.compile(r"^/ns-api/v2/domains/(?P<domain>[^/]+)/callqueues/(?P<callqueue>[^/]+)/agents$"), "agents", "callqueue-agent-id"),
+    (re.compile(r"^/ns-api/v2/connections$"), "connections", None),
+    (re.compile(r"^/ns-api/v2/routecon$"), "routes", None),
+    (re.compile(r"^/ns-api/v2/images$"), "images", None),
+    (re.compile(r"^/ns-api/v2/images/(?P<filename>[^/]+)$"), "images", "filename"),
+    (re.compile(r"^/ns-api/v2/configurations$"), "configurations", None),
+]
+CONFIG_KEY_FIELDS = ("config-name", "user-scope", "reseller", "domain")
+# Collection -> (parent collection, parent scope, parent key) for creates that need their parent to be ready
+PARENTS = {
+    "users": lambda params: ("domains", "", params.get("domain")),
+    "callqueues": lambda params: ("domains", "", params.get("domain")),
+    "devices": lambda params: ("users", params.get("domain"), params.get("user")),
+    "agents": lambda params: ("callqueues", params.get("domain"), params.get("callqueue")),
+}
+
+class MockNetSapiens:
+    """In-memory stand-in for the /ns-api/v2 endpoints NS-Blueprint calls.
+
+    Creates return 201 and duplicates 409, like the real API, so reruns and the
+    existence index behave realistically. latency/jitter (seconds) delay every
+    response; conflict_rate and throttle_rate inject random 409s on creates and
+    429s (with Retry-After) on any request. With ready_delay (seconds), an
+    object created without "synchronous": "yes" stays out of listings for
+    that long, and creating a child under it meanwhile returns 404, as on a
+    loaded host.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, conflict_rate=0.0, throttle_rate=0.0, retry_after=0, ready_delay=0.0):
+        self.latency = latency
+        self.ready_delay = ready_delay
+        self.jitter = jitter
+        self.conflict_rate = conflict_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self.reset()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def reset(self):
+        """Forget every object and counter, as if the host had just been built."""
+        with self._lock:
+            self.store = {}
+            # (collection, scope, key) -> when an asynchronously created object becomes visible
+            self.ready_at = {}
+            self.requests = 0
+            self.status_counts = {}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="mock-ns-api", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _collection(self, name, scope=""):
+        return self.store.setdefault((name, scope), {})
+
+    def _visible(self, collection, scope, key):
+        return self.ready_at.get((collection, scope, key), 0) <= time.monotonic()
+
+    def handle(self, method, path, headers, body):
+        """Return (status, payload) for one request."""
+        with self._lock:
+            self.requests += 1
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        if not headers.get("Authorization", "").startswith("Bearer "):
+            return 401, {"message": "Missing bearer token"}
+        if self.throttle_rate and random.random() < self.throttle_rate:
+            return 429, {"message": "Too many requests"}
+
+        path = urlsplit(path).path
+        if path.rstrip("/") == "/ns-api":
+            return self._legacy(method, body)
+        if path == "/ns-api/v2/version":
+            return 200, {"apiversion": "mock"}
+        for pattern, collection, key_field in ROUTES:
+            match = pattern.match(path)
+            if match:
+                params = {name: unquote(value) for name, value in match.groupdict().items()}
+                return self._resource(method, collection, key_field, params, headers, body)
+        return 404, {"message": f"No mock route for {path}"}
+
+    def _parse(self, headers, body):
+        content_type = headers.get("Content-Type", "")
+        if "multipart/form-data" in content_type:
+            text = body.decode("latin-1")
+            return {name: value for name, value in re.findall(r'name="([^"]+)"\r\n\r\n([^\r]*)\r\n', text)}
+        if "application/x-www-form-urlencoded" in content_type:
+            return {name: values[0] for name, values in parse_qs(body.decode()).items()}
+        try:
+            return json.loads(body or b"{}")
+        except ValueError:
+            return {}
+
+    def _resource(self, method, collection, key_field, params, headers, body):
+        scope = params.get("domain", "")
+        with self._lock:
+            if method == "GET":
+                if collection == "devices" and "user" not in params:
+                    items = [item for (name, item_scope), items in self.store.items() if name == "devices" and item_scope.startswith(f"{scope}/")
+                             for key, item in items.items() if self._visible(name, item_scope, key)]
+                    return 200, items
+                if collection == "devices":
+                    scope = f"{scope}/{params['user']}"
+                elif collection == "agents":
+                    scope = f"{scope}/{params['callqueue']}"
+                return 200, [item for key, item in self._collection(collection, scope).items() if self._visible(collection, scope, key)]
+
+            payload = self._parse(headers, body)
+            parent = PARENTS[collection](params) if collection in PARENTS else None
+            if method == "POST" and parent and not self._visible(*parent):
+                return 404, {"message": f"{parent[0]} {parent[2]} not found"}
+            if collection == "devices":
+                scope = f"{scope}/{params['user']}"
+                payload["user"] = params["user"]
+            elif collection == "agents":
+                scope = f"{scope}/{params['callqueue']}"
+            if collection == "images":
+                payload["filename"] = params.get("filename")
+                key = f"{payload['filename']}|{payload.get('reseller', '*')}"
+            elif collection == "configurations":
+                key = "|".join(str(payload.get(field, "*")) for field in CONFIG_KEY_FIELDS)
+            elif key_field:
+                key = str(payload.get(key_field))
+            else:
+                key = str(len(self._collection(collection, scope)))
+            items = self._collection(collection, scope)
+
+            if method == "PUT":
+                items[key] = payload
+                return 202, {"code": 202}
+            if method != "POST":
+                return 405, {"message": f"{method} not supported"}
+            if key in items or (self.conflict_rate and random.random() < self.conflict_rate):
+                return 409, {"message": f"{collection} {key} already exists"}
+            items[key] = payload
+            if self.ready_delay and payload.get("synchronous") != "yes":
+                self.ready_at[(collection, scope, key)] = time.monotonic() + self.ready_delay
+                return 202, {"code": 202}
+            return 201, {"code": 201}
+
+    def _legacy(self, method, body):
+        # The pre-v2 form post used for call parks
+        if method != "POST":
+            return 405, {"message": f"{method} not supported"}
+        form = {name: values[0] for name, values in parse_qs(body.decode()).items()}
+        if form.get("object") != "callqueue" or form.get("action") != "create":
+            return 400, {"message": "Unsupported legacy object/action"}
+        with self._lock:
+            items = self._collection("callqueues", form.get("domain", ""))
+            if form.get("queue") in items:
+                return 409, {"message": f"callqueue {form.get('queue')} already exists"}
+            items[form.get("queue")] = {"callqueue": form.get("queue"), "description": form.get("description")}
+        return 202, {"code": 202}
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Buffer the headers and body into one write; two small writes stall on delayed ACKs
+            wbufsize = -1
+
+            def _respond(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                status, payload = mock.handle(self.command, self.path, self.headers, body)
+                with mock._lock:
+                    mock.status_counts[status] = mock.status_counts.get(status, 0) + 1
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                if status == 429:
+                    self.send_header("Retry-After", str(mock.retry_after))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = _respond
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def parse_option(args, name, default, cast=float):
+    if name in args:
+        position = args.index(name)
+        value = cast(args[position + 1])
+        del args[position:position + 2]
+        return value
+    return default
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    mock = MockNetSapiens(
+        port=parse_option(args, "--port", 8080, int),
+        latency=parse_option(args, "--latency", 0.0) / 1000,
+        jitter=parse_option(args, "--jitter", 0.0) / 1000,
+        conflict_rate=parse_option(args, "--conflict-rate", 0.0),
+        throttle_rate=parse_option(args, "--throttle-rate", 0.0),
+        retry_after=parse_option(args, "--retry-after", 0, int),
+        ready_delay=parse_option(args, "--ready-delay", 0.0) / 1000
+    )
+    print(f"Mock NetSapiens API listening on {mock.url} (latency {mock.latency * 1000:.0f}ms, 409 rate {mock.conflict_rate}, 429 rate {mock.throttle_rate}, "
+          f"ready delay {mock.ready_delay * 1000:.0f}ms)")
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping mock NetSapiens API")
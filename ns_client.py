@@ -0,0 +1,317 @@
+import math
+import os
+import socket
+import threading
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from settings import load_env
+from logging_setup import setup_logging
+from metrics import registry as metrics, endpoint_template
+from tracing import span, propagate
+from rate_limiter import AdaptiveRateLimiter, DEFAULT_RATE, backoff_delay, parse_retry_after
+from readiness import report_readiness
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+# Load variables from the .env file into the environment
+load_env()
+
+DEFAULT_POOL_SIZE = int(os.getenv("NS_POOL_SIZE", "10"))
+DEFAULT_MAX_IN_FLIGHT = int(os.getenv("NS_MAX_IN_FLIGHT", "0")) or None
+DEFAULT_MAX_RETRIES = int(os.getenv("NS_MAX_RETRIES", "4"))
+RETRY_BASE_SECONDS = float(os.getenv("NS_RETRY_BASE", "0.5"))
+RETRY_MAX_SECONDS = float(os.getenv("NS_RETRY_MAX", "30"))
+DEFAULT_CONNECT_TIMEOUT = float(os.getenv("NS_CONNECT_TIMEOUT", "10"))
+DEFAULT_READ_TIMEOUT = float(os.getenv("NS_READ_TIMEOUT", "60"))
+# Floors for the timeouts a warm-up seeds from the measured RTT
+MIN_CONNECT_TIMEOUT = 3.05
+MIN_READ_TIMEOUT = 30.0
+DEFAULT_WARM_CONNECTIONS = int(os.getenv("NS_WARM_CONNECTIONS", "4"))
+DEFAULT_HEALTH_PATH = os.getenv("NS_HEALTH_PATH", "ns-api/v2/version")
+MAX_POOL_SIZE = int(os.getenv("NS_POOL_MAX", "32"))
+
+# Safe to send twice: repeating them leaves the server in the same state
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+THROTTLE_STATUSES = {429, 503}
+TRANSIENT_STATUSES = {502, 503, 504}
+
+class NetSapiensClient:
+    """Shared keep-alive HTTP client for every NetSapiens API call."""
+
+    def __init__(self, api_url: str, api_token: Optional[str] = None, pool_size: int = DEFAULT_POOL_SIZE,
+                 max_in_flight: Optional[int] = DEFAULT_MAX_IN_FLIGHT, max_retries: int = DEFAULT_MAX_RETRIES):
+        self.api_url = api_url.rstrip('/')
+        self.api_token = api_token if api_token is not None else os.getenv("API_TOKEN")
+        self.session = requests.Session()
+        self._mount(pool_size)
+        self.session.headers.update({
+            "accept": "application/json",
+            "Authorization": f"Bearer {self.api_token}"
+        })
+        self.timeout = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
+        self.warm_up_stats: Optional[Dict[str, float]] = None
+        # Cap concurrent requests to this host; defaults to the pool size so no
+        # request has to open a connection the pool cannot keep.
+        self.set_max_in_flight(max_in_flight or pool_size, explicit=max_in_flight is not None)
+        # NS_RATE_LIMIT=0 turns the limiter off; retries still apply
+        self.limiter = AdaptiveRateLimiter() if DEFAULT_RATE > 0 else None
+        self.max_retries = max_retries
+        self._counter_lock = threading.Lock()
+        self.retries = 0
+        self.retry_exhausted = 0
+        logger.info(f"Created NetSapiens client for {self.api_url} with pool size {pool_size}")
+
+    def _mount(self, pool_size: int) -> None:
+        self.pool_size = pool_size
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def set_max_in_flight(self, limit: int, explicit: bool = True) -> None:
+        """Limit how many requests may be in flight to this host at once.
+
+        A limit set explicitly (NS_MAX_IN_FLIGHT, --per-host) is never replaced
+        by the one a warm-up derives from the measured RTT.
+        """
+        self.max_in_flight = limit
+        self.in_flight_explicit = explicit
+        self._in_flight = threading.BoundedSemaphore(limit)
+        logger.info(f"Per-host concurrency limit for {self.api_url} set to {limit}")
+
+    def warm_up(self, connections: int = DEFAULT_WARM_CONNECTIONS, health_path: str = DEFAULT_HEALTH_PATH) -> Optional[Dict[str, float]]:
+        """Resolve the host, measure the baseline RTT and open warm keep-alive connections.
+
+        Any response from the health path counts: only its timing is used. The
+        RTT seeds the connect/read timeouts and, unless a limit was set
+        explicitly, grows the pool and in-flight cap to what the rate limiter's
+        ceiling needs at this latency (Little's law). Returns the measurements,
+        or None when the host could not be reached.
+        """
+        if connections <= 0:
+            return None
+        host = urlsplit(self.api_url)
+        started = time.perf_counter()
+        try:
+            socket.getaddrinfo(host.hostname, host.port or (443 if host.scheme == "https" else 80), type=socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            print(f"Could not resolve {host.hostname}: {e}")
+            logger.error(f"Warm-up could not resolve {host.hostname}: {e}")
+            return None
+        dns_seconds = time.perf_counter() - started
+        url = self.url(health_path)
+
+        def probe(_=None) -> float:
+            probe_started = time.perf_counter()
+            response = self.session.get(url, timeout=self.timeout)
+            # Reading the body hands the connection back to the pool
+            response.content
+            return time.perf_counter() - probe_started
+
+        try:
+            with span(f"warm-up {host.netloc}", "phase"):
+                # The first request pays for TCP and TLS setup; the next ones reuse its connection
+                cold_seconds = probe()
+                rtt_seconds = min(probe() for _ in range(3))
+                handshake_seconds = max(cold_seconds - rtt_seconds, 0.0)
+
+                self.timeout = (min(DEFAULT_CONNECT_TIMEOUT, max(MIN_CONNECT_TIMEOUT, 10 * (dns_seconds + handshake_seconds))),
+                                min(DEFAULT_READ_TIMEOUT, max(MIN_READ_TIMEOUT, 100 * rtt_seconds)))
+                if not self.in_flight_explicit and self.limiter:
+                    needed = min(MAX_POOL_SIZE, math.ceil(self.limiter.max_rate * rtt_seconds))
+                    if needed > self.pool_size:
+                        self._mount(needed)
+                        self.set_max_in_flight(needed, explicit=False)
+
+                # Overlapping requests make the pool open one connection each
+                connections = min(connections, self.pool_size)
+                with ThreadPoolExecutor(max_workers=connections) as executor:
+                    list(executor.map(probe, range(connections)))
+        except requests.exceptions.RequestException as e:
+            print(f"Warm-up of {host.netloc} failed: {e}")
+            logger.error(f"Warm-up of {host.netloc} failed: {e}")
+            return None
+
+        self.warm_up_stats = {
+            "dns_ms": round(dns_seconds * 1000, 1),
+            "handshake_ms": round(handshake_seconds * 1000, 1),
+            "rtt_ms": round(rtt_seconds * 1000, 1),
+            "connections": self.connection_stats()["connections"],
+            "connect_timeout": round(self.timeout[0], 2),
+            "read_timeout": round(self.timeout[1], 2),
+            "max_in_flight": self.max_in_flight,
+            "seconds": round(time.perf_counter() - started, 3)
+        }
+        stats = self.warm_up_stats
+        message = (f"Warmed {stats['connections']} connections to {host.netloc} in {stats['seconds']:.2f}s "
+                   f"(DNS {stats['dns_ms']}ms, connect+TLS {stats['handshake_ms']}ms, RTT {stats['rtt_ms']}ms); "
+                   f"timeouts {stats['connect_timeout']}s connect / {stats['read_timeout']}s read, max in flight {stats['max_in_flight']}")
+        print(message)
+        logger.info(message)
+        return stats
+
+    def start_warm_up(self, connections: int = DEFAULT_WARM_CONNECTIONS, health_path: str = DEFAULT_HEALTH_PATH) -> threading.Thread:
+        """Run warm_up on a background thread so the caller can carry on prompting."""
+        thread = threading.Thread(target=propagate(self.warm_up), args=(connections, health_path), name="warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def url(self, path: str) -> str:
+        """Return an absolute URL for a path relative to the API host."""
+        if path.startswith(("http://", "https://")):
+            return path
+        return f"{self.api_url}/{path.lstrip('/')}"
+
+    def _send(self, method: str, url: str, **kwargs) -> requests.Response:
+        if self.limiter:
+            self.limiter.acquire()
+        for value in (kwargs.get("files") or {}).values():
+            # Rewind uploads so a retried request sends the whole file again
+            file = value[1] if isinstance(value, tuple) else value
+            if hasattr(file, "seek"):
+                file.seek(0)
+        kwargs.setdefault("timeout", self.timeout)
+        in_flight = self._in_flight
+        with in_flight, span(f"{method.upper()} {endpoint_template(url)}", "http", url=url) as http_span:
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException:
+                metrics.record(method, url, None, time.perf_counter() - started)
+                raise
+            body = response.request.body
+            metrics.record(method, url, response.status_code, time.perf_counter() - started,
+                           len(body) if body else 0, len(response.content))
+            if http_span:
+                http_span.args["status"] = response.status_code
+            return response
+
+    def _retry(self, method: str, url: str, attempt: int, reason: str, retry_after: Optional[float] = None) -> bool:
+        if attempt >= self.max_retries:
+            with self._counter_lock:
+                self.retry_exhausted += 1
+            logger.error(f"{method} {url} still failing after {self.max_retries} retries: {reason}")
+            return False
+        delay = max(retry_after or 0.0, backoff_delay(attempt, RETRY_BASE_SECONDS, RETRY_MAX_SECONDS))
+        with self._counter_lock:
+            self.retries += 1
+        metrics.record_retry(method, url)
+        logger.warning(f"{method} {url} {reason}, retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+        time.sleep(delay)
+        return True
+
+    def request(self, method: str, path: str, conflict_safe: bool = False, **kwargs) -> requests.Response:
+        """Send a request through the rate limiter and pooled session, retrying where it is safe.
+
+        A 429 is always retried, since the server did not act on the request.
+        Other transient failures (502/503/504, connection errors, timeouts) are
+        only retried for idempotent methods, or for a POST the caller marks
+        conflict_safe because a repeat comes back as a 409 it already handles.
+        """
+        url = self.url(path)
+        retryable = method.upper() in IDEMPOTENT_METHODS or conflict_safe
+        attempt = 0
+        while True:
+            try:
+                response = self._send(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if retryable and self._retry(method, url, attempt, f"failed ({e.__class__.__name__})"):
+                    attempt += 1
+                    continue
+                raise
+            status = response.status_code
+            if status in THROTTLE_STATUSES:
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                if self.limiter:
+                    self.limiter.on_throttle(retry_after)
+                if (status == 429 or retryable) and self._retry(method, url, attempt, f"throttled ({status})", retry_after):
+                    attempt += 1
+                    continue
+                return response
+            if status in TRANSIENT_STATUSES and retryable and self._retry(method, url, attempt, f"returned {status}"):
+                attempt += 1
+                continue
+            if self.limiter:
+                self.limiter.on_success()
+            return response
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path: str, **kwargs) -> requests.Response:
+        return self.request("PUT", path, **kwargs)
+
+    def stats(self) -> Dict[str, float]:
+        """Return connection, retry and rate limiter counters for tuning per-cluster throughput."""
+        stats = dict(self.connection_stats())
+        with self._counter_lock:
+            stats["retries"] = self.retries
+            stats["retry_exhausted"] = self.retry_exhausted
+        if self.limiter:
+            stats.update({f"limiter_{name}": value for name, value in self.limiter.stats().items()})
+        return stats
+
+    def connection_stats(self) -> Dict[str, int]:
+        """Return how many requests were sent and how many reused a pooled connection."""
+        requests_sent = 0
+        connections_opened = 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                requests_sent += pool.num_requests
+                connections_opened += pool.num_connections
+        return {
+            "requests": requests_sent,
+            "connections": connections_opened,
+            "reused": max(requests_sent - connections_opened, 0)
+        }
+
+    def report(self) -> None:
+        """Print and log the connection reuse summary for this client."""
+        stats = self.connection_stats()
+        ratio = (stats["reused"] / stats["requests"] * 100) if stats["requests"] else 0.0
+        message = (f"Connection reuse for {urlsplit(self.api_url).netloc}: {stats['requests']} requests, "
+                   f"{stats['connections']} connections opened, {stats['reused']} reused ({ratio:.1f}%)")
+        print(message)
+        logger.info(message)
+        if self.limiter or self.retries:
+            limiter = self.limiter.stats() if self.limiter else {}
+            message = (f"Rate limiting for {urlsplit(self.api_url).netloc}: {self.retries} retries, {self.retry_exhausted} gave up, "
+                       f"{limiter.get('throttled', 0)} throttled responses, final rate {limiter.get('rate', 'unlimited')} req/s "
+                       f"(lowest {limiter.get('lowest_rate', '-')}), {limiter.get('waited', 0)} requests waited {limiter.get('wait_seconds', 0)}s")
+            print(message)
+            logger.info(message)
+        report_readiness(self, urlsplit(self.api_url).netloc)
+
+    def close(self) -> None:
+        self.session.close()
+
+_clients: Dict[str, NetSapiensClient] = {}
+_clients_lock = threading.Lock()
+
+def get_client(api_url: str, pool_size: Optional[int] = None) -> NetSapiensClient:
+    """Return the shared client for an API URL, creating it on first use."""
+    key = api_url.rstrip('/')
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = NetSapiensClient(key, pool_size=pool_size or DEFAULT_POOL_SIZE)
+            _clients[key] = client
+        return client
+
+def report_all() -> None:
+    """Print connection reuse for every shared client created in this run."""
+    with _clients_lock:
+        clients = list(_clients.values())
+    for client in clients:
+        client.report()
@@ -0,0 +1,169 @@
+import os
+import reprlib
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
+from logging_setup import setup_logging
+from journal import run_step, step_succeeded
+from tracing import propagate
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+DEFAULT_PIPELINE_WORKERS = int(os.getenv("NS_PIPELINE_WORKERS", "8"))
+
+class PipelineStep:
+    def __init__(self, name: str, deps: List[str]):
+        self.name = name
+        self.deps = deps
+        self.status = "waiting"
+        self.future: Future = Future()
+        self.start: Optional[float] = None
+        self.end: Optional[float] = None
+
+class Pipeline:
+    """Provisioning steps that start in the background as soon as their inputs are known.
+
+    Unlike a TaskGraph, steps are added while earlier ones are already
+    running: an interactive build submits each step the moment the SE has
+    answered the prompts it needs, and keeps prompting while the API calls
+    are in flight. A step starts once every step named in deps has finished;
+    if one of them failed, it is skipped.
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_PIPELINE_WORKERS, journal=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline")
+        self.journal = journal
+        self.steps: Dict[str, PipelineStep] = {}
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+
+    def submit(self, name: str, func: Callable, *args, deps: Iterable[str] = (), journaled: bool = True, ready: Optional[Callable] = None,
+               succeeded: Optional[Callable] = step_succeeded, **kwargs) -> str:
+        """Queue func to run once its dependencies finish; returns the step name (made unique if reused).
+
+        As with TaskGraph.add, a step whose result fails succeeded(result) counts
+        as failed, and ready(result) is checked before dependent steps start.
+        """
+        with self._lock:
+            unique_name, count = name, 1
+            while unique_name in self.steps:
+                count += 1
+                unique_name = f"{name}#{count}"
+            unknown = [dep for dep in deps if dep not in self.steps]
+            if unknown:
+                raise ValueError(f"Step {unique_name} depends on unknown steps: {', '.join(unknown)}")
+            step = PipelineStep(unique_name, list(deps))
+            self.steps[unique_name] = step
+            dep_futures = [self.steps[dep].future for dep in step.deps]
+        if journaled:
+            call = lambda: run_step(self.journal, unique_name, func, *args, **kwargs)
+        else:
+            # Not hashed into the journal, so the step may take its own journal argument
+            call = lambda: run_step(None, unique_name, lambda: func(*args, **kwargs))
+
+        def checked():
+            result = call()
+            if succeeded and not succeeded(result):
+                raise RuntimeError(f"{unique_name} did not succeed (returned {reprlib.repr(result)})")
+            is_ready = ready(result) if ready else True
+            if isinstance(is_ready, Future):
+                is_ready = is_ready.result()
+            if not is_ready:
+                raise RuntimeError(f"{unique_name} was created but never became ready")
+            return result
+
+        # Runs in the submitting thread's span context, wherever the step ends up starting
+        run = propagate(checked)
+        remaining = [len(dep_futures)]
+        remaining_lock = threading.Lock()
+
+        def start():
+            failed = [dep for dep in step.deps if self.steps[dep].status in ("failed", "skipped")]
+            if failed:
+                step.status = "skipped"
+                print(f"Skipping {step.name}: dependency {failed[0]} did not complete")
+                logger.warning(f"Skipping step {step.name}: dependency {failed[0]} did not complete")
+                step.future.set_exception(RuntimeError(f"dependency {failed[0]} did not complete"))
+                return
+            step.status = "running"
+            self.executor.submit(self._run, step, run)
+
+        def dep_done(_):
+            with remaining_lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if ready:
+                start()
+
+        if dep_futures:
+            for future in dep_futures:
+                future.add_done_callback(dep_done)
+        else:
+            start()
+        logger.info(f"Queued step {unique_name}" + (f" after {', '.join(step.deps)}" if step.deps else ""))
+        return unique_name
+
+    def _run(self, step: PipelineStep, run: Callable) -> None:
+        step.start = time.perf_counter()
+        try:
+            result = run()
+        except Exception as e:
+            step.end = time.perf_counter()
+            step.status = "failed"
+            print(f"Step {step.name} failed: {e}")
+            logger.error(f"Step {step.name} failed: {e}")
+            step.future.set_exception(e)
+            return
+        step.end = time.perf_counter()
+        step.status = "succeeded"
+        step.future.set_result(result)
+
+    def status_line(self) -> str:
+        """One-line summary of the background work, shown in front of each prompt."""
+        with self._lock:
+            steps = list(self.steps.values())
+        done = sum(1 for step in steps if step.status in ("succeeded", "failed", "skipped"))
+        running = [step.name for step in steps if step.status == "running"]
+        failed = sum(1 for step in steps if step.status in ("failed", "skipped"))
+        line = f"[background: {done}/{len(steps)} done"
+        if failed:
+            line += f", {failed} failed"
+        if running:
+            shown = ", ".join(running[:2]) + (f" +{len(running) - 2}" if len(running) > 2 else "")
+            line += f", running {shown}"
+        return line + "]"
+
+    def prompt(self, text: str) -> str:
+        """input() with the background progress line in front of the question."""
+        return input(f"{self.status_line()} {text}")
+
+    def wait(self) -> Dict[str, PipelineStep]:
+        """Block until every queued step has finished, then print a summary of the run."""
+        while True:
+            with self._lock:
+                pending = [step for step in self.steps.values() if not step.future.done()]
+            if not pending:
+                break
+            print(f"Waiting for {len(pending)} background steps: {self.status_line()}")
+            for step in pending:
+                try:
+                    step.future.result()
+                except Exception:
+                    pass
+        self.executor.shutdown()
+
+        counts: Dict[str, int] = {}
+        for step in self.steps.values():
+            counts[step.status] = counts.get(step.status, 0) + 1
+        elapsed = time.perf_counter() - self.started
+        summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+        print(f"\n=== Background steps finished in {elapsed:.2f}s ({summary}) ===")
+        logger.info(f"=== Background steps finished in {elapsed:.2f}s ({summary}) ===")
+        for step in sorted(self.steps.values(), key=lambda step: step.start if step.start is not None else float("inf")):
+            if step.start is None:
+                print(f"  {'':>8}  {'':>7}  {step.status:<9}  {step.name}")
+            else:
+                print(f"  +{step.start - self.started:6.2f}s  {step.end - step.start:6.2f}s  {step.status:<9}  {step.name}")
+        return self.steps
@@ -0,0 +1,226 @@
+import atexit
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import List, Optional
+from logging_setup import setup_logging
+from tracing import tracer
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+PROFILE_MODES = ("cpu", "sample", "memory")
+DEFAULT_PROFILE_DIR = os.getenv("NS_PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs"))
+DEFAULT_PROFILE_TOP = int(os.getenv("NS_PROFILE_TOP", "30"))
+DEFAULT_SAMPLE_INTERVAL = float(os.getenv("NS_PROFILE_INTERVAL_MS", "5")) / 1000
+DEFAULT_TRACEMALLOC_FRAMES = int(os.getenv("NS_PROFILE_FRAMES", "1"))
+
+def profile_mode(argv: Optional[List[str]] = None) -> Optional[str]:
+    """Return the profiling mode from --profile [mode] (removed from argv) or NS_PROFILE."""
+    argv = sys.argv if argv is None else argv
+    for position, arg in enumerate(argv):
+        if arg == "--profile" or arg.startswith("--profile="):
+            if "=" in arg:
+                mode = arg.split("=", 1)[1]
+                del argv[position]
+            elif position + 1 < len(argv) and argv[position + 1] in PROFILE_MODES:
+                mode = argv[position + 1]
+                del argv[position:position + 2]
+            else:
+                mode = "cpu"
+                del argv[position]
+            break
+    else:
+        mode = os.getenv("NS_PROFILE", "")
+    mode = mode.strip().lower()
+    if mode in ("", "0", "off"):
+        return None
+    if mode in ("1", "on"):
+        return "cpu"
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profiling mode {mode!r} (choose from {', '.join(PROFILE_MODES)})")
+    return mode
+
+class CpuProfiler:
+    """Deterministic cProfile of the main thread and every thread started after it."""
+
+    def __init__(self):
+        self.profilers: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    def _profile_thread(self, frame, event, arg):
+        # Installed through threading.setprofile: runs first in each new thread and
+        # replaces itself with that thread's own profiler
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is active; drop this hook so it stops firing on every call
+            sys.setprofile(None)
+            return
+        with self._lock:
+            self.profilers.append(profiler)
+
+    def start(self) -> None:
+        main = cProfile.Profile()
+        self.profilers.append(main)
+        if sys.version_info < (3, 12):
+            # Python 3.12+ profilers already see every thread
+            threading.setprofile(self._profile_thread)
+        main.enable()
+
+    def stop(self, prefix: str, top: int) -> List[str]:
+        threading.setprofile(None)
+        self.profilers[0].disable()
+        with self._lock:
+            profilers = list(self.profilers)
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            profiler.disable()
+            stats.add(profiler)
+        stats_path = f"{prefix}.pstats"
+        stats.dump_stats(stats_path)
+
+        report = io.StringIO()
+        stats.stream = report
+        print(f"cProfile of {len(profilers)} threads, top {top} by cumulative time\n", file=report)
+        stats.sort_stats("cumulative").print_stats(top)
+        report_path = f"{prefix}-top.txt"
+        with open(report_path, "w") as report_file:
+            report_file.write(report.getvalue())
+        return [stats_path, report_path]
+
+class StackSampler:
+    """Wall-clock sampling profiler: records every thread's stack each interval, like py-spy.
+
+    Threads waiting on the network are sampled too, which is where a
+    provisioning run spends most of its time.
+    """
+
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self, prefix: str, top: int) -> List[str]:
+        self._stop.set()
+        self._thread.join()
+        # Folded stacks load directly into flamegraph.pl or speedscope
+        collapsed_path = f"{prefix}.collapsed"
+        with open(collapsed_path, "w") as collapsed_file:
+            for stack, count in self.stacks.most_common():
+                collapsed_file.write(f"{stack} {count}\n")
+
+        own_samples: Counter = Counter()
+        total_samples: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own_samples[frames[-1]] += count
+            for frame in set(frames):
+                total_samples[frame] += count
+        thread_samples = sum(self.stacks.values()) or 1
+        report_path = f"{prefix}-top.txt"
+        with open(report_path, "w") as report_file:
+            report_file.write(f"{self.samples} samples every {self.interval * 1000:.1f}ms ({thread_samples} thread stacks), "
+                              f"top {top} by cumulative samples\n\n")
+            report_file.write(f"{'Total %':>8}  {'Own %':>7}  Function\n")
+            for frame, count in total_samples.most_common(top):
+                report_file.write(f"{count / thread_samples * 100:7.1f}%  {own_samples[frame] / thread_samples * 100:6.1f}%  {frame}\n")
+        return [collapsed_path, report_path]
+
+class AllocationTracker:
+    """tracemalloc snapshots at each phase boundary, reported as the growth since the previous one."""
+
+    def __init__(self, frames: int = DEFAULT_TRACEMALLOC_FRAMES):
+        self.frames = frames
+        self.boundaries = []
+        self._lock = threading.Lock()
+
+    def snapshot(self, label: str) -> None:
+        # Comparing and filtering snapshots is slow, so that waits for the report at exit
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        with self._lock:
+            self.boundaries.append((label, time.perf_counter(), current, peak, snapshot))
+
+    def on_phase(self, name: str, boundary: str) -> None:
+        self.snapshot(f"{boundary} {name}")
+
+    def start(self) -> None:
+        tracemalloc.start(self.frames)
+        self.snapshot("start")
+        tracer.phase_hooks.append(self.on_phase)
+
+    def stop(self, prefix: str, top: int) -> List[str]:
+        self.snapshot("exit")
+        tracer.phase_hooks.remove(self.on_phase)
+        tracemalloc.stop()
+        snapshot_path = f"{prefix}.tracemalloc"
+        self.boundaries[-1][4].dump(snapshot_path)
+
+        report_path = f"{prefix}-top.txt"
+        mib = 1024 * 1024
+        with open(report_path, "w") as report_file:
+            report_file.write(f"tracemalloc snapshots at {len(self.boundaries)} phase boundaries, "
+                              f"top {top} allocation sites by growth since the previous snapshot\n")
+            started = self.boundaries[0][1]
+            previous = None
+            for label, at, current, peak, snapshot in self.boundaries:
+                report_file.write(f"\n=== +{at - started:.2f}s {label}: {current / mib:.1f} MiB traced, peak {peak / mib:.1f} MiB ===\n")
+                if previous is not None:
+                    for stat in snapshot.compare_to(previous, "lineno")[:top]:
+                        if stat.size_diff:
+                            report_file.write(f"  {stat}\n")
+                previous = snapshot
+        return [snapshot_path, report_path]
+
+PROFILERS = {"cpu": CpuProfiler, "sample": StackSampler, "memory": AllocationTracker}
+
+def start_profiling(name: str, mode: Optional[str] = None, directory: str = DEFAULT_PROFILE_DIR, top: int = DEFAULT_PROFILE_TOP):
+    """Profile the rest of this process when NS_PROFILE or --profile asks for it.
+
+    Call at the top of a script's __main__ block; the results are written to
+    logs/profile-<name>-<timestamp>.* when the process exits.
+    """
+    mode = mode or profile_mode()
+    if mode is None:
+        return None
+    profiler = PROFILERS[mode]()
+    prefix = os.path.join(directory, f"profile-{name}-{time.strftime('%Y%m%d-%H%M%S')}")
+
+    def finish():
+        os.makedirs(directory, exist_ok=True)
+        paths = profiler.stop(prefix, top)
+        print(f"Profile ({mode}) written to {', '.join(paths)}")
+        logger.info(f"Profile ({mode}) for {name} written to {', '.join(paths)}")
+
+    print(f"Profiling {name} ({mode})")
+    logger.info(f"Profiling {name} ({mode})")
+    atexit.register(finish)
+    profiler.start()
+    return profiler
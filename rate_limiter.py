@@ -0,0 +1,119 @@
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+DEFAULT_RATE = float(os.getenv("NS_RATE_LIMIT", "20"))
+DEFAULT_MIN_RATE = float(os.getenv("NS_RATE_MIN", "1"))
+DEFAULT_MAX_RATE = float(os.getenv("NS_RATE_MAX", "200"))
+DEFAULT_BURST = float(os.getenv("NS_RATE_BURST", "10"))
+DEFAULT_RATE_INCREASE = float(os.getenv("NS_RATE_INCREASE", "0.5"))
+DEFAULT_RATE_DECREASE = float(os.getenv("NS_RATE_DECREASE", "0.5"))
+
+class AdaptiveRateLimiter:
+    """Token bucket whose refill rate adapts with AIMD.
+
+    Every successful response raises the rate by a fixed step; a 429/503 cuts it
+    by a factor (at most once per second, so a burst of throttled responses
+    counts as one signal) and honours Retry-After by pausing the bucket.
+    """
+
+    def __init__(self, rate: float = DEFAULT_RATE, min_rate: float = DEFAULT_MIN_RATE, max_rate: float = DEFAULT_MAX_RATE,
+                 burst: float = DEFAULT_BURST, increase: float = DEFAULT_RATE_INCREASE, decrease: float = DEFAULT_RATE_DECREASE):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+        self.tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+        self.throttled = 0
+        self.decreases = 0
+        self.lowest_rate = rate
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> float:
+        """Take a token without blocking; returns 0.0 on success, else the seconds to wait before trying again."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now >= self._paused_until and self.tokens >= 1:
+                self.tokens -= 1
+                self.acquired += 1
+                return 0.0
+            return max(self._paused_until - now, (1 - self.tokens) / self.rate)
+
+    def record_wait(self, waited: float) -> None:
+        if waited:
+            with self._lock:
+                self.waited += 1
+                self.wait_seconds += waited
+
+    def acquire(self) -> float:
+        """Block until a request may be sent; returns the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            delay = self.try_acquire()
+            if not delay:
+                self.record_wait(waited)
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, retry_after: Optional[float] = None) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self.throttled += 1
+            if now - self._last_decrease >= 1.0:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self.lowest_rate = min(self.lowest_rate, self.rate)
+                self.decreases += 1
+                self._last_decrease = now
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+                self.tokens = 0.0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "rate": round(self.rate, 2),
+                "lowest_rate": round(self.lowest_rate, 2),
+                "acquired": self.acquired,
+                "waited": self.waited,
+                "wait_seconds": round(self.wait_seconds, 3),
+                "throttled": self.throttled,
+                "decreases": self.decreases
+            }
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Return the delay in seconds from a Retry-After header (seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """Full-jitter exponential backoff: a random delay up to base * 2**attempt."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
@@ -0,0 +1,331 @@
+import asyncio
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import requests
+from logging_setup import setup_logging
+from rate_limiter import backoff_delay
+from tracing import span
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+READY_ENABLED = os.getenv("NS_READY", "1") != "0"
+DEFAULT_READY_TIMEOUT = float(os.getenv("NS_READY_TIMEOUT", "30"))
+DEFAULT_READY_BASE = float(os.getenv("NS_READY_BASE", "0.2"))
+DEFAULT_READY_MAX_DELAY = float(os.getenv("NS_READY_MAX_DELAY", "3"))
+DEFAULT_READY_POLLERS = int(os.getenv("NS_READY_POLLERS", "4"))
+
+# Object kind -> (listing that shows it, the key an item in that listing is known by)
+READY_LISTINGS: Dict[str, Tuple[str, Callable[[dict], str]]] = {
+    "domain": ("domains", lambda item: str(item.get("domain"))),
+    "user": ("domains/{domain}/users", lambda item: str(item.get("user"))),
+    "device": ("domains/{domain}/devices", lambda item: f"{item.get('user')}/{item.get('device')}"),
+    "callqueue": ("domains/{domain}/callqueues", lambda item: str(item.get("callqueue")))
+}
+SUCCESS_STATUSES = (200, 201, 202, 409)
+
+def step_created(result) -> bool:
+    """Whether a create step's status code means the object exists or is on its way."""
+    return result in SUCCESS_STATUSES
+
+class _Readiness:
+    """What the sync and async waiters share: the listings, the backoff, what has been seen and the counters."""
+
+    def __init__(self, client, timeout: float = DEFAULT_READY_TIMEOUT, base_delay: float = DEFAULT_READY_BASE,
+                 max_delay: float = DEFAULT_READY_MAX_DELAY, enabled: bool = READY_ENABLED):
+        self.client = client
+        self.timeout = timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.enabled = enabled
+        self._seen: Dict[str, Set[str]] = {}
+        self._stats_lock = threading.Lock()
+        # Moving average of how long a created object takes to appear, which sets the first poll delay
+        self.latency: Optional[float] = None
+        self.waits = 0
+        self.polls = 0
+        self.timeouts = 0
+        self.waited_seconds = 0.0
+
+    @staticmethod
+    def _listing(kind: str, domain: Optional[str]) -> Tuple[str, Callable[[dict], str]]:
+        if kind not in READY_LISTINGS:
+            raise ValueError(f"Unknown object kind for readiness: {kind}")
+        path, key_of = READY_LISTINGS[kind]
+        return path.format(domain=domain), key_of
+
+    def _delay(self, attempt: int) -> float:
+        if attempt == 0 and self.latency:
+            # Wait about as long as recent objects took to turn up, then close in with short jittered steps
+            return min(max(self.base_delay, 0.8 * self.latency), self.max_delay)
+        return backoff_delay(max(attempt - 1, 0), self.base_delay, self.max_delay)
+
+    def _keys(self, path: str, response, key_of) -> Optional[Set[str]]:
+        """The keys in a listing response, or None when it could not be read."""
+        with self._stats_lock:
+            self.polls += 1
+        if response is None:
+            return None
+        if response.status_code == 404:
+            # The parent the listing hangs off is not there yet either
+            return set()
+        if response.status_code != 200:
+            logger.warning(f"Could not list {path} to check readiness: {response.status_code}")
+            return None
+        try:
+            items = response.json()
+        except ValueError:
+            logger.warning(f"Could not parse {path} listing to check readiness")
+            return None
+        items = items if isinstance(items, list) else [items]
+        return {key_of(item) for item in items if isinstance(item, dict)}
+
+    def _finish(self, kind: str, key: str, domain: Optional[str], found: bool, elapsed: float) -> bool:
+        with self._stats_lock:
+            self.waits += 1
+            self.waited_seconds += elapsed
+            if found:
+                self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+            else:
+                self.timeouts += 1
+        if found:
+            logger.debug(f"{kind} {key} in {domain or 'host'} ready after {elapsed:.2f}s")
+            return True
+        print(f"{kind.capitalize()} {key} was not ready after {elapsed:.1f}s")
+        logger.error(f"{kind.capitalize()} {key} in {domain or 'host'} was not ready after {elapsed:.1f}s")
+        return False
+
+    def _already_seen(self) -> bool:
+        with self._stats_lock:
+            self.waits += 1
+        return True
+
+    def forget(self) -> None:
+        """Drop every object seen so far, e.g. after the API's objects were wiped."""
+        self._seen = {}
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "waits": self.waits,
+            "polls": self.polls,
+            "timeouts": self.timeouts,
+            "waited_seconds": round(self.waited_seconds, 2),
+            "latency": round(self.latency, 3) if self.latency is not None else None
+        }
+
+class _Pending:
+    __slots__ = ("kind", "domain", "key", "future", "started", "deadline")
+
+    def __init__(self, kind: str, domain: Optional[str], key: str, future: Future, started: float, deadline: float):
+        self.kind = kind
+        self.domain = domain
+        self.key = key
+        self.future = future
+        self.started = started
+        self.deadline = deadline
+
+class ReadinessWaiter(_Readiness):
+    """Tracks objects the API creates asynchronously ("synchronous": "no") until they actually exist.
+
+    when_ready() returns a Future that a background poller resolves once the
+    object shows up in its listing. Every object waiting on the same listing
+    (all the users of a domain, say) is checked by the same GET, so a burst of
+    creates costs one poll per listing per interval rather than one per
+    object. The first poll comes about as long after the create as recent
+    objects have taken to appear, and jittered exponential backoff takes over
+    from there.
+    """
+
+    def __init__(self, client, pollers: int = DEFAULT_READY_POLLERS, **kwargs):
+        super().__init__(client, **kwargs)
+        self.pollers = pollers
+        self._cond = threading.Condition()
+        self._pending: Dict[str, List[_Pending]] = {}
+        self._key_of: Dict[str, Callable[[dict], str]] = {}
+        self._next_poll: Dict[str, float] = {}
+        self._attempts: Dict[str, int] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def when_ready(self, kind: str, domain: Optional[str], key, timeout: Optional[float] = None) -> Future:
+        """Return a Future that becomes True once the object is listed, or False if it does not appear within the timeout."""
+        future: Future = Future()
+        if not self.enabled:
+            future.set_result(True)
+            return future
+        path, key_of = self._listing(kind, domain)
+        key = str(key)
+        now = time.monotonic()
+        with self._cond:
+            if key in self._seen.get(path, ()):
+                future.set_result(self._already_seen())
+                return future
+            self._pending.setdefault(path, []).append(_Pending(kind, domain, key, future, now, now + (timeout or self.timeout)))
+            self._key_of[path] = key_of
+            if path not in self._next_poll:
+                self._next_poll[path] = now + self._delay(self._attempts.get(path, 0))
+            if self._thread is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.pollers, thread_name_prefix="readiness-poll")
+                self._thread = threading.Thread(target=self._run, name="readiness", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def wait(self, kind: str, domain: Optional[str], key, timeout: Optional[float] = None) -> bool:
+        """Block until the object is listed; False if it did not appear within the timeout."""
+        with span(f"ready:{kind}:{key}", "object", domain=domain):
+            return self.when_ready(kind, domain, key, timeout).result()
+
+    def check(self, kind: str, domain: Optional[str], key) -> Callable:
+        """Return a ready= hook for TaskGraph.add/Pipeline.submit that releases dependents once this object exists."""
+
+        def ready(result):
+            return self.when_ready(kind, domain, key) if step_created(result) else True
+        return ready
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                due = [path for path, at in self._next_poll.items() if at <= now]
+                if not due:
+                    self._cond.wait(min(self._next_poll.values()) - now if self._next_poll else None)
+                    continue
+                for path in due:
+                    del self._next_poll[path]
+            # Different listings are polled side by side
+            for future in [self._pool.submit(self._poll, path) for path in due]:
+                try:
+                    future.result()
+                except Exception:
+                    logger.exception("Readiness poll failed")
+
+    def forget(self) -> None:
+        with self._cond:
+            super().forget()
+
+    def _poll(self, path: str) -> None:
+        try:
+            response = self.client.get(f"/ns-api/v2/{path}")
+            keys = self._keys(path, response, self._key_of[path])
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Could not list {path} to check readiness: {e}")
+            keys = None
+        except Exception:
+            # Escaping here would stop the poller thread and leave every waiter hanging
+            logger.exception(f"Could not check readiness of {path}")
+            keys = None
+        now = time.monotonic()
+        finished = []
+        with self._cond:
+            seen = self._seen.setdefault(path, set())
+            seen.update(keys or ())
+            waiting = []
+            # An unreadable listing proves nothing either way, so its waiters stay pending until their deadline
+            for pending in self._pending.pop(path, []):
+                if pending.key in seen:
+                    finished.append((pending, True))
+                elif now >= pending.deadline:
+                    finished.append((pending, False))
+                else:
+                    waiting.append(pending)
+            if waiting:
+                self._pending[path] = waiting
+                # Objects turning up means more are close behind, so the backoff starts over
+                attempts = 1 if any(found for _, found in finished) else self._attempts.get(path, 0) + 1
+                self._attempts[path] = attempts
+                # Never later than the first deadline, so a timeout is reported on time
+                first_deadline = min(pending.deadline for pending in waiting)
+                self._next_poll.setdefault(path, min(now + self._delay(attempts), first_deadline))
+            else:
+                self._attempts.pop(path, None)
+                self._next_poll.pop(path, None)
+        for pending, found in finished:
+            ready = self._finish(pending.kind, pending.key, pending.domain, found, now - pending.started)
+            if not pending.future.cancelled():
+                pending.future.set_result(ready)
+
+class AsyncReadinessWaiter(_Readiness):
+    """ReadinessWaiter for the asyncio backend, on an AsyncNetSapiensClient.
+
+    Each wait is a coroutine that polls for itself, but a poll of a listing
+    another waiter has just fetched is answered from that fetch, so the
+    batching is the same.
+    """
+
+    def __init__(self, client, **kwargs):
+        super().__init__(client, **kwargs)
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._polled: Dict[str, float] = {}
+
+    async def _check(self, path: str, key_of, key: str) -> bool:
+        async with self._locks.setdefault(path, asyncio.Lock()):
+            if key in self._seen.get(path, ()):
+                return True
+            if time.monotonic() - self._polled.get(path, float("-inf")) < self.base_delay:
+                return False
+            try:
+                keys = self._keys(path, await self.client.get(f"/ns-api/v2/{path}"), key_of)
+            except Exception as e:
+                logger.warning(f"Could not list {path} to check readiness: {e}")
+                keys = None
+            self._polled[path] = time.monotonic()
+            # An unreadable listing proves nothing either way, so the wait carries on until its deadline
+            self._seen.setdefault(path, set()).update(keys or ())
+            return key in self._seen[path]
+
+    async def wait(self, kind: str, domain: Optional[str], key, timeout: Optional[float] = None) -> bool:
+        """Wait on the event loop until the object is listed; False if it did not appear within the timeout."""
+        if not self.enabled:
+            return True
+        path, key_of = self._listing(kind, domain)
+        key = str(key)
+        if key in self._seen.get(path, ()):
+            return self._already_seen()
+        started = time.monotonic()
+        deadline = started + (timeout or self.timeout)
+        attempt = 0
+        with span(f"ready:{kind}:{key}", "object", domain=domain):
+            while True:
+                await asyncio.sleep(min(self._delay(attempt), max(deadline - time.monotonic(), 0)))
+                attempt += 1
+                found = await self._check(path, key_of, key)
+                if found or time.monotonic() >= deadline:
+                    return self._finish(kind, key, domain, found, time.monotonic() - started)
+
+    def check(self, kind: str, domain: Optional[str], key) -> Callable:
+        """Return an async ready= hook for TaskGraph.add that waits for this object."""
+
+        async def ready(result):
+            return not step_created(result) or await self.wait(kind, domain, key)
+        return ready
+
+# One waiter per client, so every tenant and graph on a host shares its polls
+_waiters: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_waiters_lock = threading.Lock()
+
+def get_waiter(client) -> _Readiness:
+    """Return the shared readiness waiter for a client (async clients get an AsyncReadinessWaiter)."""
+    with _waiters_lock:
+        waiter = _waiters.get(client)
+        if waiter is None:
+            waiter_class = AsyncReadinessWaiter if asyncio.iscoroutinefunction(client.get) else ReadinessWaiter
+            waiter = waiter_class(client)
+            _waiters[client] = waiter
+        return waiter
+
+def report_readiness(client, label: str = "") -> None:
+    """Print and log how much readiness waiting a client's run did, if any."""
+    waiter = _waiters.get(client)
+    if waiter is None or not waiter.waits:
+        return
+    stats = waiter.stats()
+    latency = f"{stats['latency']}s" if stats["latency"] is not None else "-"
+    message = (f"Readiness for {label or client.api_url}: {stats['waits']} waits served by {stats['polls']} listing polls, "
+               f"{stats['timeouts']} timed out, typical time to ready {latency}")
+    print(message)
+    logger.info(message)
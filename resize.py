@@ -4,52 +4,180 @@ import requests
 from PIL import Image
 from io import BytesIO
 from logging_setup import setup_logging
+from image_cache import source_hash
+from rate_limiter import backoff_delay, parse_retry_after
 
-logger = setup_logging()
+logger = setup_logging(__name__)
 
-def resize_image_from_url(image_url, output_directory, max_retries=3):
-    os.makedirs(output_directory, exist_ok=True)
-    image_filename = os.path.basename(image_url)
+VARIANT_SIZES = [(192, 192), (512, 512), (250, 150)]
+MAX_DECODE_PIXELS = int(os.getenv("NS_MAX_DECODE_PIXELS", "50000000"))
+# reduce() averages raw pixel values, so palette and 1-bit sources are converted before shrinking
+REDUCE_MODES = {"1": "L", "P": "RGB", "PA": "RGBA", "LA": "RGBA"}
+
+def variant_name(size):
+    return f"{size[0]}x{size[1]}.jpg"
+
+def fetch_image(image_url, max_retries=3, headers=None):
     print(f"Downloading image from URL: {image_url}")
     logger.info(f"Downloading image from URL: {image_url}")
-    logger.debug(f"Image filename extracted: {image_filename}")
+    logger.debug("Image filename extracted: %s", os.path.basename(image_url))
 
     for attempt in range(max_retries):
         try:
-            response = requests.get(image_url)
+            response = requests.get(image_url, headers=headers)
             if response.status_code == 200:
                 print("Image downloaded successfully")
                 logger.info("Image downloaded successfully")
-                image_data = BytesIO(response.content)
-                original_image = Image.open(image_data)
-                # Convert P or RGBA to RGB for JPEG compatibility
-                if original_image.mode in ["P", "RGBA"]:
-                    print(f"Converting {original_image.mode} image to RGB")
-                    logger.info(f"Converting {original_image.mode} image to RGB")
-                    original_image = original_image.convert("RGB")
-                sizes = [(192, 192), (512, 512), (250, 150)]
-                for size in sizes:
-                    resized_image = original_image.resize(size)
-                    filename = f"{size[0]}x{size[1]}"
-                    output_path = os.path.join(output_directory, f"{filename}.jpg")
-                    resized_image.save(output_path)
-                    print(f"Resized image saved to {output_path}")
-                    logger.info(f"Resized image saved to {output_path}")
-                return  # Success, exit function
+                return response
+            elif response.status_code == 304:
+                print("Image not modified since last download")
+                logger.info("Image not modified since last download (304)")
+                return response
             elif response.status_code == 429:
                 print(f"Rate limit hit (429), retrying {attempt + 1}/{max_retries}...")
                 logger.warning(f"Rate limit hit (429), retrying {attempt + 1}/{max_retries}...")
-                time.sleep(2 ** attempt)  # Exponential backoff: 1s, 2s, 4s
+                # Honour Retry-After, otherwise jittered exponential backoff up to 1s, 2s, 4s
+                time.sleep(max(parse_retry_after(response.headers.get("Retry-After")) or 0, backoff_delay(attempt, base=1.0)))
             else:
                 print(f"Failed to download the image. Status code: {response.status_code}")
                 logger.error(f"Failed to download the image. Status code: {response.status_code}")
-                return
+                return None
         except requests.exceptions.RequestException as e:
             print(f"Error downloading image: {e}")
             logger.error(f"Error downloading image: {e}")
-            return
+            return None
     print(f"Failed to download image after {max_retries} retries")
     logger.error(f"Failed to download image after {max_retries} retries")
+    return None
+
+def download_image(image_url, max_retries=3):
+    response = fetch_image(image_url, max_retries)
+    return response.content if response is not None else None
+
+def image_bytes_estimate(image):
+    return image.width * image.height * len(image.getbands())
+
+def reduce_source(original_image):
+    largest = (max(size[0] for size in VARIANT_SIZES), max(size[1] for size in VARIANT_SIZES))
+    if original_image.format == "JPEG":
+        # Let the JPEG decoder scale by 1/2, 1/4 or 1/8 while decoding, never below the largest target
+        original_image.draft("RGB", largest)
+    pixels = original_image.width * original_image.height
+    if pixels > MAX_DECODE_PIXELS:
+        raise ValueError(f"Image is {original_image.width}x{original_image.height} ({pixels} pixels), above the {MAX_DECODE_PIXELS} pixel decode limit")
+    original_image.load()
+    decoded_bytes = image_bytes_estimate(original_image)
+    # Shrink by a whole factor while keeping at least twice the largest target for resampling quality
+    factor = min(original_image.width // (2 * largest[0]), original_image.height // (2 * largest[1]))
+    if factor >= 2:
+        if original_image.mode in REDUCE_MODES:
+            original_image = original_image.convert(REDUCE_MODES[original_image.mode])
+            decoded_bytes += image_bytes_estimate(original_image)
+        original_image = original_image.reduce(factor)
+        decoded_bytes += image_bytes_estimate(original_image)
+    return original_image, decoded_bytes
+
+def resize_variants(original_image):
+    started = time.perf_counter()
+    source_size = original_image.size
+    # Total size of every pixel buffer created along the way. Pillow allocates outside tracemalloc's view, so this
+    # is an estimate of the decoding work rather than a measured peak
+    source_image, decoded_bytes = reduce_source(original_image)
+    # Convert P or RGBA to RGB for JPEG compatibility
+    if source_image.mode in ["P", "RGBA"]:
+        print(f"Converting {source_image.mode} image to RGB")
+        logger.info(f"Converting {source_image.mode} image to RGB")
+        source_image = source_image.convert("RGB")
+        decoded_bytes += image_bytes_estimate(source_image)
+
+    # Build the largest variant from the source and the smaller ones from that intermediate
+    ordered_sizes = sorted(VARIANT_SIZES, key=lambda size: size[0] * size[1], reverse=True)
+    intermediate = source_image.resize(ordered_sizes[0])
+    resized = {variant_name(ordered_sizes[0]): intermediate}
+    for size in ordered_sizes[1:]:
+        resized[variant_name(size)] = intermediate.resize(size)
+    decoded_bytes += sum(image_bytes_estimate(image) for image in resized.values())
+
+    elapsed = time.perf_counter() - started
+    print(f"Resized {source_size[0]}x{source_size[1]} image (decoded at {source_image.width}x{source_image.height}) in {elapsed * 1000:.1f} ms, estimated pixel bytes decoded {decoded_bytes / 1024 / 1024:.1f} MB")
+    logger.info(f"Resized {source_size[0]}x{source_size[1]} image (decoded at {source_image.width}x{source_image.height}) in {elapsed * 1000:.1f} ms, estimated pixel bytes decoded {decoded_bytes / 1024 / 1024:.1f} MB")
+    return {variant_name(size): resized[variant_name(size)] for size in VARIANT_SIZES}
+
+def encode_variants(original_image):
+    """Resize an image to every branding size and JPEG-encode each variant once, in memory."""
+    variants = {}
+    for name, resized_image in resize_variants(original_image).items():
+        buffer = BytesIO()
+        resized_image.save(buffer, format="JPEG")
+        variants[name] = buffer.getvalue()
+        logger.info(f"Encoded {name} in memory ({len(variants[name])} bytes)")
+    return variants
+
+def variants_from_bytes(image_bytes, cache=None):
+    if cache:
+        digest = source_hash(image_bytes)
+        cached = cache.get_all(digest, VARIANT_SIZES)
+        if cached:
+            print("Using cached image variants")
+            logger.info(f"Using cached image variants for source {digest[:12]}")
+            return {variant_name(size): data for size, data in cached.items()}
+    try:
+        with Image.open(BytesIO(image_bytes)) as original_image:
+            variants = encode_variants(original_image)
+    except (OSError, ValueError) as e:
+        print(f"Error resizing image: {e}")
+        logger.error(f"Error resizing image: {e}")
+        return None
+    if cache:
+        for size in VARIANT_SIZES:
+            cache.put(digest, size, variants[variant_name(size)])
+    return variants
+
+def variants_from_file(image_path, cache=None):
+    with open(image_path, "rb") as image_file:
+        return variants_from_bytes(image_file.read(), cache)
+
+def variants_from_url(image_url, max_retries=3, cache=None):
+    headers = {}
+    cached = None
+    metadata = cache.url_metadata(image_url) if cache else None
+    if metadata:
+        cached = cache.get_all(metadata["source_hash"], VARIANT_SIZES)
+        if cached:
+            # Revalidate instead of downloading again when the server supports it
+            if metadata.get("etag"):
+                headers["If-None-Match"] = metadata["etag"]
+            if metadata.get("last_modified"):
+                headers["If-Modified-Since"] = metadata["last_modified"]
+    response = fetch_image(image_url, max_retries, headers=headers or None)
+    if response is None:
+        return None
+    if response.status_code == 304 and cached:
+        print("Using cached image variants")
+        logger.info(f"Using cached image variants for {image_url}")
+        return {variant_name(size): data for size, data in cached.items()}
+    variants = variants_from_bytes(response.content, cache)
+    if cache:
+        cache.save_url_metadata(image_url, source_hash(response.content), response.headers.get("ETag"), response.headers.get("Last-Modified"))
+    return variants
+
+def resize_image_from_url(image_url, output_directory, max_retries=3):
+    os.makedirs(output_directory, exist_ok=True)
+    image_bytes = download_image(image_url, max_retries)
+    if image_bytes is None:
+        return
+    try:
+        original_image = Image.open(BytesIO(image_bytes))
+        variants = resize_variants(original_image)
+    except (OSError, ValueError) as e:
+        print(f"Error resizing image: {e}")
+        logger.error(f"Error resizing image: {e}")
+        return
+    for name, resized_image in variants.items():
+        output_path = os.path.join(output_directory, name)
+        resized_image.save(output_path)
+        print(f"Resized image saved to {output_path}")
+        logger.info(f"Resized image saved to {output_path}")
 
 if __name__ == "__main__":
     print("Starting image resize script")
@@ -59,4 +187,4 @@ if __name__ == "__main__":
     output_directory = 'image_files'
     resize_image_from_url(image_url, output_directory)
     print("Image resize script completed")
-    logger.info("Image resize script completed")
\ No newline at end of file
+    logger.info("Image resize script completed")
@@ -1,14 +1,14 @@
 import requests
-import json
 import os
-from dotenv import load_dotenv
-from logging_setup import setup_logging
+from settings import load_env
+from logging_setup import setup_logging, LazyJSON, LazyText
+from ns_client import get_client
 
 # Initialize logger
-logger = setup_logging()
+logger = setup_logging(__name__)
 
 # Load environment variables from .env file
-load_dotenv()
+load_env()
 
 # Retrieve the API token
 API_TOKEN = os.getenv("API_TOKEN")
@@ -16,40 +16,54 @@ API_TOKEN = os.getenv("API_TOKEN")
 print(f"Loaded API_TOKEN: {API_TOKEN}")
 logger.info(f"Loaded API_TOKEN: {API_TOKEN}")
 
-def create_us_domestic_route(custID, api_url, match_to="sip:1??????????@*", con_host="a.icr.commio.com", con_index="1"):
-    api_url = api_url.rstrip('/')
+def route_payload(match_to="sip:1??????????@*", con_index="1", con_host="a.icr.commio.com"):
+    return {
+        "match_to": match_to,
+        "con_index": con_index,
+        "con_host": con_host
+    }
+
+def route_request(api_url, match_to="sip:1??????????@*", con_host="a.icr.commio.com", con_index="1"):
+    """Log and return (url, headers, payload) for creating a route."""
     url = f"{api_url}/ns-api/v2/routecon"
     headers = {
         "accept": "application/json",
-        "authorization": f"Bearer {API_TOKEN}",
         "content-type": "application/json"
     }
-    payload = {
-        "match_to": match_to,
-        "con_index": con_index,
-        "con_host": con_host
-    }
+    payload = route_payload(match_to, con_index, con_host)
 
     print(f"Creating route at: {url}")
     logger.info(f"Creating route at: {url}")
-    logger.debug(f"Payload: {json.dumps(payload, indent=2)}")
+    logger.debug("Payload: %s", LazyJSON(payload))
+    return url, headers, payload
+
+def route_response(response):
+    print(f"Status Code: {response.status_code}")
+    logger.info(f"Status Code: {response.status_code} for route creation")
+    logger.debug("Response text: %s", LazyText(response))
+    return response
+
+def route_error(url, e):
+    logger.error(f"Error creating route at {url}: {e}")
+    print(f"Error creating route at {url}: {e}")
+
+def create_us_domestic_route(custID, api_url, match_to="sip:1??????????@*", con_host="a.icr.commio.com", con_index="1", client=None):
+    api_url = api_url.rstrip('/')
+    client = client or get_client(api_url)
+    url, headers, payload = route_request(api_url, match_to, con_host, con_index)
 
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        print(f"Status Code: {response.status_code}")
-        logger.info(f"Status Code: {response.status_code} for route creation")
-        logger.debug(f"Response text: {response.text}")
-        return response
+        response = client.post(url, headers=headers, json=payload, conflict_safe=True)
     except requests.exceptions.RequestException as e:
-        logger.error(f"Error creating route at {url}: {e}")
-        print(f"Error creating route at {url}: {e}")
+        route_error(url, e)
         raise
+    return route_response(response)
 
-def manage_us_domestic_route(custID, api_url):
+def manage_us_domestic_route(custID, api_url, client=None):
     print("Starting US domestic route management")
     logger.info("Starting US domestic route management")
 
-    response = create_us_domestic_route(custID, api_url)
+    response = create_us_domestic_route(custID, api_url, client=client)
     if response.status_code in (201, 202):
         print("US Domestic route created successfully to ThinQ LCR Outbound")
         logger.info(f"US Domestic route created successfully with status code: {response.status_code}")
@@ -0,0 +1,20 @@
+import os
+import threading
+from dotenv import load_dotenv
+
+_env_loaded = False
+_env_lock = threading.Lock()
+
+def load_env():
+    """Load the .env file into the environment once per process.
+
+    Every module calls this at import time; only the first call reads the file.
+    Values from .env take precedence over the shell, matching what the eval
+    build has always ended up with.
+    """
+    global _env_loaded
+    with _env_lock:
+        if not _env_loaded:
+            load_dotenv(override=True)
+            _env_loaded = True
+    return os.environ
@@ -1,20 +1,75 @@
-import subprocess
+import ast
+import importlib
+import os
+import runpy
 import sys
+import time
 
-def start_blueprint():
+SCRIPTS = {
+    'e': ("Eval", "eval-main.py"),
+    'p': ("Prod", "prod-main.py"),
+}
+
+def script_imports(script_path):
+    # Top-level modules the build script imports, in the order it imports them
+    with open(script_path, "r") as script_file:
+        tree = ast.parse(script_file.read(), filename=script_path)
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+def import_modules(modules):
+    """Import each module once and return (module, seconds) in import order.
+
+    Times are inclusive of anything a module pulls in that was not already
+    loaded, so shared dependencies are charged to the first module that needs them.
+    """
+    timings = []
+    for module in modules:
+        started = time.perf_counter()
+        importlib.import_module(module)
+        timings.append((module, time.perf_counter() - started))
+    return timings
+
+def print_import_report(timings, total):
+    print("\n=== Startup import times ===")
+    for module, elapsed in sorted(timings, key=lambda item: item[1], reverse=True):
+        print(f"  {elapsed * 1000:8.1f} ms  {module}")
+    print(f"  {total * 1000:8.1f} ms  total")
+    print(f"  Pillow loaded: {'yes' if 'PIL' in sys.modules else 'no (deferred until images are processed)'}")
+    print("  Run with python -X importtime for a per-module tree.")
+
+def run_build(env_choice):
+    label, script = SCRIPTS[env_choice]
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+    print(f"\n=== Starting {label} Build ===")
+
+    # Load .env once for the whole run before any module reads it
+    from settings import load_env
+    started = time.perf_counter()
+    load_env()
+    timings = import_modules(script_imports(script_path))
+    if os.getenv("NS_IMPORT_REPORT", "1") != "0":
+        print_import_report(timings, time.perf_counter() - started)
+
+    # Run the build in this interpreter so the modules imported above are reused
+    runpy.run_path(script_path, run_name="__main__")
+
+def start_blueprint(env_choice=None):
     # Prompt user for environment
-    env_choice = input("Is this build for Eval (e) or Prod (p)? ").strip().lower()
-
-    # Check input and call appropriate script
-    if env_choice == 'e':
-        print("\n=== Starting Eval Build ===")
-        subprocess.call([sys.executable, 'eval-main.py'])
-    elif env_choice == 'p':
-        print("\n=== Starting Prod Build ===")
-        subprocess.call([sys.executable, 'prod-main.py'])
+    if env_choice is None:
+        env_choice = input("Is this build for Eval (e) or Prod (p)? ").strip().lower()
+
+    # Check input and run the matching build
+    if env_choice in SCRIPTS:
+        run_build(env_choice)
     else:
         print("Invalid input. Please enter 'e' for Eval or 'p' for Prod.")
         start_blueprint()  # Restart prompt if invalid input
 
 if __name__ == "__main__":
-    start_blueprint()
+    start_blueprint(sys.argv[1].strip().lower() if len(sys.argv) > 1 else None)
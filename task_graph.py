@@ -0,0 +1,300 @@
+import asyncio
+import os
+import reprlib
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Iterable, List, Optional
+from logging_setup import setup_logging
+from journal import payload_hash, step_succeeded
+from tracing import span, propagate
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+DEFAULT_GRAPH_WORKERS = int(os.getenv("NS_GRAPH_WORKERS", "8"))
+
+class Task:
+    """One provisioning step and the steps it has to wait for."""
+
+    def __init__(self, name: str, func: Callable, args: tuple, kwargs: dict, deps: Iterable[str], ready: Optional[Callable] = None,
+                 succeeded: Optional[Callable] = step_succeeded, journaled: bool = True):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.deps = list(deps)
+        self.ready = ready
+        self.succeeded = succeeded
+        self.journaled = journaled
+        self.status = "pending"
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.start: Optional[float] = None
+        self.end: Optional[float] = None
+
+    @property
+    def duration(self) -> float:
+        if self.start is None or self.end is None:
+            return 0.0
+        return self.end - self.start
+
+def graph_succeeded(graph: "TaskGraph") -> bool:
+    """Success check for a task that runs a nested graph: every task in it succeeded or was resumed."""
+    return all(task.status in ("succeeded", "resumed") for task in graph.tasks.values())
+
+class TaskGraph:
+    """Dependency graph of provisioning steps run in parallel on a thread pool."""
+
+    def __init__(self, name: str = "provisioning"):
+        self.name = name
+        self.tasks: Dict[str, Task] = {}
+        self._lock = threading.Lock()
+        self.started: Optional[float] = None
+
+    def add(self, name: str, func: Callable, *args, deps: Iterable[str] = (), ready: Optional[Callable] = None,
+            succeeded: Optional[Callable] = step_succeeded, journaled: bool = True, **kwargs) -> str:
+        """Add a task; it runs once every task named in deps has succeeded.
+
+        The create functions report a failed request by returning its status
+        code (or None) rather than raising, so succeeded(result) decides
+        whether the task worked; pass None for a task that raises instead.
+        journaled=False keeps a task out of the run journal, for a task that
+        records its own steps there (and so must run again to retry them).
+
+        ready(result), when given, is called with the task's result before its
+        dependents are released, e.g. to wait until an object the API creates
+        asynchronously exists. It returns a bool, or a Future of one that the
+        graph waits on without holding a worker; False fails the task.
+        """
+        if name in self.tasks:
+            raise ValueError(f"Duplicate task name: {name}")
+        self.tasks[name] = Task(name, func, args, kwargs, deps, ready, succeeded, journaled)
+        return name
+
+    def _validate(self) -> None:
+        for task in self.tasks.values():
+            for dep in task.deps:
+                if dep not in self.tasks:
+                    raise ValueError(f"Task {task.name} depends on unknown task {dep}")
+        # Kahn's algorithm: anything left over sits on a cycle
+        remaining = {name: len(task.deps) for name, task in self.tasks.items()}
+        dependents = self._dependents()
+        ready = [name for name, count in remaining.items() if count == 0]
+        visited = 0
+        while ready:
+            name = ready.pop()
+            visited += 1
+            for child in dependents[name]:
+                remaining[child] -= 1
+                if remaining[child] == 0:
+                    ready.append(child)
+        if visited != len(self.tasks):
+            raise ValueError(f"Task graph {self.name} contains a dependency cycle")
+
+    def _dependents(self) -> Dict[str, List[str]]:
+        dependents: Dict[str, List[str]] = {name: [] for name in self.tasks}
+        for task in self.tasks.values():
+            for dep in task.deps:
+                dependents[dep].append(task.name)
+        return dependents
+
+    def _run_task(self, task: Task):
+        task.start = time.perf_counter()
+        try:
+            with span(task.name, "object"):
+                return task.func(*task.args, **task.kwargs)
+        finally:
+            task.end = time.perf_counter()
+
+    def _check_result(self, task: Task) -> None:
+        if task.succeeded and not task.succeeded(task.result):
+            raise RuntimeError(f"{task.name} did not succeed (returned {reprlib.repr(task.result)})")
+
+    def _skip(self, name: str, dependents: Dict[str, List[str]], reason: str) -> None:
+        for child in dependents[name]:
+            task = self.tasks[child]
+            if task.status == "pending":
+                task.status = "skipped"
+                print(f"Skipping {child}: {reason}")
+                logger.warning(f"Skipping task {child}: {reason}")
+                self._skip(child, dependents, reason)
+
+    def run(self, max_workers: int = DEFAULT_GRAPH_WORKERS, journal=None) -> Dict[str, Task]:
+        """Run every task as soon as its dependencies succeed and return the tasks.
+
+        With a RunJournal, tasks it records as succeeded with the same arguments
+        are marked "resumed" without running, and every finished task is recorded.
+        """
+        self._validate()
+        dependents = self._dependents()
+        remaining = {name: len(task.deps) for name, task in self.tasks.items()}
+        self.started = time.perf_counter()
+        logger.info(f"Running task graph {self.name}: {len(self.tasks)} tasks with {max_workers} workers")
+
+        with span(self.name, "phase", tasks=len(self.tasks)), ThreadPoolExecutor(max_workers=max_workers) as executor:
+            running = {}
+
+            def submit_ready(names):
+                ready = list(names)
+                while ready:
+                    name = ready.pop()
+                    task = self.tasks[name]
+                    if task.status != "pending" or remaining[name] != 0:
+                        continue
+                    if journal and task.journaled and journal.is_done(f"{self.name}/{name}", payload_hash(task.func, task.args, task.kwargs)):
+                        # Finished in an earlier run: release its dependents without running it again
+                        task.status = "resumed"
+                        print(f"Skipping {name}: already completed in a previous run")
+                        logger.info(f"Skipping task {name}: already completed in a previous run")
+                        for child in dependents[name]:
+                            remaining[child] -= 1
+                        ready.extend(dependents[name])
+                        continue
+                    task.status = "running"
+                    running[executor.submit(propagate(self._run_task), task)] = task
+
+            submit_ready(list(self.tasks))
+            while running:
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    try:
+                        if task.status == "readying":
+                            if not future.result():
+                                raise RuntimeError(f"{task.name} was created but never became ready")
+                            # Dependents waited for readiness too, so it counts towards the critical path
+                            task.end = time.perf_counter()
+                        else:
+                            task.result = future.result()
+                            self._check_result(task)
+                            ready = task.ready(task.result) if task.ready else True
+                            if isinstance(ready, Future):
+                                task.status = "readying"
+                                running[ready] = task
+                                continue
+                            if not ready:
+                                raise RuntimeError(f"{task.name} was created but never became ready")
+                        task.status = "succeeded"
+                    except Exception as e:
+                        task.error = e
+                        task.status = "failed"
+                        if journal and task.journaled:
+                            journal.record(f"{self.name}/{task.name}", payload_hash(task.func, task.args, task.kwargs), False, str(e))
+                        print(f"Task {task.name} failed: {e}")
+                        logger.error(f"Task {task.name} failed: {e}")
+                        self._skip(task.name, dependents, f"dependency {task.name} failed")
+                        continue
+                    if journal and task.journaled:
+                        journal.record(f"{self.name}/{task.name}", payload_hash(task.func, task.args, task.kwargs), True, task.result)
+                    for child in dependents[task.name]:
+                        remaining[child] -= 1
+                    submit_ready(dependents[task.name])
+
+        counts: Dict[str, int] = {}
+        for task in self.tasks.values():
+            counts[task.status] = counts.get(task.status, 0) + 1
+        elapsed = time.perf_counter() - self.started
+        summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+        print(f"Task graph {self.name} finished in {elapsed:.2f}s ({summary})")
+        logger.info(f"Task graph {self.name} finished in {elapsed:.2f}s ({summary})")
+        return self.tasks
+
+    async def run_async(self, journal=None) -> Dict[str, Task]:
+        """Run the graph as asyncio tasks on the running event loop; otherwise the same as run().
+
+        Coroutine functions are awaited directly, so one loop can keep every
+        ready task's requests in flight at once; plain functions (image
+        resizing, the training domain build) run in a worker thread.
+        """
+        self._validate()
+        dependents = self._dependents()
+        finished = {name: asyncio.Event() for name in self.tasks}
+        self.started = time.perf_counter()
+        logger.info(f"Running task graph {self.name}: {len(self.tasks)} tasks on the event loop")
+
+        async def run_task(task: Task) -> None:
+            try:
+                for dep in task.deps:
+                    await finished[dep].wait()
+                if task.status != "pending":
+                    # Skipped after a dependency failed
+                    return
+                key = f"{self.name}/{task.name}"
+                if journal and task.journaled and journal.is_done(key, payload_hash(task.func, task.args, task.kwargs)):
+                    task.status = "resumed"
+                    print(f"Skipping {task.name}: already completed in a previous run")
+                    logger.info(f"Skipping task {task.name}: already completed in a previous run")
+                    return
+                task.status = "running"
+                task.start = time.perf_counter()
+                try:
+                    with span(task.name, "object"):
+                        if asyncio.iscoroutinefunction(task.func):
+                            task.result = await task.func(*task.args, **task.kwargs)
+                        else:
+                            task.result = await asyncio.to_thread(task.func, *task.args, **task.kwargs)
+                        self._check_result(task)
+                        if task.ready:
+                            ready = task.ready(task.result)
+                            if asyncio.iscoroutine(ready):
+                                ready = await ready
+                            elif isinstance(ready, Future):
+                                ready = await asyncio.wrap_future(ready)
+                            if not ready:
+                                raise RuntimeError(f"{task.name} was created but never became ready")
+                except Exception as e:
+                    task.error = e
+                    task.status = "failed"
+                    if journal and task.journaled:
+                        journal.record(key, payload_hash(task.func, task.args, task.kwargs), False, str(e))
+                    print(f"Task {task.name} failed: {e}")
+                    logger.error(f"Task {task.name} failed: {e}")
+                    self._skip(task.name, dependents, f"dependency {task.name} failed")
+                    return
+                finally:
+                    task.end = time.perf_counter()
+                task.status = "succeeded"
+                if journal and task.journaled:
+                    journal.record(key, payload_hash(task.func, task.args, task.kwargs), True, task.result)
+            finally:
+                finished[task.name].set()
+
+        with span(self.name, "phase", tasks=len(self.tasks)):
+            await asyncio.gather(*(run_task(task) for task in self.tasks.values()))
+
+        counts: Dict[str, int] = {}
+        for task in self.tasks.values():
+            counts[task.status] = counts.get(task.status, 0) + 1
+        elapsed = time.perf_counter() - self.started
+        summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+        print(f"Task graph {self.name} finished in {elapsed:.2f}s ({summary})")
+        logger.info(f"Task graph {self.name} finished in {elapsed:.2f}s ({summary})")
+        return self.tasks
+
+    def critical_path(self) -> List[Task]:
+        """Return the chain of tasks that determined the wall-clock time of the run."""
+        finished = [task for task in self.tasks.values() if task.end is not None]
+        if not finished:
+            return []
+        path = [max(finished, key=lambda task: task.end)]
+        while True:
+            deps = [self.tasks[dep] for dep in path[-1].deps if self.tasks[dep].end is not None]
+            if not deps:
+                break
+            # The dependency that finished last is the one this task actually waited on
+            path.append(max(deps, key=lambda task: task.end))
+        path.reverse()
+        return path
+
+    def print_critical_path(self) -> None:
+        path = self.critical_path()
+        if not path:
+            return
+        total = path[-1].end - self.started
+        print(f"\n=== Critical path for {self.name} ({total:.2f}s) ===")
+        logger.info(f"=== Critical path for {self.name} ({total:.2f}s) ===")
+        for task in path:
+            offset = task.start - self.started
+            print(f"  +{offset:6.2f}s  {task.duration:6.2f}s  {task.name}")
+            logger.info(f"Critical path: +{offset:.2f}s {task.duration:.2f}s {task.name}")
@@ -0,0 +1,225 @@
+import asyncio
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from urllib.parse import urlsplit
+from logging_setup import setup_logging
+from ns_client import get_client, report_all
+from existence_index import ExistenceIndex
+from task_graph import DEFAULT_GRAPH_WORKERS
+from manifest import load_manifests, validate_manifest, apply_manifest
+from journal import get_journal, finish_journal
+from metrics import start_metrics_server
+from tracing import span, propagate
+from profiling import start_profiling
+from async_client import get_async_client, close_async_clients
+from async_provisioning import apply_manifest_async
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+DEFAULT_TENANT_WORKERS = int(os.getenv("NS_TENANT_WORKERS", "4"))
+DEFAULT_IMAGE_PROCESSES = int(os.getenv("NS_IMAGE_PROCESSES", "0")) or min(os.cpu_count() or 1, 4)
+DEFAULT_PER_HOST_LIMIT = int(os.getenv("NS_PER_HOST_LIMIT", "0")) or None
+DEFAULT_ASYNC = os.getenv("NS_ASYNC", "0") == "1"
+
+class TenantRunner:
+    """Provisions many tenant manifests at once, sharing one client and index per API host."""
+
+    def __init__(self, max_tenants=DEFAULT_TENANT_WORKERS, image_processes=DEFAULT_IMAGE_PROCESSES,
+                 per_host_limit=DEFAULT_PER_HOST_LIMIT, graph_workers=DEFAULT_GRAPH_WORKERS):
+        self.max_tenants = max_tenants
+        self.image_processes = image_processes
+        self.per_host_limit = per_host_limit
+        self.graph_workers = graph_workers
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self.results = []
+
+    def _host(self, api_url):
+        # One client, one in-flight cap and one existence index per API host. The first tenant on a
+        # host sets it up outside the lock; later tenants on that host wait on its future, others carry on
+        with self._lock:
+            pending = self._indexes.get(api_url)
+            owner = pending is None
+            if owner:
+                pending = self._indexes[api_url] = Future()
+        if owner:
+            try:
+                client = get_client(api_url)
+                if self.per_host_limit:
+                    client.set_max_in_flight(self.per_host_limit)
+                client.warm_up()
+                index = ExistenceIndex(client)
+                index.load()
+            except BaseException as e:
+                pending.set_exception(e)
+                raise
+            pending.set_result(index)
+        index = pending.result()
+        return index.client, index
+
+    def _run_tenant(self, tenant, manifest, image_pool):
+        started = time.perf_counter()
+        with span(f"tenant:{tenant['host_id']}", "phase", api_url=tenant["api_url"]):
+            client, index = self._host(tenant["api_url"])
+            journal = get_journal(tenant["api_url"], tenant["host_id"])
+            graph = apply_manifest(manifest, client=client, index=index, max_workers=self.graph_workers, image_pool=image_pool, journal=journal)
+            finish_journal(journal)
+        return self._result(tenant, graph, started)
+
+    async def _run_tenant_async(self, tenant, manifest, image_pool):
+        started = time.perf_counter()
+        with span(f"tenant:{tenant['host_id']}", "phase", api_url=tenant["api_url"]):
+            # Warm-up and the existence index use the sync client, off the event loop
+            sync_client, index = await asyncio.to_thread(self._host, tenant["api_url"])
+            client = get_async_client(tenant["api_url"], self.per_host_limit)
+            client.timeout = sync_client.timeout
+            journal = get_journal(tenant["api_url"], tenant["host_id"])
+            graph = await apply_manifest_async(manifest, client=client, index=index, image_pool=image_pool, journal=journal)
+            finish_journal(journal)
+        return self._result(tenant, graph, started)
+
+    def _result(self, tenant, graph, started):
+        counts = {"succeeded": 0, "failed": 0, "skipped": 0}
+        for task in graph.tasks.values():
+            counts[task.status] = counts.get(task.status, 0) + 1
+        # Steps resumed from the journal finished in an earlier run
+        counts["succeeded"] += counts.pop("resumed", 0)
+        return {
+            "tenant": tenant["host_id"],
+            "host": urlsplit(tenant["api_url"]).netloc,
+            "status": "failed" if counts["failed"] or counts["skipped"] else "succeeded",
+            "tasks": counts,
+            "elapsed": time.perf_counter() - started
+        }
+
+    def _validate_all(self, manifests):
+        tenants = []
+        for i, manifest in enumerate(manifests):
+            try:
+                tenants.append((validate_manifest(manifest), manifest))
+            except ValueError as e:
+                print(f"Manifest {i} ({manifest.get('host_id', 'unknown')}) is invalid: {e}")
+                logger.error(f"Manifest {i} ({manifest.get('host_id', 'unknown')}) is invalid: {e}")
+                self.results.append({"tenant": str(manifest.get("host_id") or f"#{i}"), "host": "-", "status": "invalid",
+                                     "tasks": {"succeeded": 0, "failed": 0, "skipped": 0}, "elapsed": 0.0})
+        return tenants
+
+    def _record(self, tenant, result, error, done, total):
+        if error is not None:
+            logger.error(f"Tenant {tenant['host_id']} failed: {error}")
+            result = {"tenant": tenant["host_id"], "host": urlsplit(tenant["api_url"]).netloc, "status": f"error: {error}",
+                      "tasks": {"succeeded": 0, "failed": 0, "skipped": 0}, "elapsed": 0.0}
+        self.results.append(result)
+        print(f"[{done}/{total}] {result['tenant']} {result['status']} in {result['elapsed']:.1f}s")
+        logger.info(f"[{done}/{total}] {result['tenant']} {result['status']} in {result['elapsed']:.1f}s")
+
+    def _image_pool(self):
+        # Spawned workers start with a fresh logging listener instead of inheriting a stopped one
+        return ProcessPoolExecutor(max_workers=self.image_processes, mp_context=multiprocessing.get_context("spawn"))
+
+    def run(self, manifests):
+        """Validate every manifest, then provision the valid ones concurrently and print a summary."""
+        tenants = self._validate_all(manifests)
+        print(f"\n=== Provisioning {len(tenants)} tenants ({self.max_tenants} at a time, {self.image_processes} image processes) ===")
+        logger.info(f"=== Provisioning {len(tenants)} tenants ({self.max_tenants} at a time, {self.image_processes} image processes, per-host limit: {self.per_host_limit}) ===")
+        started = time.perf_counter()
+        with self._image_pool() as image_pool, ThreadPoolExecutor(max_workers=self.max_tenants) as executor:
+            futures = {executor.submit(propagate(self._run_tenant), tenant, manifest, image_pool): tenant for tenant, manifest in tenants}
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    self._record(futures[future], future.result(), None, done, len(tenants))
+                except Exception as e:
+                    self._record(futures[future], None, e, done, len(tenants))
+
+        self.print_summary(time.perf_counter() - started)
+        return self.results
+
+    def run_async(self, manifests):
+        """Like run(), but every tenant is a coroutine on one event loop sharing an async client per host.
+
+        Tenants are not capped by max_tenants here: what reaches each host is
+        bounded by its client's in-flight limit (--per-host) and rate limiter.
+        """
+        tenants = self._validate_all(manifests)
+        print(f"\n=== Provisioning {len(tenants)} tenants on one event loop ({self.image_processes} image processes) ===")
+        logger.info(f"=== Provisioning {len(tenants)} tenants on one event loop ({self.image_processes} image processes, per-host limit: {self.per_host_limit}) ===")
+        started = time.perf_counter()
+
+        async def run_all(image_pool):
+            async def run_one(tenant, manifest):
+                try:
+                    return tenant, await self._run_tenant_async(tenant, manifest, image_pool), None
+                except Exception as e:
+                    return tenant, None, e
+
+            try:
+                pending = [run_one(tenant, manifest) for tenant, manifest in tenants]
+                for done, outcome in enumerate(asyncio.as_completed(pending), 1):
+                    self._record(*await outcome, done, len(tenants))
+            finally:
+                await close_async_clients()
+
+        with self._image_pool() as image_pool:
+            asyncio.run(run_all(image_pool))
+        self.print_summary(time.perf_counter() - started)
+        return self.results
+
+    def print_summary(self, elapsed):
+        results = sorted(self.results, key=lambda result: result["tenant"])
+        tenant_width = max([len("Tenant")] + [len(result["tenant"]) for result in results])
+        host_width = max([len("API host")] + [len(result["host"]) for result in results])
+        print(f"\n{'Tenant':<{tenant_width}}  {'API host':<{host_width}}  {'OK':>4}  {'Fail':>4}  {'Skip':>4}  {'Time':>7}  Status")
+        print(f"{'-' * tenant_width}  {'-' * host_width}  ----  ----  ----  -------  ------")
+        for result in results:
+            tasks = result["tasks"]
+            print(f"{result['tenant']:<{tenant_width}}  {result['host']:<{host_width}}  {tasks['succeeded']:>4}  {tasks['failed']:>4}  "
+                  f"{tasks['skipped']:>4}  {result['elapsed']:>6.1f}s  {result['status']}")
+        succeeded = sum(1 for result in results if result["status"] == "succeeded")
+        print(f"{succeeded} of {len(results)} tenants provisioned in {elapsed:.1f}s")
+        logger.info(f"{succeeded} of {len(results)} tenants provisioned in {elapsed:.1f}s")
+        for result in results:
+            if result["status"] != "succeeded":
+                logger.error(f"Tenant {result['tenant']} ({result['host']}): {result['status']}")
+
+def parse_option(args, name, default):
+    if name in args:
+        position = args.index(name)
+        value = int(args[position + 1])
+        del args[position:position + 2]
+        return value
+    return default
+
+if __name__ == "__main__":
+    start_profiling("tenant_runner")
+    print("Starting multi-tenant provisioning")
+    logger.info("Starting multi-tenant provisioning")
+    args = sys.argv[1:]
+    try:
+        max_tenants = parse_option(args, "--tenants", DEFAULT_TENANT_WORKERS)
+        image_processes = parse_option(args, "--image-processes", DEFAULT_IMAGE_PROCESSES)
+        per_host_limit = parse_option(args, "--per-host", DEFAULT_PER_HOST_LIMIT)
+        metrics_port = parse_option(args, "--metrics-port", int(os.getenv("NS_METRICS_PORT", "0")))
+        use_async = "--async" in args or DEFAULT_ASYNC
+        args = [arg for arg in args if arg != "--async"]
+        if not args:
+            raise ValueError("no manifest files given")
+        manifests = [manifest for path in args for manifest in load_manifests(path)]
+    except (ValueError, IndexError) as e:
+        print(f"Error: {e}")
+        print("Usage: python tenant_runner.py <tenants.json> [more.json ...] [--tenants N] [--image-processes N] [--per-host N] [--metrics-port N] [--async]")
+        sys.exit(1)
+
+    if metrics_port:
+        # Long batches can be scraped while they run
+        start_metrics_server(metrics_port)
+    runner = TenantRunner(max_tenants, image_processes, per_host_limit)
+    results = runner.run_async(manifests) if use_async else runner.run(manifests)
+    report_all()
+    print("Multi-tenant provisioning completed")
+    logger.info("Multi-tenant provisioning completed")
+    sys.exit(0 if all(result["status"] == "succeeded" for result in results) else 1)
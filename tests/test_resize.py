@@ -0,0 +1,27 @@
+from io import BytesIO
+from PIL import Image
+from resize import VARIANT_SIZES, variant_name, variants_from_bytes
+
+def encoded(image, format):
+    buffer = BytesIO()
+    image.save(buffer, format=format)
+    return buffer.getvalue()
+
+def assert_variants(variants):
+    assert variants is not None
+    for size in VARIANT_SIZES:
+        with Image.open(BytesIO(variants[variant_name(size)])) as variant:
+            assert variant.size == size
+            assert variant.mode in ("RGB", "L")
+
+def test_large_palette_png():
+    source = Image.new("RGB", (2400, 2400), (200, 30, 30)).convert("P", palette=Image.Palette.ADAPTIVE)
+    assert_variants(variants_from_bytes(encoded(source, "PNG")))
+
+def test_large_transparent_palette_gif():
+    source = Image.new("P", (2400, 2400), 1)
+    source.info["transparency"] = 0
+    assert_variants(variants_from_bytes(encoded(source, "GIF")))
+
+def test_large_one_bit_png():
+    assert_variants(variants_from_bytes(encoded(Image.new("1", (2400, 2400), 1), "PNG")))
@@ -0,0 +1,90 @@
+import asyncio
+import pytest
+from pipeline import Pipeline
+from journal import RunJournal
+from task_graph import TaskGraph, graph_succeeded
+
+@pytest.mark.parametrize("parent_result", [400, 500, None, False])
+def test_failed_status_skips_dependents(parent_result):
+    calls = []
+    graph = TaskGraph("test")
+    graph.add("domain", lambda: parent_result)
+    graph.add("user", lambda: calls.append("user") or 201, deps=["domain"])
+    graph.add("device", lambda: calls.append("device") or 201, deps=["user"])
+    tasks = graph.run(max_workers=2)
+    assert tasks["domain"].status == "failed"
+    assert tasks["user"].status == "skipped"
+    assert tasks["device"].status == "skipped"
+    assert calls == []
+
+@pytest.mark.parametrize("parent_result", [200, 201, 202, 409])
+def test_success_and_existing_release_dependents(parent_result):
+    graph = TaskGraph("test")
+    graph.add("domain", lambda: parent_result)
+    graph.add("user", lambda: 201, deps=["domain"])
+    tasks = graph.run(max_workers=2)
+    assert tasks["domain"].status == "succeeded"
+    assert tasks["user"].status == "succeeded"
+
+def test_unchecked_task_may_return_none():
+    graph = TaskGraph("test")
+    graph.add("index", lambda: None, succeeded=None)
+    graph.add("domain", lambda: 201, deps=["index"])
+    assert graph.run(max_workers=2)["domain"].status == "succeeded"
+
+def test_failed_status_skips_dependents_async():
+    async def parent():
+        return 400
+
+    async def child():
+        return 201
+
+    graph = TaskGraph("test")
+    graph.add("domain", parent)
+    graph.add("user", child, deps=["domain"])
+    tasks = asyncio.run(graph.run_async())
+    assert tasks["domain"].status == "failed"
+    assert tasks["user"].status == "skipped"
+
+def test_pipeline_failed_status_skips_dependents():
+    calls = []
+    pipeline = Pipeline(max_workers=2)
+    domain = pipeline.submit("domain", lambda: None, journaled=False)
+    pipeline.submit("user", lambda: calls.append("user") or 201, deps=[domain], journaled=False)
+    steps = pipeline.wait()
+    assert steps["domain"].status == "failed"
+    assert steps["user"].status == "skipped"
+    assert calls == []
+
+def test_resume_retries_failed_steps_of_a_nested_graph(tmp_path):
+    statuses = {"user": 500}
+    calls = []
+
+    def create_user():
+        calls.append("user")
+        return statuses["user"]
+
+    def nested(journal):
+        inner = TaskGraph("inner")
+        inner.add("domain", lambda: 201)
+        inner.add("user", create_user, deps=["domain"])
+        inner.run(max_workers=2, journal=journal)
+        return inner
+
+    def run_once():
+        journal = RunJournal(str(tmp_path / "journal.jsonl"))
+        graph = TaskGraph("outer")
+        graph.add("training-domains", nested, journal, succeeded=graph_succeeded, journaled=False)
+        tasks = graph.run(max_workers=2, journal=journal)
+        return tasks, journal.finish()
+
+    tasks, archived = run_once()
+    assert tasks["training-domains"].status == "failed"
+    assert not archived
+
+    statuses["user"] = 201
+    tasks, archived = run_once()
+    assert tasks["training-domains"].status == "succeeded"
+    assert tasks["training-domains"].result.tasks["domain"].status == "resumed"
+    assert calls == ["user", "user"]
+    assert archived
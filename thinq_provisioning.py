@@ -1,11 +1,11 @@
 import requests
 import base64
-import logging
 from typing import Dict, List, Optional
+from logging_setup import setup_logging
+from profiling import start_profiling
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+# Initialize logger
+logger = setup_logging(__name__)
 
 class ThinQAPI:
     
@@ -181,6 +181,7 @@ class ThinQAPI:
 
 # Example usage
 if __name__ == "__main__":
+    start_profiling("thinq_provisioning")
     thinq = ThinQAPI(
         username="sgill",
         api_token="555982ee38ec117ae5e3c85f6bf9b16a36b380b6",
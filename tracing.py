@@ -0,0 +1,192 @@
+import atexit
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+from logging_setup import setup_logging
+
+# Initialize logger
+logger = setup_logging(__name__)
+
+TRACE_ENABLED = os.getenv("NS_TRACE", "0") == "1"
+DEFAULT_TRACE_FILE = os.getenv("NS_TRACE_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "trace.json"))
+
+# The span code running in this thread (or task) belongs to
+_current_span: contextvars.ContextVar = contextvars.ContextVar("ns_current_span", default=None)
+
+class Span:
+    """One timed phase, object or HTTP call; parent_id links it to the span it ran under."""
+
+    __slots__ = ("id", "parent_id", "name", "category", "args", "start", "end", "thread_id", "thread_name")
+
+    def __init__(self, span_id: int, parent_id: Optional[int], name: str, category: str, args: dict):
+        self.id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        thread = threading.current_thread()
+        self.thread_id = thread.ident
+        self.thread_name = thread.name
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+class Tracer:
+    """Collects nested spans for a run and exports them as Chrome trace-event JSON.
+
+    Spans are "phase" (eval-main steps, task graphs, tenants), "object" (one
+    reseller, domain, user, ...) or "http" (one API request). The parent of a
+    span is whatever span was current where it started; work handed to a
+    thread pool through propagate() keeps its parent, so concurrent tasks show
+    up as overlapping children of the same phase.
+    """
+
+    def __init__(self, enabled: bool = TRACE_ENABLED):
+        self.enabled = enabled
+        self.spans: List[Span] = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self._export_registered = False
+        # Called as hook(name, "start" | "end") at phase boundaries, even with tracing off
+        self.phase_hooks: List[Callable[[str, str], None]] = []
+
+    @contextmanager
+    def span(self, name: str, category: str = "phase", **args):
+        """Time the enclosed block as a child of the current span; yields the Span (None when tracing is off)."""
+        if not self.enabled:
+            if category == "phase" and self.phase_hooks:
+                self._run_phase_hooks(name, "start")
+                try:
+                    yield None
+                finally:
+                    self._run_phase_hooks(name, "end")
+            else:
+                yield None
+            return
+        if category == "phase":
+            self._run_phase_hooks(name, "start")
+        parent = _current_span.get()
+        span = Span(next(self._ids), parent.id if parent else None, name, category, args)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.args["error"] = f"{e.__class__.__name__}: {e}"
+            raise
+        finally:
+            span.end = time.perf_counter()
+            _current_span.reset(token)
+            with self._lock:
+                self.spans.append(span)
+            self._register_export()
+            if category == "phase":
+                self._run_phase_hooks(name, "end")
+
+    def _run_phase_hooks(self, name: str, boundary: str) -> None:
+        for hook in self.phase_hooks:
+            hook(name, boundary)
+
+    def _register_export(self) -> None:
+        # Export once at exit, as soon as the run has recorded a span
+        if self._export_registered:
+            return
+        with self._lock:
+            if not self._export_registered:
+                atexit.register(self.export_at_exit)
+                self._export_registered = True
+
+    def to_chrome_trace(self) -> dict:
+        """Return the spans as a trace-event document (chrome://tracing, Perfetto, speedscope)."""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        pid = os.getpid()
+        # Small stable thread numbers read better in a trace viewer than thread idents
+        thread_numbers: Dict[int, int] = {}
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": "NS-Blueprint"}}]
+        for span in spans:
+            if span.thread_id not in thread_numbers:
+                thread_numbers[span.thread_id] = len(thread_numbers) + 1
+                events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": thread_numbers[span.thread_id],
+                               "args": {"name": span.thread_name}})
+            events.append({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": round((span.start - self.started) * 1_000_000, 1),
+                "dur": round(span.duration * 1_000_000, 1),
+                "pid": pid,
+                "tid": thread_numbers[span.thread_id],
+                "args": dict(span.args, id=span.id, parent=span.parent_id)
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export(self, path: str = DEFAULT_TRACE_FILE) -> Optional[str]:
+        """Write the trace-event JSON for this run; returns the path, or None with no spans."""
+        if not self.spans:
+            return None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as trace_file:
+            json.dump(self.to_chrome_trace(), trace_file)
+        logger.info(f"Wrote trace with {len(self.spans)} spans to {path}")
+        return path
+
+    def report_lines(self, max_depth: int = 3) -> List[str]:
+        """Indented phase/object timeline; HTTP calls are folded into a count per parent."""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        if not spans:
+            return []
+        children: Dict[Optional[int], List[Span]] = {}
+        for span in spans:
+            children.setdefault(span.parent_id, []).append(span)
+        run_start = spans[0].start
+        lines = []
+
+        def walk(parent_id, depth):
+            nested = children.get(parent_id, [])
+            http = [span for span in nested if span.category == "http"]
+            for span in nested:
+                if span.category == "http":
+                    continue
+                lines.append(f"  +{span.start - run_start:7.2f}s  {span.duration:7.2f}s  {'  ' * depth}{span.name}")
+                if depth + 1 < max_depth:
+                    walk(span.id, depth + 1)
+            if http and parent_id is not None:
+                busy = sum(span.duration for span in http)
+                lines.append(f"  {'':>9}  {busy:7.2f}s  {'  ' * depth}({len(http)} HTTP calls)")
+
+        walk(None, 0)
+        return lines
+
+    def print_report(self) -> None:
+        lines = self.report_lines()
+        if not lines:
+            return
+        print("\n=== Run timeline (start offset, duration, span) ===")
+        print("\n".join(lines))
+        logger.info("=== Run timeline (start offset, duration, span) ===\n" + "\n".join(lines))
+
+    def export_at_exit(self) -> None:
+        self.print_report()
+        path = self.export()
+        if path:
+            print(f"Trace written to {path} (open in chrome://tracing or https://ui.perfetto.dev)")
+
+tracer = Tracer()
+span = tracer.span
+
+def propagate(func: Callable) -> Callable:
+    """Bind func to the caller's current span so work submitted to a pool nests under it; wrap once per submit."""
+    if not tracer.enabled:
+        return func
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(func, *args, **kwargs)
@@ -1,19 +1,23 @@
 import json
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
 import re
-from dotenv import load_dotenv
-import logging
-from logging_setup import setup_logging
+from settings import load_env
+from logging_setup import setup_logging, LazyJSON, LazyText
+from ns_client import get_client
+from tracing import propagate
+from profiling import start_profiling
 
-logger = setup_logging()
-logger.setLevel(logging.DEBUG)
-load_dotenv()
+logger = setup_logging(__name__)
+load_env()
 API_TOKEN = os.getenv("API_TOKEN")
 if not API_TOKEN:
     raise ValueError("Missing API token. Set NETSAPIENS_API_TOKEN as an environment variable.")
 logger.info(f"Loaded API_TOKEN: {API_TOKEN}")
 
+DEFAULT_CONFIG_WORKERS = int(os.getenv("NS_CONFIG_WORKERS", "8"))
+
 SCOPE_MAPPING = {
     "su": "Super User",
     "res": "Reseller",
@@ -68,7 +72,6 @@ common_payload = {
 
 headers = {
     "accept": "application/json",
-    "authorization": f"Bearer {API_TOKEN}",
     "content-type": "application/json"
 }
 
@@ -80,7 +83,7 @@ def load_configurations(filename, customer_name=None):
             if isinstance(config.get("config_value"), str):
                 config["config_value"] = config["config_value"].replace("custID", customer_name)
     logger.info(f"Loaded configurations from {filename}" + (f" with customer_name: {customer_name}" if customer_name else ""))
-    logger.debug(f"Configurations: {json.dumps(configs, indent=2)}")
+    logger.debug("Configurations: %s", LazyJSON(configs))
     return configs
 
 def prompt_for_color(config_name, current_value, default_value):
@@ -121,7 +124,7 @@ def prompt_for_string(config_name, current_value):
     logger.info(f"Accepted string value '{new_value}' for {config_name}")
     return new_value
 
-def send_configuration(config, api_url, scope=None):
+def configuration_payload(config, scope=None):
     payload = common_payload.copy()
     payload["config-name"] = config["config_name"]
     payload["config-value"] = config["config_value"]
@@ -131,59 +134,180 @@ def send_configuration(config, api_url, scope=None):
     
     if "reseller" in config:
         payload["reseller"] = config["reseller"]
+    return payload
+
+def configuration_request(config, api_url, scope=None, index=None):
+    """Log and return (url, headers, payload, method) for sending a configuration.
+
+    method is "POST", "PUT" when the index knows it exists with another value,
+    or None when the index already has it with this value.
+    """
+    payload = configuration_payload(config, scope)
     
     url = f"{api_url}/ns-api/v2/configurations"
     logger.info(f"Sending configuration {config['config_name']} (Scope: {scope if scope else 'Default'}, Reseller: {payload['reseller']}) to {url}")
-    logger.debug(f"Payload: {json.dumps(payload, indent=2)}")
+    logger.debug("Payload: %s", LazyJSON(payload))
     
-    response = requests.post(url, headers=headers, json=payload)
-    print(f"POST status code for {config['config_name']} (Scope: {scope if scope else 'Default'}, Reseller: {payload['reseller']}): {response.status_code}")
-    logger.info(f"POST status code for {config['config_name']} (Scope: {scope if scope else 'Default'}, Reseller: {payload['reseller']}): {response.status_code}")
-    logger.debug(f"Response text: {response.text}")
-    
-    if response.status_code == 409:
+    if index:
+        state = index.config_state(payload)
+        if state == "same":
+            print(f"Configuration {config['config_name']} (Scope: {scope if scope else 'Default'}, Reseller: {payload['reseller']}) already up to date, skipping")
+            logger.info(f"Configuration {config['config_name']} (Scope: {scope if scope else 'Default'}, Reseller: {payload['reseller']}) already up to date in existence index, skipping")
+            return url, headers, payload, None
+        if state == "different":
+            # Known to exist with another value: update it without the POST/409 round trip
+            return url, headers, payload, "PUT"
+    return url, headers, payload, "POST"
+
+def configuration_sent(response, method, config, payload, index=None):
+    """Report a POST or PUT response; returns "PUT" when a POST conflicted and has to be retried as one."""
+    print(f"{method} status code for {config['config_name']} (Scope: {payload.get('user-scope', 'Default')}, Reseller: {payload['reseller']}): {response.status_code}")
+    logger.info(f"{method} status code for {config['config_name']} (Scope: {payload.get('user-scope', 'Default')}, Reseller: {payload['reseller']}): {response.status_code}")
+    logger.debug("Response text: %s", LazyText(response))
+    if method == "POST" and response.status_code == 409:
         logger.info(f"Conflict detected for {config['config_name']}, attempting PUT request")
-        response = requests.put(url, headers=headers, json=payload)
-        print(f"PUT status code for {config['config_name']} (Scope: {scope if scope else 'Default'}, Reseller: {payload['reseller']}): {response.status_code}")
-        logger.info(f"PUT status code for {config['config_name']} (Scope: {scope if scope else 'Default'}, Reseller: {payload['reseller']}): {response.status_code}")
-        logger.debug(f"PUT Response text: {response.text}")
-    
+        return "PUT"
+    if index and response.status_code in (200, 201, 202):
+        index.add_configuration(payload)
+    return None
+
+def send_configuration(config, api_url, scope=None, client=None, index=None):
+    client = client or get_client(api_url)
+    url, headers, payload, method = configuration_request(config, api_url, scope, index)
+    if method is None:
+        return 200
+    if method == "POST":
+        response = client.post(url, headers=headers, json=payload, conflict_safe=True)
+        method = configuration_sent(response, method, config, payload, index)
+    if method == "PUT":
+        response = client.put(url, headers=headers, json=payload)
+        configuration_sent(response, method, config, payload, index)
     return response.status_code
 
-def update_configurations(customer_name=None, config_file="ui-configs.json", api_url=None):
+def prompt_for_config(config):
+    config_name = config["config_name"]
+    current_value = config["config_value"]
+    if "reseller" not in config:
+        if config_name in UI_CONFIG_PROMPT_COLOR_HEX:
+            config["config_value"] = prompt_for_color(config_name, current_value, UI_CONFIG_PROMPT_COLOR_HEX[config_name])
+        elif config_name in YES_NO_CONFIGS:
+            config["config_value"] = prompt_for_yes_no(config_name, current_value)
+        elif config_name in NUMERIC_CONFIGS:
+            config["config_value"] = prompt_for_numeric(config_name, current_value)
+        elif config_name in STRING_CONFIGS:
+            config["config_value"] = prompt_for_string(config_name, current_value)
+    return config
+
+def validate_config_value(config_name, value):
+    """Check a non-interactive value against the same rules the prompts enforce."""
+    value = str(value).strip()
+    if config_name in UI_CONFIG_PROMPT_COLOR_HEX:
+        if not re.fullmatch(r"^#([A-Fa-f0-9]{6})$", value):
+            raise ValueError(f"{config_name} must be a hex color code (e.g., #123abc), got '{value}'")
+    elif config_name in YES_NO_CONFIGS:
+        if value.lower() not in ["y", "yes", "n", "no"]:
+            raise ValueError(f"{config_name} must be 'yes' or 'no', got '{value}'")
+        value = "yes" if value.lower() in ["y", "yes"] else "no"
+    elif config_name in NUMERIC_CONFIGS:
+        if not value.isdigit() or not 0 <= int(value) <= 9:
+            raise ValueError(f"{config_name} must be a number between 0 and 9, got '{value}'")
+    return value
+
+def apply_overrides(configs, overrides):
+    known = {config["config_name"] for config in configs}
+    unknown = sorted(set(overrides) - known)
+    if unknown:
+        raise ValueError(f"Unknown configurations in overrides: {', '.join(unknown)}")
+    for config in configs:
+        if config["config_name"] in overrides:
+            config["config_value"] = validate_config_value(config["config_name"], overrides[config["config_name"]])
+            logger.info(f"Using override value '{config['config_value']}' for {config['config_name']}")
+    return configs
+
+def config_scopes(config):
+    scopes = config.get("scopes", []) if "scopes" in config else config.get("scope", [])
+    if isinstance(scopes, str):
+        scopes = [scope.strip() for scope in scopes.split(",")]
+    return [SCOPE_MAPPING.get(scope, scope) for scope in scopes] or [None]
+
+def push_configurations(configs, api_url, client, max_workers=DEFAULT_CONFIG_WORKERS, index=None):
+    # Every (config, scope) pair is an independent POST (+ PUT on 409), so fan them out
+    jobs = [(config, scope) for config in configs for scope in config_scopes(config)]
+    print(f"Pushing {len(jobs)} configurations with {max_workers} workers")
+    logger.info(f"Pushing {len(jobs)} configurations to {api_url} with {max_workers} workers (per-host limit: {client.max_in_flight})")
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(propagate(send_configuration), config, api_url, scope, client=client, index=index): (config, scope) for config, scope in jobs}
+        for future in as_completed(futures):
+            config, scope = futures[future]
+            try:
+                status = future.result()
+            except requests.exceptions.RequestException as e:
+                status = e
+            results.append(configuration_result(config, scope, status))
+
+    results.sort(key=lambda result: (result["config_name"], result["scope"], result["reseller"]))
+    print_status_table(results)
+    return results
+
+def configuration_result(config, scope, status):
+    """One row of the status table; status is a status code or the exception the send raised."""
+    if isinstance(status, Exception):
+        logger.error(f"Error sending configuration {config['config_name']} (Scope: {scope if scope else 'Default'}): {status}")
+        status = f"error: {status}"
+    return {
+        "config_name": config["config_name"],
+        "scope": scope if scope else "Default",
+        "reseller": config.get("reseller", "*"),
+        "status": status
+    }
+
+def print_status_table(results):
+    name_width = max([len("Config")] + [len(result["config_name"]) for result in results])
+    scope_width = max([len("Scope")] + [len(result["scope"]) for result in results])
+    reseller_width = max([len("Reseller")] + [len(result["reseller"]) for result in results])
+    print(f"\n{'Config':<{name_width}}  {'Scope':<{scope_width}}  {'Reseller':<{reseller_width}}  Status")
+    print(f"{'-' * name_width}  {'-' * scope_width}  {'-' * reseller_width}  ------")
+    for result in results:
+        print(f"{result['config_name']:<{name_width}}  {result['scope']:<{scope_width}}  {result['reseller']:<{reseller_width}}  {result['status']}")
+    failed = [result for result in results if result["status"] not in (200, 201, 202)]
+    print(f"{len(results) - len(failed)} of {len(results)} configurations applied")
+    logger.info(f"{len(results) - len(failed)} of {len(results)} configurations applied")
+    for result in failed:
+        logger.error(f"Configuration {result['config_name']} (Scope: {result['scope']}, Reseller: {result['reseller']}) failed: {result['status']}")
+
+def update_configurations(customer_name=None, config_file="ui-configs.json", api_url=None, client=None,
+                          concurrent=False, max_workers=DEFAULT_CONFIG_WORKERS, per_host_limit=None, index=None,
+                          interactive=True, overrides=None):
     if not api_url:
         raise ValueError("API URL must be provided")
+    client = client or get_client(api_url)
+    if per_host_limit:
+        client.set_max_in_flight(per_host_limit)
     
     print(f"Using API URL: {api_url}")
     logger.info(f"Using API URL: {api_url}")
 
     configs = load_configurations(config_file, customer_name)
+    if overrides:
+        apply_overrides(configs, overrides)
+    if not interactive:
+        # Values come from the config file and overrides only, so nothing waits on the SE
+        return push_configurations(configs, api_url, client, max_workers, index=index)
+    if concurrent:
+        # Collect every interactive answer first, then push everything at once
+        for config in configs:
+            prompt_for_config(config)
+        return push_configurations(configs, api_url, client, max_workers, index=index)
+
     for config in configs:
-        config_name = config["config_name"]
-        current_value = config["config_value"]
-        
-        if "reseller" not in config:
-            if config_name in UI_CONFIG_PROMPT_COLOR_HEX:
-                config["config_value"] = prompt_for_color(config_name, current_value, UI_CONFIG_PROMPT_COLOR_HEX[config_name])
-            elif config_name in YES_NO_CONFIGS:
-                config["config_value"] = prompt_for_yes_no(config_name, current_value)
-            elif config_name in NUMERIC_CONFIGS:
-                config["config_value"] = prompt_for_numeric(config_name, current_value)
-            elif config_name in STRING_CONFIGS:
-                config["config_value"] = prompt_for_string(config_name, current_value)
-        
-        scopes = config.get("scopes", []) if "scopes" in config else config.get("scope", [])
-        if isinstance(scopes, str):
-            scopes = [scope.strip() for scope in scopes.split(",")]
-        
-        if scopes:
-            for scope in scopes:
-                full_scope_name = SCOPE_MAPPING.get(scope, scope)
-                send_configuration(config, api_url, full_scope_name)
-        else:
-            send_configuration(config, api_url)
+        prompt_for_config(config)
+        for scope in config_scopes(config):
+            send_configuration(config, api_url, scope, client=client, index=index)
 
 if __name__ == "__main__":
+    start_profiling("ui_configs")
     import sys
     print("Starting UI configurations update script (standalone mode)")
     logger.info("Starting UI configurations update script (standalone mode)")
@@ -194,10 +318,14 @@ if __name__ == "__main__":
         logger.error(f"Invalid API URL provided: {api_url}")
         sys.exit(1)
     
-    config_file = sys.argv[1] if len(sys.argv) > 1 else "ui-configs.json"
+    args = [arg for arg in sys.argv[1:] if arg != "--concurrent"]
+    concurrent = "--concurrent" in sys.argv[1:]
+    config_file = args[0] if args else "ui-configs.json"
     
     try:
-        update_configurations(config_file=config_file, api_url=api_url)
+        client = get_client(api_url)
+        update_configurations(config_file=config_file, api_url=api_url, client=client, concurrent=concurrent)
+        client.report()
         print("UI configurations update script completed")
         logger.info("UI configurations update script completed")
     except Exception as e: